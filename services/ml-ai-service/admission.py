@@ -0,0 +1,147 @@
+"""
+Допуск сообщений пользователя (POST /messages).
+
+Каждое сообщение — это ожидание lock'а сессии и по LLM-запросу на каждого
+агента-адресата, поэтому клиент, шлющий сообщения в цикле, отнимает LLM
+у всех остальных. Перед тем как принять сообщение, AdmissionController
+проверяет по порядку:
+  1. перегрузку LLM: запрос пользователя уже ждёт слот дольше
+     LLM_SHED_QUEUE_SECONDS — 503 (новые сообщения только удлинят очередь);
+  2. очередь сессии: в работе уже USER_MAX_PENDING_MESSAGES сообщений — 429;
+  3. ведро токенов пользователя: сообщение стоит по токену на агента-адресата,
+     ведро пополняется на USER_MESSAGE_RATE в секунду до USER_MESSAGE_BURST — 429.
+Отказ несёт Retry-After. Принятое сообщение занимает место в очереди сессии
+до release(); пока место занято, фоновая симуляция уступает сессию.
+Нулевой лимит в config отключает соответствующую проверку.
+"""
+
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from config import (
+    USER_MESSAGE_RATE, USER_MESSAGE_BURST, USER_MAX_PENDING_MESSAGES, LLM_SHED_QUEUE_SECONDS,
+    ADMISSION_RETRY_AFTER,
+)
+from llm_client import _llm_slots
+
+# Причины отказа
+REJECT_OVERLOADED = "overloaded"
+REJECT_PENDING = "pending"
+REJECT_RATE = "rate"
+
+_PRUNE_BUCKETS_AT = 1024  # с этого размера вёдра простаивающих пользователей выбрасываются
+
+
+@dataclass
+class Rejection:
+    """Отказ в приёме сообщения."""
+    status: int  # 429 или 503
+    reason: str
+    detail: str
+    retry_after: int  # секунд
+
+
+class TokenBucket:
+    """Ведро токенов: rate в секунду, не больше burst."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, cost: float, now: float) -> float:
+        """Списать cost токенов. 0 — списано, иначе через сколько секунд их хватит."""
+        self._refill(now)
+        cost = min(cost, self.burst)  # сообщение «всем» при большом составе всё же проходит
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class AdmissionController:
+    """Лимиты на сообщения пользователей. Потокобезопасный."""
+
+    def __init__(self, rate: float = USER_MESSAGE_RATE, burst: float = USER_MESSAGE_BURST,
+                 max_pending: int = USER_MAX_PENDING_MESSAGES, shed_after: float = LLM_SHED_QUEUE_SECONDS):
+        self.rate = rate
+        self.burst = burst
+        self.max_pending = max_pending
+        self.shed_after = shed_after
+        self._buckets: dict[str, TokenBucket] = {}
+        self._pending: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.rejected: dict[str, int] = {REJECT_OVERLOADED: 0, REJECT_PENDING: 0, REJECT_RATE: 0}
+
+    def admit(self, user_id: str, cost: int) -> Optional[Rejection]:
+        """
+        Принять сообщение (cost — число агентов-адресатов) или отказать.
+
+        None — принято: место в очереди сессии занято до release(user_id).
+        """
+        if self.shed_after > 0:
+            queue_age = _llm_slots.user_queue_age()
+            if queue_age > self.shed_after:
+                return self._reject(503, REJECT_OVERLOADED,
+                                    f"LLM перегружена: ответы ждут очереди {queue_age:.0f} с", queue_age)
+
+        now = time.monotonic()
+        with self._lock:
+            if 0 < self.max_pending <= self._pending.get(user_id, 0):
+                return self._reject(429, REJECT_PENDING,
+                                    f"В работе уже {self.max_pending} сообщений этой сессии",
+                                    ADMISSION_RETRY_AFTER)
+            if self.rate > 0:
+                bucket = self._buckets.get(user_id)
+                if bucket is None:
+                    if len(self._buckets) >= _PRUNE_BUCKETS_AT:
+                        self._prune(now)
+                    bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+                wait = bucket.take(cost, now)
+                if wait:
+                    return self._reject(429, REJECT_RATE, "Слишком много сообщений, подождите", wait)
+            self._pending[user_id] = self._pending.get(user_id, 0) + 1
+        return None
+
+    def release(self, user_id: str):
+        """Сообщение обработано (или не будет обработано) — освободить место в очереди сессии."""
+        with self._lock:
+            count = self._pending.get(user_id, 0) - 1
+            if count > 0:
+                self._pending[user_id] = count
+            else:
+                self._pending.pop(user_id, None)
+
+    def pending(self, user_id: str) -> int:
+        return self._pending.get(user_id, 0)
+
+    @property
+    def total_pending(self) -> int:
+        with self._lock:
+            return sum(self._pending.values())
+
+    def _reject(self, status: int, reason: str, detail: str, retry_after: float) -> Rejection:
+        self.rejected[reason] += 1
+        return Rejection(status=status, reason=reason, detail=detail,
+                         retry_after=max(1, math.ceil(retry_after)))
+
+    def _prune(self, now: float):
+        """Выбросить полные вёдра пользователей без сообщений в работе — они равны новым."""
+        for user_id in [u for u, b in self._buckets.items() if u not in self._pending and b.is_full(now)]:
+            del self._buckets[user_id]
+
+
+# Глобальный экземпляр
+admission = AdmissionController()
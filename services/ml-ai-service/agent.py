@@ -37,6 +37,8 @@ class Agent:
     color: str = Fore.WHITE
     user_id: str = ""  # ID пользователя для изоляции данных
     _registry: object = field(default=None, repr=False)  # AgentRegistry сессии
+    _text_pool: object = field(default=None, repr=False)  # TextPool сессии
+    _load_memory: bool = field(default=True, repr=False)  # False — память заполнит restore()
 
     talkativeness: float = field(init=False)
     base_talkativeness: float = field(init=False)
@@ -60,10 +62,12 @@ class Agent:
     reacted_to_event: bool = False
 
     mood: AgentMood = field(init=False)
+    _persona_cache: dict = field(default_factory=dict, repr=False)  # (mode, имя) → текст
 
     def __post_init__(self):
         self.memory_system = AgentMemorySystem(
-            self.agent_id, user_id=self.user_id, registry=self._registry
+            self.agent_id, user_id=self.user_id, registry=self._registry,
+            text_pool=self._text_pool, load=self._load_memory,
         )
         self.race: Race = RACES[self.race_type]
         self._apply_race_modifiers_to_big_five()
@@ -129,6 +133,48 @@ class Agent:
             parts.append(f"{display_name}:{value:+.1f}{emoji}")
         return ", ".join(parts)
 
+    def _persona_segment(self, mode: str) -> str:
+        """Неизменная часть system prompt: личность, раса, стиль речи, правила.
+
+        Стоит в начале промпта и кэшируется, пока не сменится имя агента, — так
+        llama.cpp / LM Studio переиспользуют KV-кэш префикса между запросами.
+        """
+        is_new_topic = mode == "new_topic"
+        key = (is_new_topic, self.display_name)
+        cached = self._persona_cache.get(key)
+        if cached is not None:
+            return cached
+
+        segment = (
+            f"{self.personality_description}\n"
+            f"{self._get_race_prompt()}"
+        )
+        segment += self._get_speech_style()
+
+        if is_new_topic:
+            segment += (
+                "\n═══ ЗАДАЧА: ПРЕДЛОЖИТЬ НОВУЮ ТЕМУ ═══\n"
+                "- Предложи КОНКРЕТНУЮ тему (1 предложение)\n"
+                "- Тема ПРАКТИЧЕСКАЯ, связана с ситуацией\n"
+                "- Говори от первого лица\n"
+                "- ТОЛЬКО русский язык, БЕЗ тегов\n"
+            )
+        else:
+            segment += (
+                f"\nТы — {self.display_name}. Говори ТОЛЬКО от себя, 1-2 предложения.\n"
+                "ПРАВИЛА: отвечай конкретно на последнюю реплику, называй собеседников по имени.\n"
+                "ГОВОРИ только словами. НЕ описывай свои физические действия.\n"
+                "  НЕЛЬЗЯ: 'Я подхожу к столу', 'Я оборачиваюсь', 'Я обращаюсь к...'\n"
+                "  МОЖНО: 'Может стоит поесть', 'Что там за шум?', 'Нужно усилить защиту'\n"
+                "ЗАПРЕЩЕНО: писать за других, теги, английский, обращаться к себе по имени, обращаться к 'Ведущему'.\n"
+                "Не причиняй вред себе/другим. Не повторяй сказанное. Русский язык.\n"
+            )
+
+        # Старые имена больше не понадобятся — не копим записи после переименований
+        self._persona_cache = {k: v for k, v in self._persona_cache.items() if k[1] == key[1]}
+        self._persona_cache[key] = segment
+        return segment
+
     def system_prompt(self, long_term_context: str = "", mode: str = "normal",
                       scenario_context: str = "", recent_own_messages: list = None,
                       recent_dialogue_context: str = "",
@@ -136,22 +182,22 @@ class Agent:
                       pending_questions: str = "",
                       phase_instruction: str = "",
                       force_event_reaction: bool = False) -> str:
+        """
+        Собрать system prompt из сегментов в порядке убывания стабильности:
+        персона (не меняется) → сценарий (меняется редко) → состояние (каждый тик).
+        Чем длиннее общий префикс соседних запросов, тем больше KV-кэша переиспользует бэкенд.
+        """
+        base_prompt = self._persona_segment(mode)
 
+        if scenario_context:
+            base_prompt += f"\n{scenario_context}\n"
+
+        # ── Дальше — быстро меняющееся состояние ──
         rel_info = self.get_relationship_description()
         mood_info = self.mood.to_description()
 
-        mood_numbers = (
-            f"  Счастье: {self.mood.happiness:+.1f} | "
-            f"Злость: {self.mood.anger:.1f} | "
-            f"Страх: {self.mood.fear:.1f} | "
-            f"Стресс: {self.mood.stress:.1f} | "
-            f"Энергия: {self.mood.energy:.1f}"
-        )
-
-        base_prompt = (
-            f"{self.personality_description}\n"
-            f"{self._get_race_prompt()}"
-            f"Отношения: {rel_info}\n"
+        base_prompt += (
+            f"\nОтношения: {rel_info}\n"
             f"Настроение: {mood_info}\n\n"
         )
 
@@ -178,6 +224,14 @@ class Agent:
                 f"НЕ переключайся на другие темы пока событие активно!\n\n"
             )
 
+        # Решения группы — напоминание о принятых решениях
+        decisions_context = self.memory_system.get_group_decisions_text()
+        if decisions_context:
+            base_prompt += f"\n{decisions_context}\n"
+
+        if long_term_context:
+            base_prompt += f"\n{long_term_context}\n"
+
         if recent_dialogue_context:
             base_prompt += f"\n{recent_dialogue_context}\n"
 
@@ -200,43 +254,11 @@ class Agent:
                 base_prompt += "; ".join(msg[:50] for msg in recent_own_messages[-3:])
                 base_prompt += "\n"
 
-        # Решения группы — напоминание о принятых решениях
-        decisions_context = self.memory_system.get_group_decisions_text()
-        if decisions_context:
-            base_prompt += f"\n{decisions_context}\n"
-
-        if scenario_context:
-            base_prompt += f"\n{scenario_context}\n"
-
-        if long_term_context:
-            base_prompt += f"\n{long_term_context}\n"
-
-        speech_style = self._get_speech_style()
-        base_prompt += speech_style
-
-        if mode == "new_topic":
-            base_prompt += (
-                "\n═══ ЗАДАЧА: ПРЕДЛОЖИТЬ НОВУЮ ТЕМУ ═══\n"
-                "- Предложи КОНКРЕТНУЮ тему (1 предложение)\n"
-                "- Тема ПРАКТИЧЕСКАЯ, связана с ситуацией\n"
-                "- Говори от первого лица\n"
-                "- ТОЛЬКО русский язык, БЕЗ тегов\n"
-            )
-        else:
+        if mode != "new_topic":
             plan_context = self.get_plan_context()
             if plan_context:
                 base_prompt += plan_context
 
-            base_prompt += (
-                f"\nТы — {self.display_name}. Говори ТОЛЬКО от себя, 1-2 предложения.\n"
-                "ПРАВИЛА: отвечай конкретно на последнюю реплику, называй собеседников по имени.\n"
-                "ГОВОРИ только словами. НЕ описывай свои физические действия.\n"
-                "  НЕЛЬЗЯ: 'Я подхожу к столу', 'Я оборачиваюсь', 'Я обращаюсь к...'\n"
-                "  МОЖНО: 'Может стоит поесть', 'Что там за шум?', 'Нужно усилить защиту'\n"
-                "ЗАПРЕЩЕНО: писать за других, теги, английский, обращаться к себе по имени, обращаться к 'Ведущему'.\n"
-                "Не причиняй вред себе/другим. Не повторяй сказанное. Русский язык.\n"
-            )
-
         return base_prompt
 
     def _get_race_prompt(self) -> str:
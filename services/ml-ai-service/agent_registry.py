@@ -15,6 +15,12 @@ class AgentRegistry:
         self._name_to_id: dict[str, str] = {}
         self._name_history: dict[str, list[str]] = {}
         self._lock = threading.Lock()
+        self._version = 0  # растёт при любом изменении имён (для кэшей промптов)
+
+    @property
+    def version(self) -> int:
+        """Версия реестра: меняется при регистрации, удалении и переименовании."""
+        return self._version
 
     def register(self, agent_id: str, display_name: str):
         """Зарегистрировать нового агента."""
@@ -22,6 +28,7 @@ class AgentRegistry:
             self._id_to_name[agent_id] = display_name
             self._name_to_id[display_name.lower()] = agent_id
             self._name_history.setdefault(agent_id, []).append(display_name)
+            self._version += 1
 
     def unregister(self, agent_id: str) -> str:
         """Удалить агента из реестра. Возвращает его имя."""
@@ -29,6 +36,7 @@ class AgentRegistry:
             name = self._id_to_name.pop(agent_id, "")
             if name:
                 self._name_to_id.pop(name.lower(), None)
+            self._version += 1
             return name
 
     def rename(self, agent_id: str, new_name: str, agents: list = None) -> str:
@@ -46,8 +54,25 @@ class AgentRegistry:
             self._id_to_name[agent_id] = new_name
             self._name_to_id[new_name.lower()] = agent_id
             self._name_history.setdefault(agent_id, []).append(new_name)
+            self._version += 1
             return old_name
 
+    def export_state(self) -> dict:
+        """Состояние реестра для снапшота сессии."""
+        with self._lock:
+            return {
+                "names": dict(self._id_to_name),
+                "history": {aid: list(h) for aid, h in self._name_history.items()},
+            }
+
+    def load_state(self, state: dict):
+        """Заменить содержимое реестра состоянием из снапшота."""
+        with self._lock:
+            self._id_to_name = dict(state.get("names", {}))
+            self._name_to_id = {name.lower(): aid for aid, name in self._id_to_name.items()}
+            self._name_history = {aid: list(h) for aid, h in state.get("history", {}).items()}
+            self._version += 1
+
     def get_name(self, agent_id: str) -> str:
         """Получить текущее display_name по id."""
         with self._lock:
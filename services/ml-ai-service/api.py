@@ -3,29 +3,53 @@ FastAPI сервер для ML AI Service.
 
 Эндпоинты:
   POST /api/v1/ml/users/{userId}/messages      — отправить сообщение от пользователя в обсуждение
-  GET  /api/v1/ml/users/{userId}/conversation   — получить историю сообщений (polling)
+                                                 (?async=true — сразу 202 и job_id)
+  GET  /api/v1/ml/users/{userId}/jobs/{jobId}   — статус фоновой обработки сообщения
+  GET  /api/v1/ml/users/{userId}/conversation   — получить историю сообщений (polling / long-poll)
+  GET  /api/v1/ml/users/{userId}/conversation/history — постраничная история по тикам (включая архив)
+  GET  /api/v1/ml/users/{userId}/conversation/stream  — новые сообщения в реальном времени (SSE)
+  WS   /api/v1/ml/users/{userId}/ws             — реплики агентов по токенам во время генерации
   GET  /api/v1/ml/users/{userId}/session        — получить статус сессии
   POST /api/v1/ml/users/{userId}/session        — создать/инициализировать сессию
+  GET  /api/v1/ml/users/{userId}/session/memory — потребление памяти сессией
+  GET  /api/v1/ml/slo                           — задержки ответов пользователю (SLO)
+
+Служебные (для router.py — перенос сессий между воркерами; только с X-Internal-Token):
+  GET  /api/v1/ml/internal/sessions                  — сессии этого воркера (в памяти и выгруженные)
+  POST /api/v1/ml/internal/sessions/{userId}/export  — копия сессии для переноса (сессия выгружается)
+  POST /api/v1/ml/internal/sessions/{userId}/release — удалить копию после переноса
+  POST /api/v1/ml/internal/sessions/{userId}/import  — принять снапшот и продолжить сессию здесь
+
   GET  /health                                  — healthcheck
+  GET  /metrics                                 — метрики процесса (Prometheus)
 
 Фоновая симуляция:
   При создании сессии запускается фоновый поток, в котором агенты общаются
   между собой автономно (run_tick). Пользователь может в любой момент отправить
   сообщение через POST /messages, и агенты ответят ему.
+  Сообщение пользователя важнее фона: пока оно ждёт, симуляция не делает
+  второй тик подряд, текущий тик прерывается перед очередным LLM-запросом,
+  а LLM-слоты достаются запросам пользователя первыми.
 """
 
 import os
 import sys
+import json
 import time
+import base64
 import random
+import asyncio
+import functools
 import threading
 import traceback
-from pathlib import Path
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Optional
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Header, Request, WebSocket, WebSocketDisconnect, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
 
 # Настройка кодировки
@@ -40,12 +64,23 @@ os.environ.setdefault("HTTP_PROXY", "")
 os.environ.setdefault("HTTPS_PROXY", "")
 os.environ.setdefault("NO_PROXY", "localhost,127.0.0.1")
 
-from config import LLM_MODEL, LLM_BASE_URL, CHROMA_DB_PATH
+from config import (
+    LLM_MODEL, LLM_BASE_URL, CHROMA_DB_PATH, API_BLOCKING_WORKERS, API_SESSION_WORKERS,
+    SSE_HEARTBEAT_SECONDS, WS_QUEUE_FRAMES,
+)
 from models import RACES
 from scenarios import ScenarioManager
 from orchestrator import RACE_PRESETS, create_agents, BigBrotherOrchestrator
 from session import session_manager
+from hibernation import SessionHibernator
+from orchestrator_pool import OrchestratorPool
+from jobs import job_store, MessageJob
+from admission import admission
+from internal_auth import require_internal_token
+from slo import slo_tracker
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, render_metrics, tick_latency
 from topics import TopicManager, DialoguePhaseManager
+import chroma_storage
 
 
 # ─── Pydantic-схемы ──────────────────────────────────────────
@@ -79,6 +114,28 @@ class MessageResponse(BaseModel):
     session_id: str
 
 
+class AgentJobStatus(BaseModel):
+    """Ответ одного агента в фоновой задаче."""
+    agent_id: str
+    name: str
+    status: str  # pending | generated | rejected
+    text: Optional[str] = None
+
+
+class MessageJobResponse(BaseModel):
+    """Фоновая обработка сообщения пользователя."""
+    job_id: str
+    user_id: str
+    status: str  # queued | running | done | failed
+    message: str
+    target: str
+    agents: list[AgentJobStatus]
+    responses: list[AgentResponse]  # заполняется, когда status=done
+    error: Optional[str] = None
+    created_at: float
+    finished_at: Optional[float] = None
+
+
 class SessionCreateRequest(BaseModel):
     """Запрос на создание сессии."""
     scenario: str = Field("desert_island", description="Ключ сценария")
@@ -104,6 +161,7 @@ class HealthResponse(BaseModel):
 
 class ConversationEntry(BaseModel):
     """Одно сообщение в истории."""
+    seq: int = 0  # номер записи во всей истории сессии (монотонный)
     tick: int
     agent_id: str
     name: str
@@ -119,6 +177,26 @@ class ConversationResponse(BaseModel):
     total: int
     last_tick: int
     simulation_running: bool
+    next_cursor: str = ""  # передать в cursor следующего запроса
+
+
+class ConversationHistoryResponse(BaseModel):
+    """Страница полной истории (архив на диске + хвост в памяти)."""
+    user_id: str
+    entries: list[ConversationEntry]
+    total: int
+    next_cursor: Optional[str] = None  # передать в cursor для следующей страницы
+
+
+class MemoryFootprintResponse(BaseModel):
+    """Потребление памяти сессией (в байтах)."""
+    user_id: str
+    total_bytes: int
+    agents_bytes: int
+    conversation_bytes: int
+    conversation_entries: int
+    text_pool_entries: int
+    agents: dict[str, dict[str, int]]  # agent_id → {слой: байты}
 
 
 class SessionSettingsRequest(BaseModel):
@@ -145,16 +223,44 @@ class SessionSettingsResponse(BaseModel):
 _simulation_threads: dict[str, threading.Thread] = {}
 _simulation_stop_flags: dict[str, threading.Event] = {}
 _simulation_locks: dict[str, threading.Lock] = {}
+_simulation_locks_guard = threading.Lock()
+_simulation_threads_guard = threading.Lock()  # проверка «уже запущена» и регистрация потока — атомарно
 
 
 def _get_session_lock(user_id: str) -> threading.Lock:
     """Получить или создать lock для сессии (для синхронизации tick/message)."""
-    if user_id not in _simulation_locks:
-        _simulation_locks[user_id] = threading.Lock()
-    return _simulation_locks[user_id]
+    with _simulation_locks_guard:
+        return _simulation_locks.setdefault(user_id, threading.Lock())
+
+
+def _user_waiting(user_id: str) -> bool:
+    """Есть принятые сообщения пользователя, которые ждут или держат lock сессии."""
+    return admission.pending(user_id) > 0
+
+
+# ─── Блокирующая работа вне event loop ────────────────────────
+
+# Короткие блокирующие вызовы (подъём сессии, создание мира, ChromaDB, файлы) выполняются
+# в этом пуле, чтобы не останавливать event loop
+_blocking_executor = ThreadPoolExecutor(max_workers=API_BLOCKING_WORKERS, thread_name_prefix="api-blocking")
+# Работа, которая ждёт lock сессии и LLM (сообщения пользователя), — в отдельном пуле:
+# очередь сообщений одних пользователей не должна задерживать чужие подъём и создание сессий
+_session_executor = ThreadPoolExecutor(max_workers=API_SESSION_WORKERS, thread_name_prefix="api-session")
+
+
+async def _run_blocking(fn, *args, **kwargs):
+    """Выполнить блокирующую функцию в пуле потоков и дождаться её без блокировки loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_blocking_executor, functools.partial(fn, *args, **kwargs))
+
+
+async def _run_session_locked(fn, *args, **kwargs):
+    """Как _run_blocking, но для функций, которые ждут lock сессии (в _session_executor)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_session_executor, functools.partial(fn, *args, **kwargs))
 
 
-def _simulation_loop(user_id: str):
+def _simulation_loop(user_id: str, stop_flag: threading.Event):
     """
     Фоновый цикл симуляции — агенты общаются между собой.
 
@@ -164,15 +270,12 @@ def _simulation_loop(user_id: str):
     """
     from config import TICK_DELAY
 
-    stop_flag = _simulation_stop_flags.get(user_id)
-    if not stop_flag:
-        return
-
     session = session_manager.get_session(user_id)
     if not session or not session.orchestrator:
         return
 
     orchestrator = session.orchestrator
+    orchestrator.preempt = functools.partial(_user_waiting, user_id)
     lock = _get_session_lock(user_id)
 
     print(f"[Simulation] Фоновая симуляция запущена для {user_id[:8]}...")
@@ -183,13 +286,17 @@ def _simulation_loop(user_id: str):
                 if orchestrator._quit_requested:
                     break
 
+                started = time.perf_counter()
                 entry = orchestrator.run_tick()
+                tick_latency.record(time.perf_counter() - started)
                 if entry:
                     orchestrator.print_entry(entry)
 
-                # Иногда второй тик подряд (как в терминальном режиме)
-                if random.random() < 0.50:
+                # Иногда второй тик подряд (как в терминальном режиме), если не ждёт пользователь
+                if random.random() < 0.50 and not _user_waiting(user_id):
+                    started = time.perf_counter()
                     entry2 = orchestrator.run_tick()
+                    tick_latency.record(time.perf_counter() - started)
                     if entry2:
                         orchestrator.print_entry(entry2)
 
@@ -211,73 +318,97 @@ def _simulation_loop(user_id: str):
 
 def _start_simulation(user_id: str):
     """Запустить фоновую симуляцию для сессии."""
-    if user_id in _simulation_threads and _simulation_threads[user_id].is_alive():
-        return  # Уже запущена
-
-    stop_flag = threading.Event()
-    _simulation_stop_flags[user_id] = stop_flag
-
-    thread = threading.Thread(
-        target=_simulation_loop,
-        args=(user_id,),
-        daemon=True,
-        name=f"sim-{user_id[:8]}",
-    )
-    _simulation_threads[user_id] = thread
-    thread.start()
+    with _simulation_threads_guard:
+        if user_id in _simulation_threads and _simulation_threads[user_id].is_alive():
+            return  # Уже запущена
+
+        # Флаг передаётся потоку сразу: его останавливает именно этот флаг
+        stop_flag = threading.Event()
+        _simulation_stop_flags[user_id] = stop_flag
+
+        thread = threading.Thread(
+            target=_simulation_loop,
+            args=(user_id, stop_flag),
+            daemon=True,
+            name=f"sim-{user_id[:8]}",
+        )
+        _simulation_threads[user_id] = thread
+        thread.start()
 
 
-def _stop_simulation(user_id: str):
-    """Остановить фоновую симуляцию."""
-    stop_flag = _simulation_stop_flags.pop(user_id, None)
+def _stop_simulation(user_id: str, keep_lock: bool = False):
+    """Остановить фоновую симуляцию. keep_lock — сессия остаётся, её lock ещё нужен."""
+    with _simulation_threads_guard:
+        stop_flag = _simulation_stop_flags.pop(user_id, None)
+        thread = _simulation_threads.pop(user_id, None)
     if stop_flag:
         stop_flag.set()
-    thread = _simulation_threads.pop(user_id, None)
     if thread and thread.is_alive():
         thread.join(timeout=5.0)
-    _simulation_locks.pop(user_id, None)
+    if not keep_lock:
+        _simulation_locks.pop(user_id, None)
+
+
+def _pause_for_hibernation(user_id: str):
+    """Хук гибернации: остановить симуляцию. Текущий тик и сообщения hibernator
+    дожидается сам — снапшот снимается под lock'ом сессии."""
+    _stop_simulation(user_id, keep_lock=True)
+
+
+# Заранее собранные миры для мгновенного POST /session (см. orchestrator_pool.py)
+orchestrator_pool = OrchestratorPool()
+
+# Выгрузка холодных сессий на диск (см. hibernation.py)
+hibernator = SessionHibernator(
+    session_manager, on_hibernate=_pause_for_hibernation, on_wake=_start_simulation,
+    session_lock=_get_session_lock, is_busy=_user_waiting,
+)
 
 
 # ─── Инициализация сессии ─────────────────────────────────────
 
 def _init_session(user_id: str, scenario: str = "desert_island",
                   race_preset: str = "humans"):
-    """Инициализировать сессию: создать агентов, оркестратор, начать обсуждение."""
-    session = session_manager.get_or_create_session(user_id)
+    """Инициализировать сессию: создать агентов, оркестратор, начать обсуждение.
 
-    if session.orchestrator is not None:
-        return session
+    Параллельные POST /session одного пользователя (и выгрузка, перенос) идут
+    по очереди: иначе каждый собрал бы свой мир и запустил свою симуляцию."""
+    with hibernator.user_lock(user_id):
+        return _build_session(user_id, scenario, race_preset)
 
-    registry = session.agent_registry
 
-    # Очистка данных предыдущих сессий
-    data_dir = Path("data")
-    if data_dir.exists():
-        for file in ["agent_memory.json", "topics.json", "scenario.json", "vector_memory.json"]:
-            file_path = data_dir / file
-            if file_path.exists():
-                file_path.unlink()
+def _build_session(user_id: str, scenario: str, race_preset: str):
+    # Выгруженная сессия продолжается с того же места
+    session = hibernator.wake(user_id) or session_manager.get_or_create_session(user_id)
+    session_manager.touch(user_id)
 
-    agents = create_agents(race_preset, user_id=user_id, registry=registry)
-    orchestrator = BigBrotherOrchestrator(
-        agents, scenario, user_id=user_id, registry=registry,
-    )
-    session.orchestrator = orchestrator
-
-    # Стартовая тема
-    scenario_context = orchestrator.scenario_manager.get_scenario_context()
-    start_topic = orchestrator.topic_manager.get_new_topic(scenario_context)
-    orchestrator.phase_manager.start_new_topic(0)
-
-    starter = {
-        "tick": 0, "agent_id": "system",
-        "name": "Ведущий",
-        "text": f"Привет всем! Давайте обсудим: {start_topic}",
-        "is_new_topic": True,
-    }
-    orchestrator.conversation.append(starter)
-    for agent in agents:
-        agent.process_message(0, "Ведущий", starter["text"], is_own=False)
+    if session.orchestrator is not None:
+        return session
+
+    # Новому пользователю — готовый мир из пула (агенты и стартовая тема уже есть)
+    orchestrator = None
+    if not chroma_storage.tenant_exists(user_id):
+        orchestrator = orchestrator_pool.claim(scenario, race_preset)
+    if orchestrator is not None:
+        orchestrator.bind_user(user_id)
+        session.agent_registry = orchestrator._registry
+        session.text_pool = orchestrator._text_pool
+        session.orchestrator = orchestrator
+        orchestrator.save_world()
+    else:
+        registry = session.agent_registry
+
+        # Всё сохранённое состояние сессии — одним запросом на коллекцию;
+        # для новой сессии — без запросов к коллекциям вовсе
+        state = chroma_storage.load_session_state(user_id)
+        agents = create_agents(race_preset, user_id=user_id, registry=registry,
+                               text_pool=session.text_pool, session_state=state)
+        orchestrator = BigBrotherOrchestrator(
+            agents, scenario, user_id=user_id, registry=registry,
+            text_pool=session.text_pool, session_state=state,
+        )
+        session.orchestrator = orchestrator
+        orchestrator.start_discussion()
 
     # Запускаем фоновую симуляцию — агенты общаются между собой
     _start_simulation(user_id)
@@ -288,15 +419,39 @@ def _init_session(user_id: str, scenario: str = "desert_island",
 def _get_session_with_orchestrator(user_id: str):
     """Получить сессию с инициализированным оркестратором или выбросить 404."""
     session = session_manager.get_session(user_id)
+    if session is None or session.orchestrator is None:
+        session = hibernator.wake(user_id) or session
     if session is None or session.orchestrator is None:
         raise HTTPException(
             status_code=404,
             detail=f"Сессия для пользователя '{user_id}' не найдена. "
                    f"Сначала создайте сессию: POST /api/v1/ml/users/{user_id}/session"
         )
+    session_manager.touch(user_id)
     return session
 
 
+async def _session_or_404(user_id: str):
+    """Асинхронный _get_session_with_orchestrator: подъём из гибернации — в пуле потоков."""
+    session = session_manager.get_session(user_id)
+    if session is None or session.orchestrator is None:
+        return await _run_blocking(_get_session_with_orchestrator, user_id)
+    session_manager.touch(user_id)
+    return session
+
+
+async def _session_and_orchestrator(user_id: str):
+    """Сессия и её оркестратор, прочитанный один раз: между проверкой и чтением
+    session.orchestrator сессию могут выгрузить. Выгрузили — поднимаем снова."""
+    for _ in range(3):
+        session = await _session_or_404(user_id)
+        orchestrator = session.orchestrator
+        if orchestrator is not None:
+            return session, orchestrator
+    raise HTTPException(status_code=503, detail="Сессия выгружается; повторите запрос",
+                        headers={"Retry-After": "1"})
+
+
 # ─── FastAPI App ──────────────────────────────────────────────
 
 @asynccontextmanager
@@ -304,13 +459,20 @@ async def lifespan(app: FastAPI):
     print(f"[ML-AI-Service] Запуск API сервера...")
     print(f"[ML-AI-Service] Модель: {LLM_MODEL}")
     print(f"[ML-AI-Service] LLM API: {LLM_BASE_URL}")
+    hibernator.start()
+    orchestrator_pool.start()
     yield
+    orchestrator_pool.stop()
+    hibernator.stop()
     # Shutdown: останавливаем симуляции и сохраняем сессии
     print(f"[ML-AI-Service] Остановка сервера, сохранение сессий...")
     for session_info in session_manager.list_sessions():
         uid = session_info["user_id"]
         _stop_simulation(uid)
         session_manager.close_session(uid)
+    chroma_storage.flush_writes()
+    _blocking_executor.shutdown(wait=False, cancel_futures=True)
+    _session_executor.shutdown(wait=False, cancel_futures=True)
     print(f"[ML-AI-Service] Все сессии сохранены.")
 
 
@@ -338,6 +500,164 @@ async def health():
     return HealthResponse(status="ok", model=LLM_MODEL, llm_url=LLM_BASE_URL)
 
 
+@app.get("/api/v1/ml/slo")
+async def slo_report():
+    """Задержки ответов пользователю: перцентили и доля в пределах USER_REPLY_SLO_SECONDS."""
+    return slo_tracker.report()
+
+
+@app.get("/metrics")
+async def metrics():
+    """Метрики процесса в формате Prometheus (см. metrics.py)."""
+    body = render_metrics(
+        simulation_threads=sum(1 for t in list(_simulation_threads.values()) if t.is_alive()),
+        hibernated_sessions=hibernator.hibernated_count(),
+    )
+    return Response(content=body, media_type=METRICS_CONTENT_TYPE)
+
+
+def _session_info(session, orchestrator=None) -> SessionInfo:
+    orchestrator = orchestrator or session.orchestrator
+    agents_info = []
+    for a in orchestrator.agents:
+        race = a.race
+        agents_info.append({
+            "agent_id": a.agent_id,
+            "name": session.agent_registry.get_name(a.agent_id),
+            "race": race.race_type.value,
+            "race_emoji": race.emoji,
+            "race_name": race.name_ru,
+            "personality": a.personality_type.value,
+            "mood": a.mood.get_dominant_emotion(),
+            "is_male": a.is_male,
+            "age": a.age,
+        })
+
+    return SessionInfo(
+        user_id=session.user_id,
+        is_active=session.is_active,
+        scenario=orchestrator.scenario_manager.current_scenario.name,
+        agents=agents_info,
+        tick=orchestrator.tick,
+        available_scenarios=list(ScenarioManager.SCENARIOS.keys()),
+        available_race_presets=list(RACE_PRESETS.keys()),
+    )
+
+
+@app.get("/api/v1/ml/internal/sessions", dependencies=[Depends(require_internal_token)])
+async def list_worker_sessions():
+    """user_id всех сессий этого процесса (в памяти, выгруженные и только в ChromaDB)
+    — роутер решает, какие перенести."""
+    resident = [s.user_id for s in session_manager.resident_sessions()]
+    hibernated = await _run_blocking(hibernator.hibernated_ids)
+    stored = await _run_blocking(chroma_storage.list_tenants)
+    return {"user_ids": sorted(set(resident) | set(hibernated) | set(stored))}
+
+
+_SNAPSHOT_MEDIA_TYPE = "application/octet-stream"
+_TENANT_MEDIA_TYPE = "application/json"
+
+
+class SessionExistsError(RuntimeError):
+    """Сессия уже поднята на этом воркере — чужую копию поверх неё не принимаем."""
+
+
+def _export_session(user_id: str) -> Optional[tuple[bytes, str]]:
+    """Копия сессии для переноса: (тело, media type) или None, если её здесь нет.
+
+    Живой или выгруженный мир переезжает снапшотом (живой при этом выгружается).
+    Если мира нет, а память в ChromaDB есть (сессию закрыли, воркер
+    перезапускался), переезжают записи хранилища — мир из них соберёт
+    create_session на новом воркере. Здесь ничего не удаляется: копию убирает
+    _release_session, когда новый воркер сессию принял.
+    RuntimeError — сессию в памяти выгрузить не удалось."""
+    with hibernator.user_lock(user_id):
+        blob = hibernator.export_snapshot(user_id)
+        if blob is not None:
+            return blob, _SNAPSHOT_MEDIA_TYPE
+        rows = chroma_storage.export_tenant(user_id)
+        if rows is None:
+            return None
+        return json.dumps(rows, ensure_ascii=False).encode("utf-8"), _TENANT_MEDIA_TYPE
+
+
+def _release_session(user_id: str) -> bool:
+    """Удалить копию перенесённой сессии (снапшот и данные в ChromaDB).
+    False — сессию после экспорта снова подняли здесь, копия не тронута."""
+    with hibernator.user_lock(user_id):
+        if not hibernator.discard_snapshot(user_id):
+            return False
+        chroma_storage.delete_tenant(user_id)
+        _simulation_locks.pop(user_id, None)
+        return True
+
+
+def _import_session(user_id: str, blob: bytes, media_type: str):
+    """Принять сессию с другого воркера. Присланная копия главнее того, что
+    осталось здесь от прежних переносов: старые снапшот и записи удаляются.
+    Возвращает сессию (снапшот) или None (записи хранилища)."""
+    with hibernator.user_lock(user_id):
+        existing = session_manager.get_session(user_id)
+        if existing is not None and existing.orchestrator is not None:
+            raise SessionExistsError(f"Сессия '{user_id}' уже есть на этом воркере")
+        hibernator.discard_snapshot(user_id)
+        chroma_storage.delete_tenant(user_id)
+        if media_type.startswith(_TENANT_MEDIA_TYPE):
+            chroma_storage.import_tenant(user_id, json.loads(blob))
+            return None
+
+        session = hibernator.import_snapshot(user_id, blob)
+        orchestrator = session.orchestrator
+        # В хранилище этого воркера мира ещё нет — пишем его целиком
+        with _get_session_lock(user_id):
+            for agent in orchestrator.agents:
+                agent.memory_system.mark_unsaved()
+            orchestrator.save_world()
+        return session
+
+
+@app.post("/api/v1/ml/internal/sessions/{user_id}/export", dependencies=[Depends(require_internal_token)])
+async def export_session(user_id: str):
+    """Копия сессии для переноса (служебный): снапшот или записи хранилища.
+    С воркера сессия уходит только после release."""
+    try:
+        exported = await _run_blocking(_export_session, user_id)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if exported is None:
+        raise HTTPException(status_code=404, detail=f"Сессия '{user_id}' не найдена")
+    blob, media_type = exported
+    return Response(content=blob, media_type=media_type)
+
+
+@app.post("/api/v1/ml/internal/sessions/{user_id}/release", dependencies=[Depends(require_internal_token)])
+async def release_session(user_id: str):
+    """Новый воркер принял сессию — удалить её копию здесь (служебный, для переноса)."""
+    if not await _run_blocking(_release_session, user_id):
+        raise HTTPException(status_code=409, detail=f"Сессия '{user_id}' снова активна на этом воркере")
+    return {"user_id": user_id, "released": True}
+
+
+@app.post("/api/v1/ml/internal/sessions/{user_id}/import", dependencies=[Depends(require_internal_token)])
+async def import_session(user_id: str, request: Request):
+    """Продолжить на этом воркере сессию из снапшота или принять её записи хранилища
+    (служебный, для переноса; формат — по Content-Type ответа export)."""
+    if not all(c.isalnum() or c in '-_' for c in user_id):
+        raise HTTPException(status_code=400, detail=f"Невалидный user_id: '{user_id}'")
+    blob = await request.body()
+    media_type = request.headers.get("content-type", _SNAPSHOT_MEDIA_TYPE)
+    try:
+        session = await _run_blocking(_import_session, user_id, blob, media_type)
+    except SessionExistsError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=400, detail=f"Не удалось принять сессию: {e}")
+    if session is None:
+        return {"user_id": user_id, "resident": False}
+    return _session_info(session)
+
+
 @app.post("/api/v1/ml/users/{user_id}/session", response_model=SessionInfo)
 async def create_session(user_id: str, request: SessionCreateRequest = None):
     """
@@ -365,33 +685,8 @@ async def create_session(user_id: str, request: SessionCreateRequest = None):
         )
 
     try:
-        session = _init_session(user_id, request.scenario, request.race_preset)
-        orchestrator = session.orchestrator
-
-        agents_info = []
-        for a in orchestrator.agents:
-            race = a.race
-            agents_info.append({
-                "agent_id": a.agent_id,
-                "name": session.agent_registry.get_name(a.agent_id),
-                "race": race.race_type.value,
-                "race_emoji": race.emoji,
-                "race_name": race.name_ru,
-                "personality": a.personality_type.value,
-                "mood": a.mood.get_dominant_emotion(),
-                "is_male": a.is_male,
-                "age": a.age,
-            })
-
-        return SessionInfo(
-            user_id=user_id,
-            is_active=session.is_active,
-            scenario=orchestrator.scenario_manager.current_scenario.name,
-            agents=agents_info,
-            tick=orchestrator.tick,
-            available_scenarios=list(ScenarioManager.SCENARIOS.keys()),
-            available_race_presets=list(RACE_PRESETS.keys()),
-        )
+        session = await _run_blocking(_init_session, user_id, request.scenario, request.race_preset)
+        return _session_info(session)
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Ошибка создания сессии: {str(e)}")
@@ -400,33 +695,20 @@ async def create_session(user_id: str, request: SessionCreateRequest = None):
 @app.get("/api/v1/ml/users/{user_id}/session", response_model=SessionInfo)
 async def get_session(user_id: str):
     """Получить информацию о сессии пользователя."""
-    session = _get_session_with_orchestrator(user_id)
-    orchestrator = session.orchestrator
+    session, orchestrator = await _session_and_orchestrator(user_id)
+    return _session_info(session, orchestrator)
 
-    agents_info = []
-    for a in orchestrator.agents:
-        race = a.race
-        agents_info.append({
-            "agent_id": a.agent_id,
-            "name": session.agent_registry.get_name(a.agent_id),
-            "race": race.race_type.value,
-            "race_emoji": race.emoji,
-            "race_name": race.name_ru,
-            "personality": a.personality_type.value,
-            "mood": a.mood.get_dominant_emotion(),
-            "is_male": a.is_male,
-            "age": a.age,
-        })
 
-    return SessionInfo(
-        user_id=user_id,
-        is_active=session.is_active,
-        scenario=orchestrator.scenario_manager.current_scenario.name,
-        agents=agents_info,
-        tick=orchestrator.tick,
-        available_scenarios=list(ScenarioManager.SCENARIOS.keys()),
-        available_race_presets=list(RACE_PRESETS.keys()),
-    )
+def _set_tick_delay(user_id: str, orchestrator, speed_seconds: float) -> float:
+    """Поменять задержку между тиками под lock сессии (как _inject_message):
+    иначе изменение может не попасть в снапшот выгружаемой сессии. Возвращает прежнюю."""
+    with _get_session_lock(user_id):
+        session = session_manager.get_session(user_id)
+        if session is None or session.orchestrator is not orchestrator:
+            raise SessionMovedError("Сессия выгружена, пока запрос ждал очереди; повторите запрос")
+        old_delay = orchestrator.tick_delay
+        orchestrator.tick_delay = speed_seconds
+        return old_delay
 
 
 @app.patch("/api/v1/ml/users/{user_id}/session/settings", response_model=SessionSettingsResponse)
@@ -437,11 +719,11 @@ async def update_session_settings(user_id: str, request: SessionSettingsRequest)
     Позволяет фронтенду управлять скоростью общения агентов —
     задержкой (в секундах) между их сообщениями.
     """
-    session = _get_session_with_orchestrator(user_id)
-    orchestrator = session.orchestrator
-
-    old_delay = orchestrator.tick_delay
-    orchestrator.tick_delay = request.speed_seconds
+    _, orchestrator = await _session_and_orchestrator(user_id)
+    try:
+        old_delay = await _run_session_locked(_set_tick_delay, user_id, orchestrator, request.speed_seconds)
+    except SessionMovedError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
 
     return SessionSettingsResponse(
         user_id=user_id,
@@ -451,8 +733,39 @@ async def update_session_settings(user_id: str, request: SessionSettingsRequest)
     )
 
 
-@app.post("/api/v1/ml/users/{user_id}/messages", response_model=MessageResponse)
-async def send_message(user_id: str, request: MessageRequest):
+@app.get("/api/v1/ml/users/{user_id}/session/memory", response_model=MemoryFootprintResponse)
+async def get_memory_footprint(user_id: str):
+    """
+    Отчёт о памяти сессии: байты по агентам и слоям памяти.
+
+    Нужен для оценки, сколько сессий помещается на одну машину.
+    """
+    _, orchestrator = await _session_and_orchestrator(user_id)
+
+    def _measure():
+        with _get_session_lock(user_id):
+            return orchestrator.memory_footprint()
+
+    report = await _run_session_locked(_measure)
+
+    return MemoryFootprintResponse(
+        user_id=user_id,
+        total_bytes=report["total"],
+        agents_bytes=report["agents_total"],
+        conversation_bytes=report["conversation"]["bytes"],
+        conversation_entries=report["conversation"]["entries"],
+        text_pool_entries=report["text_pool"]["entries"],
+        agents=report["agents"],
+    )
+
+
+@app.post("/api/v1/ml/users/{user_id}/messages", response_model=MessageResponse,
+          responses={202: {"model": MessageJobResponse, "description": "Принято в работу (?async=true)"}})
+async def send_message(
+    user_id: str,
+    request: MessageRequest,
+    async_mode: bool = Query(False, alias="async", description="Не ждать ответов: сразу 202 и job_id"),
+):
     """
     Отправить сообщение от пользователя в обсуждение.
     
@@ -461,8 +774,14 @@ async def send_message(user_id: str, request: MessageRequest):
     
     Если target_agent указан — личное сообщение конкретному агенту.
     Если target_agent не указан (None) — сообщение всем агентам.
+
+    С ?async=true ответ — 202 Accepted с job_id (Location: /jobs/{job_id}):
+    ответы агентов приходят в стрим диалога, статус — GET /jobs/{job_id}.
+
+    Лимиты (admission.py): 429 — превышена частота сообщений или в работе
+    уже слишком много сообщений сессии, 503 — LLM перегружена. Оба с Retry-After.
     """
-    session = _get_session_with_orchestrator(user_id)
+    session = await _session_or_404(user_id)
     orchestrator = session.orchestrator
 
     # Определяем целевых агентов
@@ -488,13 +807,28 @@ async def send_message(user_id: str, request: MessageRequest):
         target_agents = list(orchestrator.agents)
         target_label = "all"
 
+    rejection = admission.admit(user_id, len(target_agents))
+    if rejection:
+        raise HTTPException(status_code=rejection.status, detail=rejection.detail,
+                            headers={"Retry-After": str(rejection.retry_after)})
+
+    received = time.monotonic()
+    if async_mode:
+        job = job_store.create(
+            user_id, request.message, target_label,
+            [(a.agent_id, session.agent_registry.get_name(a.agent_id)) for a in target_agents],
+        )
+        _submit_admitted(user_id, _run_message_job, job, orchestrator, target_agents, received)
+        return JSONResponse(
+            status_code=202,
+            content=MessageJobResponse(**job.as_dict()).model_dump(),
+            headers={"Location": f"/api/v1/ml/users/{user_id}/jobs/{job.job_id}"},
+        )
+
     try:
-        # Lock — чтобы фоновая симуляция не делала tick одновременно
-        lock = _get_session_lock(user_id)
-        with lock:
-            responses_raw = orchestrator.inject_user_message_api(
-                request.message, target_agents
-            )
+        responses_raw = await asyncio.wrap_future(_submit_admitted(
+            user_id, _inject_message, user_id, orchestrator, request.message, target_agents, received=received
+        ))
 
         responses = [
             AgentResponse(
@@ -517,6 +851,8 @@ async def send_message(user_id: str, request: MessageRequest):
             session_id=user_id,
         )
 
+    except SessionMovedError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(
@@ -525,11 +861,152 @@ async def send_message(user_id: str, request: MessageRequest):
         )
 
 
+def _submit_admitted(user_id: str, fn, *args, **kwargs) -> Future:
+    """Обработать принятое сообщение в _session_executor. Место в очереди сессии
+    освобождается, когда обработка закончится или будет отменена, не начавшись."""
+    try:
+        future = _session_executor.submit(fn, *args, **kwargs)
+    except Exception:
+        admission.release(user_id)
+        raise
+    future.add_done_callback(lambda _: admission.release(user_id))
+    return future
+
+
+class SessionMovedError(RuntimeError):
+    """Пока сообщение ждало lock, мир сессии выгрузили или перенесли на другой воркер."""
+
+
+def _inject_message(user_id: str, orchestrator, message: str, target_agents: list,
+                    on_reply=None, received: Optional[float] = None) -> list[dict]:
+    """Сообщение пользователя (блокирующе: lock сессии + LLM). Вызывается через _submit_admitted,
+    который и освобождает место в очереди сессии (admission.admit).
+
+    received — time.monotonic() приёма сообщения (для SLO)."""
+    received = received if received is not None else time.monotonic()
+    first_reply = []
+
+    def track_reply(agent_id: str, text: Optional[str]):
+        if text and not first_reply:
+            first_reply.append(True)
+            slo_tracker.record("first_reply", time.monotonic() - received)
+        if on_reply:
+            on_reply(agent_id, text)
+
+    # Lock — чтобы фоновая симуляция не делала tick одновременно
+    # (пока сообщение ждёт, она уступает — см. _simulation_loop)
+    with _get_session_lock(user_id):
+        session = session_manager.get_session(user_id)
+        if session is None or session.orchestrator is not orchestrator:
+            raise SessionMovedError("Сессия выгружена, пока сообщение ждало очереди; повторите запрос")
+        slo_tracker.record("lock_wait", time.monotonic() - received)
+        responses = orchestrator.inject_user_message_api(message, target_agents, on_reply=track_reply)
+    slo_tracker.record("user_reply", time.monotonic() - received)
+    return responses
+
+
+def _run_message_job(job: MessageJob, orchestrator, target_agents: list, received: float):
+    """Фоновая задача POST /messages?async=true (в _session_executor)."""
+    job.start()
+    try:
+        job.finish(_inject_message(job.user_id, orchestrator, job.message, target_agents,
+                                   on_reply=job.set_reply, received=received))
+    except SessionMovedError as e:
+        job.fail(str(e))
+    except Exception as e:
+        traceback.print_exc()
+        job.fail(str(e))
+
+
+@app.get("/api/v1/ml/users/{user_id}/jobs/{job_id}", response_model=MessageJobResponse)
+async def get_job(user_id: str, job_id: str):
+    """Статус фоновой обработки сообщения (POST /messages?async=true)."""
+    job = job_store.get(job_id, user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Задача '{job_id}' не найдена")
+    return MessageJobResponse(**job.as_dict())
+
+
+def _conversation_entry(e: dict, seq: int = 0) -> ConversationEntry:
+    return ConversationEntry(
+        seq=seq,
+        tick=e.get("tick", 0),
+        agent_id=e.get("agent_id", ""),
+        name=e.get("name", ""),
+        text=e.get("text", ""),
+        is_event=e.get("is_event", False),
+        is_new_topic=e.get("is_new_topic", False),
+    )
+
+
+class _AppendWaiter:
+    """Пробуждение корутины при новой записи в ConversationLog (запись идёт из потока симуляции)."""
+
+    def __init__(self, conversation):
+        self.conversation = conversation
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+
+    def _notify(self):
+        self._loop.call_soon_threadsafe(self._event.set)
+
+    def __enter__(self):
+        self.conversation.subscribe(self._notify)
+        return self
+
+    def __exit__(self, *exc):
+        self.conversation.unsubscribe(self._notify)
+
+    def clear(self):
+        """Сбросить до проверки лога — запись после проверки не потеряется."""
+        self._event.clear()
+
+    async def wait(self, timeout: float) -> bool:
+        """True — появилась новая запись, False — таймаут."""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+def _encode_cursor(seq: int) -> str:
+    return base64.urlsafe_b64encode(f"seq:{seq}".encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> int:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        prefix, _, value = raw.partition(":")
+        if prefix == "seq" and value.isdigit():
+            return int(value)
+    except (ValueError, UnicodeDecodeError):
+        pass
+    raise HTTPException(status_code=400, detail="Некорректный cursor")
+
+
+def _entry_json(seq: int, entry: dict) -> bytes:
+    return _conversation_entry(entry, seq).model_dump_json().encode("utf-8")
+
+
+async def _select_entries(conversation, after_tick: int, limit: int,
+                          cursor_seq: Optional[int]) -> list[tuple[int, dict]]:
+    """Записи страницы: по cursor — вперёд с него, иначе последние limit после after_tick."""
+    if cursor_seq is None:
+        return conversation.tail_after(after_tick, limit)
+    if cursor_seq < conversation.spilled:
+        return await _run_blocking(conversation.since, cursor_seq, limit)  # отставший клиент — из архива
+    return conversation.since(cursor_seq, limit)
+
+
 @app.get("/api/v1/ml/users/{user_id}/conversation", response_model=ConversationResponse)
 async def get_conversation(
     user_id: str,
     after_tick: int = Query(-1, description="Вернуть сообщения после этого тика (для polling)"),
     limit: int = Query(50, ge=1, le=200, description="Максимум сообщений"),
+    wait_seconds: float = Query(0, ge=0, le=60, description="Long-poll: ждать новых сообщений до N секунд"),
+    cursor: Optional[str] = Query(None, description="next_cursor прошлого ответа (вместо after_tick)"),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
 ):
     """
     Получить историю сообщений.
@@ -541,40 +1018,252 @@ async def get_conversation(
       1. GET /conversation?after_tick=-1&limit=50   → получить последние 50
       2. Запомнить last_tick из ответа
       3. GET /conversation?after_tick=42&limit=50    → только новые после тика 42
+
+    Long-poll: с wait_seconds=25 запрос без новых сообщений не отвечает сразу,
+    а ждёт, пока агенты что-то скажут (или истечёт время — тогда entries пустой).
+    Протокол тот же, просто следующий запрос отправляется сразу после ответа.
+
+    Курсор: у каждой записи есть seq, в ответе — next_cursor. Запрос
+    с cursor=<next_cursor> отдаёт записи строго после прошлой страницы
+    (тик неоднозначен — на один тик приходится несколько записей).
+    ETag зависит от истории и параметров запроса: с If-None-Match ответ — 304 без тела
+    (с wait_seconds — после ожидания, если ничего не изменилось).
     """
-    session = _get_session_with_orchestrator(user_id)
+    session = await _session_or_404(user_id)
     orchestrator = session.orchestrator
 
     all_entries = orchestrator.conversation
+    cursor_seq = _decode_cursor(cursor) if cursor else None
+    query_key = f"c{cursor_seq}" if cursor_seq is not None else f"t{max(after_tick, -1)}"
+    query_key += f"-l{limit}"
+
+    def current_etag() -> str:
+        sim_running = user_id in _simulation_threads and _simulation_threads[user_id].is_alive()
+        return f'W/"{all_entries.epoch}-{all_entries.total}-{int(sim_running)}-{query_key}"'
+
+    # Клиент уже видел это состояние — записи не выбираем вовсе
+    unchanged = if_none_match is not None and if_none_match == current_etag()
+    if unchanged and wait_seconds <= 0:
+        return Response(status_code=304, headers={"ETag": if_none_match})
+    selected = [] if unchanged else await _select_entries(all_entries, after_tick, limit, cursor_seq)
+
+    if not selected and wait_seconds > 0:
+        deadline = time.monotonic() + wait_seconds
+        with _AppendWaiter(all_entries) as waiter:
+            while session.orchestrator is orchestrator:
+                waiter.clear()
+                if if_none_match != current_etag():
+                    selected = await _select_entries(all_entries, after_tick, limit, cursor_seq)
+                remaining = deadline - time.monotonic()
+                if selected or remaining <= 0 or not await waiter.wait(remaining):
+                    break
+        session_manager.touch(user_id)
 
-    # Фильтруем по after_tick
-    if after_tick >= 0:
-        filtered = [e for e in all_entries if e.get("tick", 0) > after_tick]
+    total = all_entries.total
+    sim_running = user_id in _simulation_threads and _simulation_threads[user_id].is_alive()
+    etag = current_etag()
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    # Ответ собирается из закэшированного JSON записей, без моделей на каждый poll
+    tail = all_entries[-1:]
+    last_tick = tail[0].get("tick", 0) if tail else 0
+    if selected:
+        next_seq = selected[-1][0] + 1
     else:
-        filtered = list(all_entries)
-
-    # Берём последние limit
-    filtered = filtered[-limit:]
-
-    entries = [
-        ConversationEntry(
-            tick=e.get("tick", 0),
-            agent_id=e.get("agent_id", ""),
-            name=e.get("name", ""),
-            text=e.get("text", ""),
-            is_event=e.get("is_event", False),
-            is_new_topic=e.get("is_new_topic", False),
-        )
-        for e in filtered
-    ]
+        next_seq = cursor_seq if cursor_seq is not None else total
+    body = b"".join((
+        b'{"user_id":', json.dumps(user_id).encode(),
+        b',"entries":[', b",".join(all_entries.encoded(seq, e, _entry_json) for seq, e in selected),
+        b'],"total":', str(total).encode(),
+        b',"last_tick":', str(last_tick).encode(),
+        b',"simulation_running":', b"true" if sim_running else b"false",
+        b',"next_cursor":', json.dumps(_encode_cursor(next_seq)).encode(),
+        b"}",
+    ))
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+
+@app.get("/api/v1/ml/users/{user_id}/conversation/history", response_model=ConversationHistoryResponse)
+async def get_conversation_history(
+    user_id: str,
+    from_tick: int = Query(0, ge=0, description="Первый тик диапазона"),
+    to_tick: int = Query(-1, description="Последний тик диапазона (-1 — до конца)"),
+    limit: int = Query(100, ge=1, le=500, description="Максимум сообщений на странице"),
+    cursor: Optional[str] = Query(None, description="next_cursor предыдущей страницы"),
+):
+    """
+    Полная история диалога по диапазону тиков, постранично.
 
-    last_tick = all_entries[-1].get("tick", 0) if all_entries else 0
-    sim_running = user_id in _simulation_threads and _simulation_threads[user_id].is_alive()
+    Старые сообщения хранятся в архиве на диске (см. conversation_log.py),
+    поэтому доступна вся история сессии, а не только последние записи.
+    """
+    start_seq = _decode_cursor(cursor) if cursor else None
+    _, orchestrator = await _session_and_orchestrator(user_id)
+    conversation = orchestrator.conversation
 
-    return ConversationResponse(
+    page, next_seq = await _run_blocking(conversation.read, from_tick, to_tick, limit, start_seq=start_seq)
+    return ConversationHistoryResponse(
         user_id=user_id,
-        entries=entries,
-        total=len(all_entries),
-        last_tick=last_tick,
-        simulation_running=sim_running,
+        entries=[_conversation_entry(e, seq) for seq, e in page],
+        total=conversation.total,
+        next_cursor=_encode_cursor(next_seq) if next_seq is not None else None,
     )
+
+
+def _sse_event(conversation, seq: int, entry: dict) -> bytes:
+    data = conversation.encoded(seq, entry, _entry_json)
+    return f"id: {conversation.epoch}:{seq}\nevent: message\ndata: ".encode() + data + b"\n\n"
+
+
+@app.get("/api/v1/ml/users/{user_id}/conversation/stream")
+async def stream_conversation(
+    user_id: str,
+    request: Request,
+    backlog: int = Query(0, ge=0, le=200, description="Сколько последних сообщений отдать при подключении"),
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+):
+    """
+    Поток новых сообщений (Server-Sent Events) вместо polling.
+
+    Каждое событие: id — "{epoch}:{seq}" (история и номер записи в ней), data — JSON сообщения.
+    При переподключении браузер сам присылает Last-Event-ID, и стрим
+    продолжается со следующей записи (пропущенные дочитываются и из архива).
+    Если история с тех пор началась заново (другой epoch), стрим начинается
+    как новый — с последних backlog сообщений.
+    В тишине раз в SSE_HEARTBEAT_SECONDS приходит комментарий-пинг.
+    """
+    session = await _session_or_404(user_id)
+    orchestrator = session.orchestrator
+    conversation = orchestrator.conversation
+
+    epoch, _, seq = (last_event_id or "").strip().partition(":")
+    if epoch == conversation.epoch and seq.isdigit():
+        next_seq = int(seq) + 1
+    else:
+        next_seq = max(0, conversation.total - backlog)
+
+    waiter = _AppendWaiter(conversation)
+
+    async def events():
+        nonlocal next_seq
+        with waiter:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                # Сессию выгрузили — клиент переподключится с Last-Event-ID и поднимет её
+                if session.orchestrator is not orchestrator:
+                    break
+                waiter.clear()
+                if next_seq < conversation.spilled:
+                    batch = await _run_blocking(conversation.since, next_seq)
+                else:
+                    batch = conversation.since(next_seq)
+                for seq, entry in batch:
+                    yield _sse_event(conversation, seq, entry)
+                    next_seq = seq + 1
+                if batch:
+                    continue
+                if not await waiter.wait(SSE_HEARTBEAT_SECONDS):
+                    session_manager.touch(user_id)  # открытый стрим — активный пользователь
+                    yield ": heartbeat\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+class _FrameQueue:
+    """Очередь кадров WebSocket одного клиента (работает только в потоке event loop).
+
+    При переполнении кадр token отбрасывается, а ради start/commit/retract из очереди
+    выбрасываются накопленные token. Если не помещаются и управляющие кадры — overflowed."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.ready = asyncio.Event()
+        self.overflowed = False
+        self._frames: deque = deque()
+
+    def offer(self, frame: dict):
+        if len(self._frames) >= self.maxsize:
+            if frame["type"] == "token":
+                return
+            kept = [f for f in self._frames if f["type"] != "token"]
+            if len(kept) >= self.maxsize:
+                self.overflowed = True
+                self.ready.set()
+                return
+            self._frames = deque(kept)
+        self._frames.append(frame)
+        self.ready.set()
+
+    def take(self) -> list[dict]:
+        self.ready.clear()
+        frames, self._frames = list(self._frames), deque()
+        return frames
+
+
+@app.websocket("/api/v1/ml/users/{user_id}/ws")
+async def reply_socket(websocket: WebSocket, user_id: str):
+    """
+    Реплики агентов по токенам, пока LLM их генерирует.
+
+    Кадры (JSON):
+      {"type": "start", "reply_id", "agent_id", "name", "tick"} — агент начал говорить
+      {"type": "token", "reply_id", "text"}                    — очередной фрагмент (сырой текст)
+      {"type": "commit", "reply_id", ..., "text"}             — реплика принята, text — итоговый
+      {"type": "retract", "reply_id", "reason"}                — реплика отвергнута, убрать
+      {"type": "ping"}                                         — соединение живо
+    Клиент показывает токены сразу, а по commit заменяет их очищенным текстом.
+    Медленному клиенту лишние кадры token не доставляются, а start/commit/retract
+    доходят всегда; если не успевает и их — соединение закрывается с кодом 1013.
+    """
+    try:
+        session = await _session_or_404(user_id)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    orchestrator = session.orchestrator
+    await websocket.accept()
+
+    loop = asyncio.get_running_loop()
+    frames = _FrameQueue(WS_QUEUE_FRAMES)
+
+    def sink(frame: dict):
+        # Вызывается из потока симуляции
+        loop.call_soon_threadsafe(frames.offer, frame)
+
+    async def drain():
+        # Входящие сообщения не нужны — ждём закрытия со стороны клиента
+        while True:
+            await websocket.receive_text()
+
+    orchestrator.add_stream_sink(sink)
+    receiver = asyncio.create_task(drain())
+    try:
+        while not receiver.done() and session.orchestrator is orchestrator:
+            getter = asyncio.create_task(frames.ready.wait())
+            done, _ = await asyncio.wait({getter, receiver}, timeout=SSE_HEARTBEAT_SECONDS,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                if frames.overflowed:
+                    await websocket.close(code=1013)  # не успевает даже за commit — пусть переподключится
+                    break
+                for frame in frames.take():
+                    await websocket.send_json(frame)
+                continue
+            getter.cancel()
+            if not done:
+                session_manager.touch(user_id)
+                await websocket.send_json({"type": "ping"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        orchestrator.remove_stream_sink(sink)
+        receiver.cancel()
+        try:
+            await websocket.close()
+        except Exception:
+            pass  # клиент уже закрыл соединение
@@ -8,8 +8,13 @@ Audit Service клиент: отправка событий (POST /api/v1/audit/
   - simulation_context: { scenario_name, current_topic, phase }
 
 Авторизация: Bearer JWT (токен из env AUDIT_JWT_TOKEN).
+
+События уходят через ограниченную очередь (AUDIT_QUEUE_SIZE) и AUDIT_SENDERS
+фоновых потоков. Если Audit Service не успевает, новые события отбрасываются
+(счётчик dropped) — тик симуляции никогда не ждёт аудит.
 """
 
+import queue
 import threading
 from datetime import datetime, timezone
 from typing import Optional, TYPE_CHECKING
@@ -17,7 +22,7 @@ from typing import Optional, TYPE_CHECKING
 import httpx
 from colorama import Fore, Style
 
-from config import AUDIT_API_URL, AUDIT_JWT_TOKEN
+from config import AUDIT_API_URL, AUDIT_JWT_TOKEN, AUDIT_QUEUE_SIZE, AUDIT_SENDERS
 
 if TYPE_CHECKING:
     from agent import Agent
@@ -29,6 +34,49 @@ _audit_http_client = httpx.Client(
 )
 
 
+class AuditQueue:
+    """Очередь событий для отправки; потоки отправки запускаются при первом событии."""
+
+    def __init__(self, maxsize: int = AUDIT_QUEUE_SIZE, senders: int = AUDIT_SENDERS):
+        self._queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self._senders = senders
+        self._threads: list[threading.Thread] = []
+        self._threads_lock = threading.Lock()
+        self.sent = 0
+        self.dropped = 0
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def put(self, payload: dict):
+        self._ensure_threads()
+        try:
+            self._queue.put_nowait(payload)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_threads(self):
+        if len(self._threads) == self._senders:
+            return
+        with self._threads_lock:
+            while len(self._threads) < self._senders:
+                thread = threading.Thread(target=self._loop, daemon=True,
+                                          name=f"audit-{len(self._threads)}")
+                thread.start()
+                self._threads.append(thread)
+
+    def _loop(self):
+        while True:
+            payload = self._queue.get()
+            _send_request(payload)
+            self.sent += 1
+
+
+# Глобальная очередь
+audit_queue = AuditQueue()
+
+
 def _serialize_source_agent(agent: 'Agent') -> dict:
     """
     Сериализовать состояние агента-инициатора для Audit API.
@@ -96,7 +144,7 @@ def send_audit_event(
     sentiments: Optional[dict] = None,
 ) -> None:
     """
-    Отправить полное событие в Audit Service (неблокирующе, в фоновом потоке).
+    Отправить полное событие в Audit Service (неблокирующе, через audit_queue).
 
     Args:
         event_type: "message_sent" | "new_topic" | "event_reaction"
@@ -144,12 +192,7 @@ def send_audit_event(
         },
     }
 
-    thread = threading.Thread(
-        target=_send_request,
-        args=(payload,),
-        daemon=True,
-    )
-    thread.start()
+    audit_queue.put(payload)
 
 
 def _send_request(payload: dict) -> None:
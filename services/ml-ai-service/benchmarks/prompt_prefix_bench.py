@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк префиксного кэширования промптов.
+
+Гоняет симуляцию N тиков и для каждого LLM-запроса агента считает:
+  - долю общего префикса с предыдущим запросом того же агента (в символах) —
+    верхняя оценка того, сколько KV-кэша может переиспользовать бэкенд;
+  - time-to-first-token (TTFT) через стриминг к локальному бэкенду;
+  - если бэкенд — llama.cpp server, ещё и timings.cache_n / prompt_n
+    (сколько токенов промпта реально взято из кэша).
+
+Запуск (из services/ml-ai-service):
+  python benchmarks/prompt_prefix_bench.py --ticks 30
+  python benchmarks/prompt_prefix_bench.py --ticks 30 --dry-run   # без бэкенда, только префиксы
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx
+
+from config import LLM_BASE_URL, LLM_API_KEY, LLM_MODEL, LLM_TIMEOUT
+from agent_registry import AgentRegistry
+import chroma_storage
+import memory
+import orchestrator as orchestrator_module
+import topics
+from orchestrator import create_agents, BigBrotherOrchestrator
+
+
+def _prompt_text(messages: list[dict]) -> str:
+    """Плоское представление запроса — так его видит токенизатор бэкенда."""
+    return "".join(f"<{m['role']}>{m['content']}" for m in messages)
+
+
+def _common_prefix_len(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def _stream_chat(messages: list[dict], temperature: float) -> tuple[Optional[str], Optional[float], dict]:
+    """Стриминговый запрос: (текст, TTFT в секундах, timings от llama.cpp)."""
+    payload = {
+        "model": LLM_MODEL,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": 150,
+        "stream": True,
+        "cache_prompt": True,  # llama.cpp server; остальные бэкенды игнорируют
+    }
+    headers = {"Authorization": f"Bearer {LLM_API_KEY}"}
+    started = time.perf_counter()
+    ttft = None
+    parts = []
+    timings = {}
+    with httpx.stream("POST", f"{LLM_BASE_URL.rstrip('/')}/chat/completions",
+                      json=payload, headers=headers, timeout=LLM_TIMEOUT) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            chunk = json.loads(data)
+            if chunk.get("timings"):
+                timings = chunk["timings"]
+            for choice in chunk.get("choices", []):
+                delta = (choice.get("delta") or {}).get("content")
+                if delta:
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                    parts.append(delta)
+    return "".join(parts).strip() or None, ttft, timings
+
+
+class PromptRecorder:
+    """Подменяет llm_chat: пишет статистику и (если не dry-run) ходит в бэкенд."""
+
+    def __init__(self, agents: list, dry_run: bool):
+        self.agents = agents
+        self.dry_run = dry_run
+        self.last_prompt: dict[str, str] = {}
+        self.samples: list[dict] = []
+
+    def _owner(self, messages: list[dict]) -> str:
+        if not messages or messages[0]["role"] != "system":
+            return "other"
+        content = messages[0]["content"]
+        for agent in self.agents:
+            if content.startswith(agent.personality_description):
+                return agent.agent_id
+        return "other"
+
+    def __call__(self, messages: list[dict], temperature: float = 0.8) -> Optional[str]:
+        owner = self._owner(messages)
+        text = _prompt_text(messages)
+        sample = {"owner": owner, "prompt_chars": len(text)}
+        if owner != "other" and owner in self.last_prompt:
+            prev = self.last_prompt[owner]
+            sample["prefix_ratio"] = _common_prefix_len(prev, text) / max(len(text), 1)
+        if owner != "other":
+            self.last_prompt[owner] = text
+
+        if self.dry_run:
+            self.samples.append(sample)
+            return f"Реплика номер {len(self.samples)}: надо проверить запасы и укрепить лагерь."
+
+        try:
+            reply, ttft, timings = _stream_chat(messages, temperature)
+        except Exception as e:
+            print(f"  запрос не удался: {e}")
+            return None
+        sample["ttft"] = ttft
+        if timings.get("prompt_n") is not None:
+            cache_n = timings.get("cache_n", 0)
+            sample["cache_ratio"] = cache_n / max(cache_n + timings["prompt_n"], 1)
+        self.samples.append(sample)
+        return reply
+
+
+def _summary(values: list[float]) -> str:
+    if not values:
+        return "нет данных"
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+    return f"mean={statistics.mean(values):.3f} median={statistics.median(values):.3f} p95={p95:.3f} (n={len(values)})"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prefix-cache benchmark for agent prompts")
+    parser.add_argument("--ticks", type=int, default=30)
+    parser.add_argument("--scenario", default="desert_island")
+    parser.add_argument("--race-preset", default="humans")
+    parser.add_argument("--dry-run", action="store_true", help="не ходить в бэкенд, считать только префиксы")
+    parser.add_argument("--json", dest="json_path", default="", help="сохранить сырые замеры в файл")
+    args = parser.parse_args()
+
+    os.environ.setdefault("NO_PROXY", "localhost,127.0.0.1")
+    user_id = f"bench_{uuid.uuid4().hex[:8]}"
+    registry = AgentRegistry()
+    agents = create_agents(args.race_preset, user_id=user_id, registry=registry)
+    recorder = PromptRecorder(agents, dry_run=args.dry_run)
+    for module in (orchestrator_module, memory, topics):
+        module.llm_chat = recorder
+
+    orch = BigBrotherOrchestrator(agents, args.scenario, user_id=user_id, registry=registry)
+    orch.tick_delay = 0
+    try:
+        for _ in range(args.ticks):
+            orch.run_tick()
+    finally:
+        chroma_storage.reset_all(user_id=user_id)
+
+    agent_samples = [s for s in recorder.samples if s["owner"] != "other"]
+    print(f"\nЗапросов агентов: {len(agent_samples)}, прочих: {len(recorder.samples) - len(agent_samples)}")
+    print(f"Общий префикс с прошлым запросом агента: {_summary([s['prefix_ratio'] for s in agent_samples if 'prefix_ratio' in s])}")
+    if not args.dry_run:
+        print(f"TTFT, с:                                  {_summary([s['ttft'] for s in agent_samples if s.get('ttft') is not None])}")
+        print(f"Доля токенов из KV-кэша (llama.cpp):      {_summary([s['cache_ratio'] for s in agent_samples if 'cache_ratio' in s])}")
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(recorder.samples, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
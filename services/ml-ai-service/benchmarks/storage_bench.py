@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк слоя хранения (ChromaDB).
+
+Генерирует синтетическую память (short_term, long_term, действия, решения)
+и документы векторной памяти для N агентов и замеряет:
+  - полное сохранение всех агентов (первый save);
+  - инкрементальное сохранение (по одной новой реплике у каждого агента, один батч);
+  - загрузку по агентам (load_agent_memories + load_vector_documents)
+    и одним запросом на коллекцию (load_session_state);
+  - поиск по векторной памяти агента (TF-IDF поверх загруженных документов);
+  - прирост базы на диске.
+Прогоняется для каждой раскладки коллекций (per_user / shared) и каждого
+числа агентов. В базе заранее лежат данные ещё --tenants пользователей —
+так видна цена фильтрации в общей коллекции.
+
+Записи идут синхронно (фоновый писатель выключен), чтобы мерить саму запись.
+
+Запуск (из services/ml-ai-service):
+  python benchmarks/storage_bench.py
+  python benchmarks/storage_bench.py --agents 5 20 100 --layouts per_user shared --json results.json
+"""
+
+import argparse
+import json
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import chromadb
+
+from config import SHORT_TERM_MEMORY, LONG_TERM_MEMORY
+import chroma_storage
+from memory import AgentMemorySystem, MemoryItem
+from vector_memory import VectorMemoryLayer
+from text_pool import TextPool
+
+
+_WORDS = (
+    "вода огонь лодка берег пальма рыба шторм нож верёвка костёр хижина остров "
+    "запасы компас карта сигнал дым помощь ночь утро охота план решение доверие "
+    "укрытие ветер дождь скалы пещера еда фрукты кокос сеть крючок вахта"
+).split()
+
+
+def _phrase(rng: random.Random, words: int = 14) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _fill_agent(memory: AgentMemorySystem, rng: random.Random, ticks: int):
+    """Полная память агента: все слои заполнены до своих лимитов."""
+    speakers = [("Алиса", "agent_1"), ("Борис", "agent_2"), ("Вика", "agent_3")]
+    def item(tick: int) -> MemoryItem:
+        name, sid = rng.choice(speakers)
+        return MemoryItem(tick=tick, speaker=name, text=_phrase(rng), timestamp=tick,
+                          importance=round(rng.uniform(0.2, 1.0), 2), speaker_id=sid,
+                          is_event=rng.random() < 0.1)
+    memory.short_term = [item(ticks - SHORT_TERM_MEMORY + i) for i in range(SHORT_TERM_MEMORY)]
+    memory.long_term = [item(rng.randrange(ticks)) for _ in range(LONG_TERM_MEMORY)]
+    memory.completed_actions = [_phrase(rng, 6) for _ in range(20)]
+    memory.group_decisions = [{"tick": rng.randrange(ticks), "proposer": "Алиса",
+                               "proposer_id": "agent_1", "decision": _phrase(rng, 8)} for _ in range(10)]
+    memory._actions_dirty = True
+    memory._decisions_dirty = True
+    memory._touch()
+    vector = memory.vector_layer
+    for tick in range(VectorMemoryLayer.MAX_DOCUMENTS):
+        name, sid = rng.choice(speakers)
+        vector.add_document(_phrase(rng), tick=tick, importance=rng.uniform(0.2, 1.0),
+                            speaker=name, speaker_id=sid)
+
+
+def _make_agents(user_id: str, count: int, rng: random.Random, ticks: int = 500) -> list[AgentMemorySystem]:
+    pool = TextPool()
+    agents = []
+    for i in range(count):
+        memory = AgentMemorySystem(f"agent_{i + 1}", user_id=user_id, text_pool=pool, load=False)
+        _fill_agent(memory, rng, ticks)
+        agents.append(memory)
+    return agents
+
+
+def _save_all(agents: list[AgentMemorySystem]) -> float:
+    started = time.perf_counter()
+    with chroma_storage.write_batch():
+        for memory in agents:
+            memory.save_to_db()
+    return time.perf_counter() - started
+
+
+def _dir_bytes(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def _use_database(path: Path, layout: str):
+    """Переключить chroma_storage на чистую базу и нужную раскладку."""
+    chroma_storage.CHROMA_DB_PATH = str(path)
+    chroma_storage.CHROMA_LAYOUT = layout
+    chroma_storage._client = None
+    chroma_storage._collections.clear()
+
+
+def _percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def run_case(layout: str, agents_count: int, tenants: int, queries: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    workdir = Path(tempfile.mkdtemp(prefix="storage_bench_"))
+    try:
+        _use_database(workdir / "chroma", layout)
+
+        # Соседи по базе: в shared-раскладке они лежат в тех же коллекциях
+        for t in range(tenants):
+            _save_all(_make_agents(f"bench_tenant_{t}", agents_count, rng))
+        disk_before = _dir_bytes(workdir)
+
+        user_id = "bench_user"
+        agents = _make_agents(user_id, agents_count, rng)
+        save_full = _save_all(agents)
+        disk_after = _dir_bytes(workdir)
+
+        # Новая реплика у каждого агента: add_memory сам сохраняет diff (как в тике — одним батчем)
+        started = time.perf_counter()
+        with chroma_storage.write_batch():
+            for memory in agents:
+                memory.add_memory(tick=600, speaker="Алиса", text=_phrase(rng), speaker_id="agent_1")
+        save_incremental = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for memory in agents:
+            chroma_storage.load_agent_memories(memory.agent_id, user_id=user_id)
+            chroma_storage.load_vector_documents(memory.agent_id, user_id=user_id)
+        load_per_agent = time.perf_counter() - started
+
+        started = time.perf_counter()
+        state = chroma_storage.load_session_state(user_id)
+        load_bulk = time.perf_counter() - started
+        assert len(state["agents"]) == agents_count
+
+        vector = VectorMemoryLayer(agents[0].agent_id, user_id=user_id)
+        vector.search(_phrase(rng, 4))  # первый поиск строит индекс
+        search_times = []
+        for _ in range(queries):
+            query = _phrase(rng, 4)
+            started = time.perf_counter()
+            vector.search(query)
+            search_times.append(time.perf_counter() - started)
+
+        return {
+            "layout": layout,
+            "agents": agents_count,
+            "tenants": tenants,
+            "save_full_s": save_full,
+            "save_incremental_s": save_incremental,
+            "load_per_agent_s": load_per_agent,
+            "load_bulk_s": load_bulk,
+            "search_p50_ms": statistics.median(search_times) * 1000,
+            "search_p95_ms": _percentile(search_times, 0.95) * 1000,
+            "vector_documents": len(vector.documents),
+            "disk_growth_bytes": disk_after - disk_before,
+        }
+    finally:
+        chroma_storage._client = None
+        chroma_storage._collections.clear()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _median_case(runs: list[dict]) -> dict:
+    result = dict(runs[0])
+    for key, value in runs[0].items():
+        if isinstance(value, float):
+            result[key] = statistics.median(r[key] for r in runs)
+    return result
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=Path(__file__).parent).stdout.strip()
+    except Exception:
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ChromaDB storage benchmark")
+    parser.add_argument("--agents", type=int, nargs="+", default=[5, 20, 100])
+    parser.add_argument("--layouts", nargs="+", default=["per_user", "shared"], choices=["per_user", "shared"])
+    parser.add_argument("--tenants", type=int, default=2, help="сколько ещё пользователей лежит в базе")
+    parser.add_argument("--repeat", type=int, default=3, help="повторов на случай (берётся медиана)")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", dest="json_path", default="storage_bench_results.json")
+    args = parser.parse_args()
+
+    chroma_storage.storage_writer.enabled = False  # мерим запись, а не постановку в очередь
+
+    results = []
+    for layout in args.layouts:
+        for count in args.agents:
+            runs = [run_case(layout, count, args.tenants, args.queries, args.seed + r) for r in range(args.repeat)]
+            case = _median_case(runs)
+            results.append(case)
+            print(f"{layout:9} agents={count:4}  save={case['save_full_s']:.3f}s  "
+                  f"incr={case['save_incremental_s']:.3f}s  load={case['load_per_agent_s']:.3f}s  "
+                  f"bulk={case['load_bulk_s']:.3f}s  search p50={case['search_p50_ms']:.2f}ms  "
+                  f"disk=+{case['disk_growth_bytes'] / 1024:.0f}KB")
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "chromadb": chromadb.__version__,
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    Path(args.json_path).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\nРезультаты: {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
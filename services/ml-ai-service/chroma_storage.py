@@ -11,21 +11,58 @@
   document  — текстовое содержимое (для встроенного embedding)
   metadata  — все структурированные поля (tick, importance, is_event и т.д.)
   id        — уникальный ключ записи
+
+Запись батчами:
+  with chroma_storage.write_batch():
+      ...  # save_* всех агентов
+  Внутри блока изменения копятся в памяти и при выходе уходят одним delete
+  и одним upsert на коллекцию (вместо отдельной серии запросов на каждого агента).
+
+Асинхронная запись:
+  Готовые батчи (и одиночные save_* вне батча) отдаются фоновому писателю
+  (StorageWriter) и пишутся в ChromaDB вне тика симуляции. Пока изменение
+  ждёт записи, следующее изменение той же записи его заменяет. Очередь
+  ограничена: при переполнении сохраняющий поток ждёт. Чтение коллекции
+  дожидается записи своих изменений, flush_writes() — всех (при остановке).
+
+Раскладка (CHROMA_LAYOUT):
+  per_user — у каждого пользователя свои коллекции {name}__{uid[:12]};
+             полный user_id — в метаданных коллекции (для list_tenants).
+  shared   — одна коллекция {name}__shared на вид данных; пользователь хранится
+             в метаданных user_id, ID записей имеют префикс "{user_id}::".
+             Число коллекций (файлов, HNSW-индексов) не растёт с числом пользователей,
+             а user_id используется целиком — без коллизий усечённого суффикса.
 """
 
+import atexit
 import json
 import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Optional
 
 import chromadb
 
-from config import CHROMA_DB_PATH
+from config import (
+    CHROMA_DB_PATH, CHROMA_LAYOUT, STORAGE_WRITER_ASYNC, STORAGE_WRITE_QUEUE_ROWS, STORAGE_RETRY_MAX_DELAY,
+)
+from slo import LatencyTracker
 
 
 _client: Optional[chromadb.ClientAPI] = None
 _client_lock = threading.Lock()
 
+# Кэш хэндлов коллекций: имя коллекции → Collection. Сбрасывается в reset_all.
+_collections: dict[str, chromadb.Collection] = {}
+
+_BASE_NAMES = ["agent_memory", "vector_memory", "scenario_state", "topic_state"]
+_TENANT_SEP = "::"
+_collections_lock = threading.Lock()
+
+# Активный батч записи текущего потока (см. write_batch)
+_batch_local = threading.local()
+
 
 def get_client() -> chromadb.ClientAPI:
     """Ленивая инициализация ChromaDB клиента (persistent). Потокобезопасно."""
@@ -39,26 +76,423 @@ def get_client() -> chromadb.ClientAPI:
     return _client
 
 
+def _is_shared(user_id: str) -> bool:
+    """Данные пользователя лежат в общей коллекции (а не в своей)."""
+    return bool(user_id) and CHROMA_LAYOUT == "shared"
+
+
+def _collection_name(name: str, user_id: str = "") -> str:
+    if _is_shared(user_id):
+        return f"{name}__shared"
+    # Изоляция по user_id: каждый пользователь получает свой набор коллекций
+    if user_id:
+        # ChromaDB ограничивает длину имени коллекции (63 символа)
+        # Используем последние 12 символов user_id как суффикс
+        safe_uid = user_id.replace('-', '_')[:12]
+        return f"{name}__{safe_uid}"
+    return name
+
+
 def get_collection(name: str, user_id: str = "") -> chromadb.Collection:
     """Получить или создать коллекцию. Embedding отключён (поиск свой, TF-IDF).
+
+    Хэндл кэшируется по имени коллекции — get_or_create_collection вызывается
+    один раз, а не на каждое сохранение.
     
     Args:
         name: Базовое имя коллекции.
         user_id: ID пользователя для изоляции данных. Если пусто — общая коллекция.
     """
-    client = get_client()
-    # Изоляция по user_id: каждый пользователь получает свой набор коллекций
-    if user_id:
-        # ChromaDB ограничивает длину имени коллекции (63 символа)
-        # Используем последние 12 символов user_id как суффикс
-        safe_uid = user_id.replace('-', '_')[:12]
-        collection_name = f"{name}__{safe_uid}"
-    else:
-        collection_name = name
-    return client.get_or_create_collection(
-        name=collection_name,
-        metadata={"hnsw:space": "cosine"},
-    )
+    collection_name = _collection_name(name, user_id)
+    col = _collections.get(collection_name)
+    if col is not None:
+        return col
+    with _collections_lock:
+        col = _collections.get(collection_name)
+        if col is None:
+            col = get_client().get_or_create_collection(
+                name=collection_name,
+                metadata={"hnsw:space": "cosine"},
+            )
+            if user_id and not _is_shared(user_id):
+                _tag_user(col, user_id)
+            _collections[collection_name] = col
+    return col
+
+
+def _tag_user(col: chromadb.Collection, user_id: str):
+    """Записать user_id в метаданные коллекции: в имени только усечённый суффикс."""
+    meta = col.metadata or {}
+    if meta.get("user_id") == user_id:
+        return
+    try:
+        # hnsw:* после создания менять нельзя — передаём только свои поля
+        col.modify(metadata={**{k: v for k, v in meta.items() if not k.startswith("hnsw:")},
+                             "user_id": user_id})
+    except Exception as e:
+        print(f"[ChromaDB] Не удалось пометить коллекцию {col.name}: {e}")
+
+
+# ---------------------------------------------------------------------------
+#  Тенанты (раскладка shared)
+# ---------------------------------------------------------------------------
+
+def _tenant_ids(user_id: str, ids: list[str]) -> list[str]:
+    """ID записей в физической коллекции: в shared-раскладке — с префиксом пользователя."""
+    if not _is_shared(user_id):
+        return list(ids)
+    prefix = f"{user_id}{_TENANT_SEP}"
+    return [prefix + doc_id for doc_id in ids]
+
+
+def _tenant_where(user_id: str, where: Optional[dict]) -> Optional[dict]:
+    """Фильтр с учётом пользователя (shared-раскладка)."""
+    if not _is_shared(user_id):
+        return where
+    if not where:
+        return {"user_id": user_id}
+    return {"$and": [{"user_id": user_id}] + [{k: v} for k, v in where.items()]}
+
+
+def _get_rows(name: str, user_id: str, where: Optional[dict] = None,
+              ids: Optional[list[str]] = None, include: Optional[list[str]] = None,
+              limit: Optional[int] = None) -> dict:
+    """col.get() с переводом ID/фильтров тенанта; возвращает ID без префикса."""
+    col = _collection_for_read(name, user_id=user_id)
+    kwargs = {"include": include if include is not None else ["documents", "metadatas"]}
+    if ids is not None:
+        kwargs["ids"] = _tenant_ids(user_id, ids)
+    if limit is not None:
+        kwargs["limit"] = limit
+    where = _tenant_where(user_id, where)
+    if where:
+        kwargs["where"] = where
+    result = col.get(**kwargs)
+    if result and result["ids"] and _is_shared(user_id):
+        cut = len(user_id) + len(_TENANT_SEP)
+        result["ids"] = [doc_id[cut:] for doc_id in result["ids"]]
+    return result
+
+
+def delete_tenant(user_id: str):
+    """Удалить все данные пользователя.
+
+    per_user — удаляются его коллекции; shared — его записи во всех общих коллекциях
+    (один delete по user_id на коллекцию).
+    """
+    if not user_id:
+        raise ValueError("delete_tenant: требуется user_id")
+    batch = getattr(_batch_local, "batch", None)
+    if batch is not None:
+        batch.discard_user(user_id)
+    storage_writer.discard_user(user_id)
+    if not _is_shared(user_id):
+        reset_all(user_id=user_id)
+        return
+    for name in _BASE_NAMES:
+        try:
+            get_collection(name, user_id=user_id).delete(where={"user_id": user_id})
+        except Exception:
+            pass
+
+
+# ---------------------------------------------------------------------------
+#  Батч записи
+# ---------------------------------------------------------------------------
+
+class _WriteBatch:
+    """Отложенные изменения по коллекциям; для каждого ID важна последняя операция."""
+
+    def __init__(self):
+        self._deletes: dict[tuple[str, str], set[str]] = {}
+        self._upserts: dict[tuple[str, str], dict[str, tuple[str, dict]]] = {}
+
+    def delete(self, key: tuple[str, str], ids: list[str]):
+        upserts = self._upserts.get(key, {})
+        deletes = self._deletes.setdefault(key, set())
+        for doc_id in ids:
+            upserts.pop(doc_id, None)
+            deletes.add(doc_id)
+
+    def upsert(self, key: tuple[str, str], ids: list[str], documents: list[str], metadatas: list[dict]):
+        deletes = self._deletes.get(key, set())
+        upserts = self._upserts.setdefault(key, {})
+        for doc_id, doc, meta in zip(ids, documents, metadatas):
+            deletes.discard(doc_id)
+            upserts[doc_id] = (doc, meta)
+
+    def has_pending(self, key: tuple[str, str]) -> bool:
+        return bool(self._deletes.get(key) or self._upserts.get(key))
+
+    def keys(self) -> set[tuple[str, str]]:
+        return {k for k, v in self._deletes.items() if v} | {k for k, v in self._upserts.items() if v}
+
+    def rows(self) -> int:
+        """Сколько записей ждёт отправки (после слияния)."""
+        return sum(len(v) for v in self._deletes.values()) + sum(len(v) for v in self._upserts.values())
+
+    def merge(self, other: "_WriteBatch"):
+        """Добавить более поздний батч: его операции побеждают наши по тем же ID."""
+        for key, ids in other._deletes.items():
+            self.delete(key, list(ids))
+        for key, rows in other._upserts.items():
+            upserts = self._upserts.setdefault(key, {})
+            deletes = self._deletes.get(key, set())
+            for doc_id, row in rows.items():
+                deletes.discard(doc_id)
+                upserts[doc_id] = row
+
+    def take(self) -> "_WriteBatch":
+        """Забрать накопленное в новый батч, этот — очистить."""
+        taken = _WriteBatch()
+        taken._deletes, self._deletes = self._deletes, {}
+        taken._upserts, self._upserts = self._upserts, {}
+        return taken
+
+    def discard_user(self, user_id: str):
+        """Выбросить отложенные изменения пользователя (его данные удаляются целиком)."""
+        for pending in (self._deletes, self._upserts):
+            for key in [k for k in pending if k[1] == user_id]:
+                del pending[key]
+
+    def flush(self):
+        """Передать накопленное писателю (см. StorageWriter)."""
+        if self.rows():
+            storage_writer.submit(self.take())
+
+    def apply(self):
+        """Записать в ChromaDB: по одному delete и одному upsert на коллекцию.
+        Батч очищается только после успешной записи (повтор идемпотентен)."""
+        for key in set(self._deletes) | set(self._upserts):
+            col = get_collection(*key)
+            if self._deletes.get(key):
+                _delete_ids(col, list(self._deletes[key]))
+            rows = self._upserts.get(key)
+            if rows:
+                ids = list(rows)
+                _upsert_batched(col, ids, [rows[i][0] for i in ids], [rows[i][1] for i in ids])
+        self._deletes, self._upserts = {}, {}
+
+
+class StorageWriter:
+    """
+    Фоновый писатель ChromaDB.
+
+    Принимает батчи и сливает их в один ожидающий батч: для каждого ключа
+    (коллекция, пользователь) и каждой записи остаётся последняя операция,
+    поэтому частые сохранения одного агента не пишутся в ChromaDB целиком
+    каждый раз. Очередь ограничена max_rows записями — при переполнении
+    submit() ждёт, пока писатель разгрузит очередь.
+
+    Память агентов считает запись сделанной, как только отдала её сюда
+    (diff-сохранение больше её не пришлёт), поэтому батч, который не удалось
+    записать, возвращается в очередь и повторяется с растущей паузой.
+    """
+
+    def __init__(self, max_rows: int = STORAGE_WRITE_QUEUE_ROWS, enabled: bool = STORAGE_WRITER_ASYNC):
+        self.max_rows = max_rows
+        self.enabled = enabled
+        self._pending = _WriteBatch()
+        self._in_flight: set[tuple[str, str]] = set()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self.coalesced_rows = 0  # сколько записей заменено до отправки
+        self.written_rows = 0
+        self.failed_batches = 0
+        self._failures = 0  # неудачных попыток подряд
+        self.flush_latency = LatencyTracker()  # запись одного батча в ChromaDB (для /metrics)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._loop, daemon=True, name="chroma-writer")
+            self._thread.start()
+
+    @property
+    def pending_rows(self) -> int:
+        with self._cond:
+            return self._pending.rows()
+
+    def submit(self, batch: _WriteBatch):
+        """Поставить батч в очередь (или записать сразу, если писатель выключен)."""
+        if not self.enabled:
+            with self._cond:
+                self._pending.merge(batch)  # вместе с тем, что не записалось в прошлый раз
+                self._apply_or_requeue(self._pending.take())
+            return
+        incoming = batch.rows()
+        with self._cond:
+            self._ensure_thread()
+            while self._pending.rows() >= self.max_rows and not self._stopping:
+                self._cond.wait()
+            before = self._pending.rows()
+            self._pending.merge(batch)
+            self.coalesced_rows += before + incoming - self._pending.rows()
+            self._cond.notify_all()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._pending.rows() and not self._stopping:
+                    self._cond.wait()
+                if not self._pending.rows():
+                    return
+                batch = self._pending.take()
+                self._in_flight = batch.keys()
+                self._cond.notify_all()  # место в очереди освободилось
+            try:
+                self._apply(batch)
+                self._failures = 0
+            except Exception as e:
+                self.failed_batches += 1
+                self._failures += 1
+                delay = min(STORAGE_RETRY_MAX_DELAY, 0.5 * 2 ** (self._failures - 1))
+                print(f"[ChromaDB] Ошибка фоновой записи ({batch.rows()} записей), "
+                      f"повтор через {delay:.1f} с: {e}")
+                with self._cond:
+                    if self._stopping:
+                        print(f"[ChromaDB] Остановка: {batch.rows()} записей не записано")
+                        self._in_flight = set()
+                        self._cond.notify_all()
+                        return
+                    self._requeue(batch)
+                    self._in_flight = set()
+                    self._cond.notify_all()
+                    self._cond.wait_for(lambda: self._stopping, timeout=delay)
+                continue
+            with self._cond:
+                self._in_flight = set()
+                self._cond.notify_all()
+
+    def _requeue(self, batch: _WriteBatch):
+        """Вернуть незаписанный батч в очередь (под self._cond): более поздние изменения побеждают."""
+        batch.merge(self._pending)
+        self._pending = batch
+
+    def _apply_or_requeue(self, batch: _WriteBatch):
+        """Записать в этом потоке (под self._cond); при ошибке батч остаётся в очереди."""
+        try:
+            self._apply(batch)
+        except Exception:
+            self.failed_batches += 1
+            self._requeue(batch)
+            raise
+
+    def _apply(self, batch: _WriteBatch):
+        rows = batch.rows()
+        started = time.perf_counter()
+        batch.apply()
+        self.flush_latency.record(time.perf_counter() - started)
+        self.written_rows += rows
+
+    def wait_for(self, key: tuple[str, str]):
+        """Дождаться записи всех изменений ключа (перед чтением)."""
+        with self._cond:
+            while self._pending.has_pending(key) or key in self._in_flight:
+                self._cond.wait()
+
+    def discard_user(self, user_id: str):
+        """Выбросить ожидающие изменения пользователя и дождаться уже отправленных."""
+        with self._cond:
+            self._pending.discard_user(user_id)
+            while any(k[1] == user_id for k in self._in_flight):
+                self._cond.wait()
+            self._pending.discard_user(user_id)  # неудачная запись могла вернуться в очередь
+            self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Дождаться записи всей очереди. False — не успели за timeout."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            while self._pending.rows() or self._in_flight:
+                if self._thread is None or not self._thread.is_alive():
+                    self._apply_or_requeue(self._pending.take())  # поток не запущен — пишем сами
+                    continue
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stop(self, timeout: float = 30.0):
+        """Записать очередь и остановить поток. Если ChromaDB так и не ответила — отказаться."""
+        if not self.flush(timeout):
+            print(f"[ChromaDB] Не записано при остановке: {self.pending_rows} записей")
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+
+
+storage_writer = StorageWriter()
+
+
+def flush_writes():
+    """Синхронно дописать все отложенные изменения (при остановке сервиса)."""
+    storage_writer.flush()
+
+
+atexit.register(storage_writer.stop)
+
+
+@contextmanager
+def write_batch():
+    """Собрать все записи внутри блока и отправить их одним набором запросов.
+
+    Вложенные блоки присоединяются к внешнему. Чтение коллекции внутри блока
+    сначала сбрасывает накопленные изменения, поэтому load_* видят свои записи.
+    """
+    outer = getattr(_batch_local, "batch", None)
+    if outer is not None:
+        yield outer
+        return
+    batch = _WriteBatch()
+    _batch_local.batch = batch
+    try:
+        yield batch
+    finally:
+        _batch_local.batch = None
+        batch.flush()
+
+
+def _stage_delete(name: str, user_id: str, ids: list[str]):
+    ids = _tenant_ids(user_id, ids)
+    batch = getattr(_batch_local, "batch", None)
+    if batch is not None:
+        batch.delete((name, user_id), ids)
+    elif ids:
+        single = _WriteBatch()
+        single.delete((name, user_id), ids)
+        storage_writer.submit(single)
+
+
+def _stage_upsert(name: str, user_id: str, ids: list[str], documents: list[str], metadatas: list[dict]):
+    if _is_shared(user_id):
+        ids = _tenant_ids(user_id, ids)
+        metadatas = [dict(meta, user_id=user_id) for meta in metadatas]
+    batch = getattr(_batch_local, "batch", None)
+    if batch is not None:
+        batch.upsert((name, user_id), ids, documents, metadatas)
+    elif ids:
+        single = _WriteBatch()
+        single.upsert((name, user_id), ids, documents, metadatas)
+        storage_writer.submit(single)
+
+
+def _collection_for_read(name: str, user_id: str = "") -> chromadb.Collection:
+    """Коллекция для чтения: сначала дожидаемся записи своих отложенных изменений."""
+    _settle(name, user_id)
+    return get_collection(name, user_id=user_id)
+
+
+def _settle(name: str, user_id: str = ""):
+    """Отправить батч текущего потока и дождаться, пока писатель запишет ключ."""
+    batch = getattr(_batch_local, "batch", None)
+    if batch is not None and batch.has_pending((name, user_id)):
+        batch.flush()
+    storage_writer.wait_for((name, user_id))
 
 
 def _meta_safe(value) -> str | int | float | bool:
@@ -70,62 +504,84 @@ def _meta_safe(value) -> str | int | float | bool:
     return str(value)
 
 
+# ---------------------------------------------------------------------------
+#  ID записей
+# ---------------------------------------------------------------------------
+#
+# Воспоминания и векторные документы имеют стабильные ID (не зависят от позиции
+# в списке), поэтому при сохранении пишутся только новые/изменённые записи,
+# а удаляются только вытесненные. completed_actions и group_decisions — короткие
+# списки с ограниченной длиной, для них остаются позиционные ID.
+
+def memory_doc_id(agent_id: str, memory_id: str) -> str:
+    """ID записи воспоминания в коллекции agent_memory."""
+    return f"{agent_id}__mem__{memory_id}"
+
+
+def action_doc_id(agent_id: str, idx: int) -> str:
+    """ID записи выполненного действия (позиционный)."""
+    return f"{agent_id}__act__{idx}"
+
+
+def decision_doc_id(agent_id: str, idx: int) -> str:
+    """ID записи решения группы (позиционный)."""
+    return f"{agent_id}__gd__{idx}"
+
+
+def vector_doc_id(agent_id: str, doc_id: str) -> str:
+    """ID документа в коллекции vector_memory."""
+    return f"{agent_id}__vec__{doc_id}"
+
+
 # ---------------------------------------------------------------------------
 #  Agent Memory (short_term + long_term)
 # ---------------------------------------------------------------------------
 
-def save_agent_memories(agent_id: str, short_term: list[dict], long_term: list[dict],
-                        completed_actions: list[str], group_decisions: list[dict],
+def _memory_metadata(agent_id: str, mem: dict) -> dict:
+    return {
+        "agent_id": agent_id,
+        "layer": mem.get("layer", "short_term"),
+        "memory_id": _meta_safe(mem.get("memory_id", "")),
+        "tick": _meta_safe(mem.get("tick", 0)),
+        "speaker": _meta_safe(mem.get("speaker", "")),
+        "speaker_id": _meta_safe(mem.get("speaker_id", "")),
+        "timestamp": _meta_safe(mem.get("timestamp", "")),
+        "importance": float(mem.get("importance", 0.5)),
+        "addressed_to": _meta_safe(mem.get("addressed_to", "")),
+        "addressed_to_id": _meta_safe(mem.get("addressed_to_id", "")),
+        "is_event": bool(mem.get("is_event", False)),
+        "is_action_result": bool(mem.get("is_action_result", False)),
+    }
+
+
+def save_agent_memories(agent_id: str, memories: list[dict],
+                        deleted_ids: Optional[list[str]] = None,
+                        completed_actions: Optional[list[str]] = None,
+                        group_decisions: Optional[list[dict]] = None,
                         user_id: str = ""):
-    """Полное сохранение памяти агента в ChromaDB."""
-    col = get_collection("agent_memory", user_id=user_id)
+    """Инкрементальное сохранение памяти агента в ChromaDB.
 
-    # Удаляем старые записи этого агента
-    _delete_by_prefix(col, agent_id)
+    Args:
+        memories: Только новые/изменённые воспоминания. Каждое — dict полей
+            MemoryItem + ключ "layer" ("short_term" / "long_term").
+        deleted_ids: ID записей, которые нужно удалить (вытесненные).
+        completed_actions: Полный список действий, если он изменился (иначе None).
+        group_decisions: Полный список решений, если он изменился (иначе None).
+    """
+    if deleted_ids:
+        _stage_delete("agent_memory", user_id, deleted_ids)
 
     ids = []
     documents = []
     metadatas = []
 
-    for idx, mem in enumerate(short_term):
-        doc_id = f"{agent_id}__st__{idx}"
-        ids.append(doc_id)
+    for mem in memories:
+        ids.append(memory_doc_id(agent_id, mem["memory_id"]))
         documents.append(mem.get("text", ""))
-        metadatas.append({
-            "agent_id": agent_id,
-            "layer": "short_term",
-            "tick": _meta_safe(mem.get("tick", 0)),
-            "speaker": _meta_safe(mem.get("speaker", "")),
-            "speaker_id": _meta_safe(mem.get("speaker_id", "")),
-            "timestamp": _meta_safe(mem.get("timestamp", "")),
-            "importance": float(mem.get("importance", 0.5)),
-            "addressed_to": _meta_safe(mem.get("addressed_to", "")),
-            "addressed_to_id": _meta_safe(mem.get("addressed_to_id", "")),
-            "is_event": bool(mem.get("is_event", False)),
-            "is_action_result": bool(mem.get("is_action_result", False)),
-        })
+        metadatas.append(_memory_metadata(agent_id, mem))
 
-    for idx, mem in enumerate(long_term):
-        doc_id = f"{agent_id}__lt__{idx}"
-        ids.append(doc_id)
-        documents.append(mem.get("text", ""))
-        metadatas.append({
-            "agent_id": agent_id,
-            "layer": "long_term",
-            "tick": _meta_safe(mem.get("tick", 0)),
-            "speaker": _meta_safe(mem.get("speaker", "")),
-            "speaker_id": _meta_safe(mem.get("speaker_id", "")),
-            "timestamp": _meta_safe(mem.get("timestamp", "")),
-            "importance": float(mem.get("importance", 0.5)),
-            "addressed_to": _meta_safe(mem.get("addressed_to", "")),
-            "addressed_to_id": _meta_safe(mem.get("addressed_to_id", "")),
-            "is_event": bool(mem.get("is_event", False)),
-            "is_action_result": bool(mem.get("is_action_result", False)),
-        })
-
-    for idx, action in enumerate(completed_actions):
-        doc_id = f"{agent_id}__act__{idx}"
-        ids.append(doc_id)
+    for idx, action in enumerate(completed_actions or []):
+        ids.append(action_doc_id(agent_id, idx))
         documents.append(action)
         metadatas.append({
             "agent_id": agent_id,
@@ -141,9 +597,8 @@ def save_agent_memories(agent_id: str, short_term: list[dict], long_term: list[d
             "addressed_to_id": "",
         })
 
-    for idx, decision in enumerate(group_decisions):
-        doc_id = f"{agent_id}__gd__{idx}"
-        ids.append(doc_id)
+    for idx, decision in enumerate(group_decisions or []):
+        ids.append(decision_doc_id(agent_id, idx))
         documents.append(decision.get("decision", ""))
         metadatas.append({
             "agent_id": agent_id,
@@ -160,49 +615,37 @@ def save_agent_memories(agent_id: str, short_term: list[dict], long_term: list[d
         })
 
     if ids:
-        _upsert_batched(col, ids, documents, metadatas)
+        _stage_upsert("agent_memory", user_id, ids, documents, metadatas)
 
 
 def load_agent_memories(agent_id: str, user_id: str = "") -> dict:
-    """Загрузить память агента из ChromaDB. Возвращает dict с ключами short_term/long_term/completed_actions/group_decisions."""
-    col = get_collection("agent_memory", user_id=user_id)
+    """Загрузить память агента из ChromaDB.
+
+    Возвращает dict с ключами short_term/long_term/completed_actions/group_decisions
+    и legacy_ids — ID записей старого (позиционного) формата, которые нужно
+    удалить при следующем сохранении.
+    """
+    result = _get_rows("agent_memory", user_id, where={"agent_id": agent_id})
+    if not result or not result["ids"]:
+        return _parse_agent_memory_rows([])
+    return _parse_agent_memory_rows(zip(result["ids"], result["documents"], result["metadatas"]))
 
-    result = col.get(
-        where={"agent_id": agent_id},
-        include=["documents", "metadatas"],
-    )
 
+def _parse_agent_memory_rows(rows) -> dict:
+    """Строки agent_memory одного агента (id, document, metadata) → dict памяти."""
     short_term = []
     long_term = []
-    completed_actions = []
-    group_decisions = []
-
-    if not result or not result["ids"]:
-        return {
-            "short_term": short_term,
-            "long_term": long_term,
-            "completed_actions": completed_actions,
-            "group_decisions": group_decisions,
-        }
-
-    for doc, meta in zip(result["documents"], result["metadatas"]):
+    legacy_ids = []
+    actions_by_idx = []
+    decisions_by_idx = []
+    for doc_id, doc, meta in rows:
         layer = meta.get("layer", "")
 
-        if layer == "short_term":
-            short_term.append({
-                "tick": meta.get("tick", 0),
-                "speaker": meta.get("speaker", ""),
-                "text": doc,
-                "timestamp": meta.get("timestamp", ""),
-                "importance": meta.get("importance", 0.5),
-                "speaker_id": meta.get("speaker_id", ""),
-                "addressed_to": meta.get("addressed_to", ""),
-                "addressed_to_id": meta.get("addressed_to_id", ""),
-                "is_event": meta.get("is_event", False),
-                "is_action_result": meta.get("is_action_result", False),
-            })
-        elif layer == "long_term":
-            long_term.append({
+        if layer in ("short_term", "long_term"):
+            memory_id = meta.get("memory_id", "")
+            if not memory_id:
+                legacy_ids.append(doc_id)  # старый позиционный ID — пересохраним
+            item = {
                 "tick": meta.get("tick", 0),
                 "speaker": meta.get("speaker", ""),
                 "text": doc,
@@ -213,26 +656,33 @@ def load_agent_memories(agent_id: str, user_id: str = "") -> dict:
                 "addressed_to_id": meta.get("addressed_to_id", ""),
                 "is_event": meta.get("is_event", False),
                 "is_action_result": meta.get("is_action_result", False),
-            })
+                "memory_id": memory_id,
+            }
+            (short_term if layer == "short_term" else long_term).append(item)
         elif layer == "completed_actions":
-            completed_actions.append(doc)
+            actions_by_idx.append((_positional_index(doc_id), doc))
         elif layer == "group_decisions":
-            group_decisions.append({
+            decisions_by_idx.append((_positional_index(doc_id), {
                 "tick": meta.get("tick", 0),
                 "proposer": meta.get("speaker", ""),
                 "proposer_id": meta.get("speaker_id", ""),
                 "decision": doc,
-            })
+            }))
 
     # Сортируем по tick для правильного порядка
     short_term.sort(key=lambda m: m.get("tick", 0))
     long_term.sort(key=lambda m: m.get("tick", 0))
+    actions_by_idx.sort(key=lambda x: x[0])
+    decisions_by_idx.sort(key=lambda x: x[0])
+    completed_actions = [a for _, a in actions_by_idx]
+    group_decisions = [d for _, d in decisions_by_idx]
 
     return {
         "short_term": short_term,
         "long_term": long_term,
         "completed_actions": completed_actions,
         "group_decisions": group_decisions,
+        "legacy_ids": legacy_ids,
     }
 
 
@@ -240,10 +690,17 @@ def load_agent_memories(agent_id: str, user_id: str = "") -> dict:
 #  Vector Memory (документы для TF-IDF поиска)
 # ---------------------------------------------------------------------------
 
-def save_vector_documents(agent_id: str, documents: list[dict], user_id: str = ""):
-    """Сохранить документы векторной памяти агента."""
-    col = get_collection("vector_memory", user_id=user_id)
-    _delete_by_prefix(col, agent_id)
+def save_vector_documents(agent_id: str, documents: list[dict],
+                          deleted_ids: Optional[list[str]] = None,
+                          user_id: str = ""):
+    """Инкрементально сохранить документы векторной памяти агента.
+
+    Args:
+        documents: Только новые/изменённые документы (dict с ключом "doc_id").
+        deleted_ids: ID вытесненных документов.
+    """
+    if deleted_ids:
+        _stage_delete("vector_memory", user_id, deleted_ids)
 
     if not documents:
         return
@@ -252,12 +709,12 @@ def save_vector_documents(agent_id: str, documents: list[dict], user_id: str = "
     docs = []
     metas = []
 
-    for idx, vdoc in enumerate(documents):
-        doc_id = f"{agent_id}__vd__{idx}"
-        ids.append(doc_id)
+    for vdoc in documents:
+        ids.append(vector_doc_id(agent_id, vdoc["doc_id"]))
         docs.append(vdoc.get("text", ""))
         metas.append({
             "agent_id": agent_id,
+            "doc_id": _meta_safe(vdoc.get("doc_id", "")),
             "tick": _meta_safe(vdoc.get("tick", 0)),
             "importance": float(vdoc.get("importance", 0.5)),
             "is_event": bool(vdoc.get("is_event", False)),
@@ -265,31 +722,38 @@ def save_vector_documents(agent_id: str, documents: list[dict], user_id: str = "
             "speaker_id": _meta_safe(vdoc.get("speaker_id", "")),
         })
 
-    _upsert_batched(col, ids, docs, metas)
+    _stage_upsert("vector_memory", user_id, ids, docs, metas)
 
 
 def load_vector_documents(agent_id: str, user_id: str = "") -> list[dict]:
-    """Загрузить документы векторной памяти агента."""
-    col = get_collection("vector_memory", user_id=user_id)
+    """Загрузить документы векторной памяти агента.
 
-    result = col.get(
-        where={"agent_id": agent_id},
-        include=["documents", "metadatas"],
-    )
+    Документы старого формата (без doc_id) возвращаются с пустым doc_id
+    и ключом "legacy_id" — их нужно пересохранить под стабильным ID.
+    """
+    result = _get_rows("vector_memory", user_id, where={"agent_id": agent_id})
+    if not result or not result["ids"]:
+        return []
+    return _parse_vector_rows(zip(result["ids"], result["documents"], result["metadatas"]))
 
-    documents = []
-    if result and result["ids"]:
-        for doc, meta in zip(result["documents"], result["metadatas"]):
-            documents.append({
-                "text": doc,
-                "tick": meta.get("tick", 0),
-                "importance": meta.get("importance", 0.5),
-                "is_event": meta.get("is_event", False),
-                "speaker": meta.get("speaker", ""),
-                "speaker_id": meta.get("speaker_id", ""),
-            })
-        documents.sort(key=lambda d: d.get("tick", 0))
 
+def _parse_vector_rows(rows) -> list[dict]:
+    """Строки vector_memory одного агента (id, document, metadata) → документы по tick."""
+    documents = []
+    for row_id, doc, meta in rows:
+        item = {
+            "text": doc,
+            "tick": meta.get("tick", 0),
+            "importance": meta.get("importance", 0.5),
+            "is_event": meta.get("is_event", False),
+            "speaker": meta.get("speaker", ""),
+            "speaker_id": meta.get("speaker_id", ""),
+            "doc_id": meta.get("doc_id", ""),
+        }
+        if not item["doc_id"]:
+            item["legacy_id"] = row_id
+        documents.append(item)
+    documents.sort(key=lambda d: d.get("tick", 0))
     return documents
 
 
@@ -298,18 +762,9 @@ def load_vector_documents(agent_id: str, user_id: str = "") -> list[dict]:
 # ---------------------------------------------------------------------------
 
 def save_scenario_state(scenario_name: str, events_triggered: list[str], user_id: str = ""):
-    """Сохранить состояние сценария."""
-    col = get_collection("scenario_state", user_id=user_id)
-
-    # Удаляем старое состояние
-    try:
-        existing = col.get(where={"kind": "scenario"}, include=[])
-        if existing and existing["ids"]:
-            col.delete(ids=existing["ids"])
-    except Exception:
-        pass
-
-    col.upsert(
+    """Сохранить состояние сценария (одна запись с фиксированным ID — upsert её заменяет)."""
+    _stage_upsert(
+        "scenario_state", user_id,
         ids=["scenario__current"],
         documents=[json.dumps(events_triggered, ensure_ascii=False)],
         metadatas=[{
@@ -321,12 +776,8 @@ def save_scenario_state(scenario_name: str, events_triggered: list[str], user_id
 
 def load_scenario_state(user_id: str = "") -> dict:
     """Загрузить состояние сценария."""
-    col = get_collection("scenario_state", user_id=user_id)
     try:
-        result = col.get(
-            ids=["scenario__current"],
-            include=["documents", "metadatas"],
-        )
+        result = _get_rows("scenario_state", user_id, ids=["scenario__current"])
         if result and result["ids"]:
             events = json.loads(result["documents"][0])
             return {"events_triggered": events}
@@ -341,17 +792,9 @@ def load_scenario_state(user_id: str = "") -> dict:
 
 def save_topic_state(current_topic: Optional[str], messages_on_topic: int,
                      discussed_topics: list[str], user_id: str = ""):
-    """Сохранить состояние тем."""
-    col = get_collection("topic_state", user_id=user_id)
-
-    try:
-        existing = col.get(where={"kind": "topic"}, include=[])
-        if existing and existing["ids"]:
-            col.delete(ids=existing["ids"])
-    except Exception:
-        pass
-
-    col.upsert(
+    """Сохранить состояние тем (одна запись с фиксированным ID — upsert её заменяет)."""
+    _stage_upsert(
+        "topic_state", user_id,
         ids=["topic__current"],
         documents=[json.dumps({
             "current_topic": current_topic,
@@ -364,12 +807,8 @@ def save_topic_state(current_topic: Optional[str], messages_on_topic: int,
 
 def load_topic_state(user_id: str = "") -> dict:
     """Загрузить состояние тем."""
-    col = get_collection("topic_state", user_id=user_id)
     try:
-        result = col.get(
-            ids=["topic__current"],
-            include=["documents"],
-        )
+        result = _get_rows("topic_state", user_id, ids=["topic__current"], include=["documents"])
         if result and result["ids"]:
             return json.loads(result["documents"][0])
     except Exception:
@@ -381,21 +820,144 @@ def load_topic_state(user_id: str = "") -> dict:
     }
 
 
+# ---------------------------------------------------------------------------
+#  Гидрация сессии целиком
+# ---------------------------------------------------------------------------
+
+def tenant_exists(user_id: str = "") -> bool:
+    """Есть ли у пользователя сохранённая память (per_user — без создания коллекций)."""
+    _settle("agent_memory", user_id)
+    if not _is_shared(user_id):
+        name = _collection_name("agent_memory", user_id)
+        if name not in _collections:
+            try:
+                get_client().get_collection(name)
+            except Exception:
+                return False
+    result = _get_rows("agent_memory", user_id, include=[], limit=1)
+    return bool(result and result["ids"])
+
+
+def empty_session_state() -> dict:
+    """Состояние новой сессии: агентов нет, темы и сценарий по умолчанию."""
+    return {
+        "agents": {},
+        "topic": {"current_topic": None, "messages_on_topic": 0, "discussed_topics": []},
+        "scenario": {"events_triggered": []},
+    }
+
+
+def load_session_state(user_id: str = "") -> dict:
+    """Загрузить всё состояние сессии: по одному get на коллекцию.
+
+    Возвращает {"agents": {agent_id: {"memory": ..., "vector": ...}},
+    "topic": ..., "scenario": ...} в тех же форматах, что load_agent_memories,
+    load_vector_documents, load_topic_state и load_scenario_state.
+    Для новой сессии (tenant_exists() == False) запросов к коллекциям не делает.
+    """
+    state = empty_session_state()
+    if not tenant_exists(user_id):
+        return state
+
+    memory_rows: dict[str, list] = {}
+    result = _get_rows("agent_memory", user_id)
+    if result and result["ids"]:
+        for row in zip(result["ids"], result["documents"], result["metadatas"]):
+            memory_rows.setdefault(row[2].get("agent_id", ""), []).append(row)
+
+    vector_rows: dict[str, list] = {}
+    result = _get_rows("vector_memory", user_id)
+    if result and result["ids"]:
+        for row in zip(result["ids"], result["documents"], result["metadatas"]):
+            vector_rows.setdefault(row[2].get("agent_id", ""), []).append(row)
+
+    for agent_id in memory_rows.keys() | vector_rows.keys():
+        state["agents"][agent_id] = {
+            "memory": _parse_agent_memory_rows(memory_rows.get(agent_id, [])),
+            "vector": _parse_vector_rows(vector_rows.get(agent_id, [])),
+        }
+
+    state["topic"] = load_topic_state(user_id)
+    state["scenario"] = load_scenario_state(user_id)
+    return state
+
+
+def agent_state(session_state: dict, agent_id: str) -> dict:
+    """Память агента из load_session_state() (пустая, если агента там нет)."""
+    found = session_state["agents"].get(agent_id)
+    if found is not None:
+        return found
+    return {"memory": _parse_agent_memory_rows([]), "vector": []}
+
+
+# ---------------------------------------------------------------------------
+#  Перенос пользователя в другое хранилище (воркеры, см. router.py)
+# ---------------------------------------------------------------------------
+
+def list_tenants() -> list[str]:
+    """user_id всех пользователей с памятью в этом хранилище.
+
+    per_user — по метаданным коллекций памяти (коллекции, созданные до появления
+    метки, находятся после первого обращения к ним); shared — полный проход
+    по метаданным общей коллекции, поэтому только для редких служебных вызовов.
+    """
+    storage_writer.flush()
+    client = get_client()
+    if CHROMA_LAYOUT == "shared":
+        try:
+            result = client.get_collection("agent_memory__shared").get(include=["metadatas"])
+        except Exception:
+            return []
+        return sorted({m["user_id"] for m in result["metadatas"] if m and m.get("user_id")})
+    users = set()
+    for col in client.list_collections():
+        user_id = (col.metadata or {}).get("user_id")
+        if user_id and col.name.startswith("agent_memory__"):
+            users.add(user_id)
+    return sorted(users)
+
+
+def export_tenant(user_id: str) -> Optional[dict]:
+    """Все записи пользователя по коллекциям: {name: {ids, documents, metadatas}}.
+    None — памяти у пользователя нет."""
+    if not tenant_exists(user_id):
+        return None
+    rows = {}
+    for name in _BASE_NAMES:
+        result = _get_rows(name, user_id)
+        rows[name] = {key: result[key] or [] for key in ("ids", "documents", "metadatas")}
+    return rows
+
+
+def import_tenant(user_id: str, rows: dict):
+    """Записать данные export_tenant() в это хранилище; возвращается после записи."""
+    if not user_id:
+        raise ValueError("import_tenant: требуется user_id")
+    with write_batch():
+        for name in _BASE_NAMES:
+            data = rows.get(name) or {}
+            _stage_upsert(name, user_id, list(data.get("ids", [])),
+                          list(data.get("documents", [])), list(data.get("metadatas", [])))
+    for name in _BASE_NAMES:
+        _settle(name, user_id)
+
+
 # ---------------------------------------------------------------------------
 #  Утилиты
 # ---------------------------------------------------------------------------
 
-def _delete_by_prefix(col: chromadb.Collection, prefix: str):
-    """Удалить все записи с id, начинающимся на prefix."""
+def _positional_index(doc_id: str) -> int:
+    """Индекс из позиционного ID вида '{agent_id}__act__{idx}'."""
     try:
-        result = col.get(
-            where={"agent_id": prefix},
-            include=[],
-        )
-        if result and result["ids"]:
-            col.delete(ids=result["ids"])
-    except Exception:
-        pass
+        return int(doc_id.rsplit("__", 1)[-1])
+    except ValueError:
+        return 0
+
+
+def _delete_ids(col: chromadb.Collection, ids: list[str], batch_size: int = 500):
+    """Удалить записи по ID (с разбивкой на батчи)."""
+    for i in range(0, len(ids), batch_size):
+        col.delete(ids=ids[i:i + batch_size])
 
 
 def _upsert_batched(col: chromadb.Collection, ids: list, documents: list,
@@ -416,15 +978,17 @@ def reset_all(user_id: str = ""):
         user_id: Если указан — сброс данных только этого пользователя.
                  Если пусто — сброс глобальных (legacy) данных.
     """
+    storage_writer.discard_user(user_id)
+    if _is_shared(user_id):
+        # Общие коллекции не удаляем — только записи пользователя
+        delete_tenant(user_id)
+        return
     client = get_client()
-    base_names = ["agent_memory", "vector_memory", "scenario_state", "topic_state"]
-    for name in base_names:
-        if user_id:
-            safe_uid = user_id.replace('-', '_')[:12]
-            col_name = f"{name}__{safe_uid}"
-        else:
-            col_name = name
+    for name in _BASE_NAMES:
+        collection_name = _collection_name(name, user_id)
+        with _collections_lock:
+            _collections.pop(collection_name, None)
         try:
-            client.delete_collection(col_name)
+            client.delete_collection(collection_name)
         except Exception:
             pass
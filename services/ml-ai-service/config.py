@@ -16,12 +16,15 @@ LLM_MODEL = os.getenv("OLLAMA_MODEL", "qwen-3-14b-instruct")
 LLM_TIMEOUT = 60
 LLM_MAX_RETRIES = 3
 LLM_RETRY_DELAY = 2.0
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))  # одновременных запросов к LLM на процесс
 
 # --- Audit ---
 # В Docker: http://go-backend:8083/api/v1/audit/events
 # Локально: http://localhost:8083/api/v1/audit/events (если Go-бэкенд запущен)
 AUDIT_API_URL = os.getenv("AUDIT_API_URL", "http://go-backend:8083/api/v1/audit/events")
 AUDIT_JWT_TOKEN = os.getenv("AUDIT_JWT_TOKEN", "")
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "1000"))  # событий в очереди; лишние отбрасываются
+AUDIT_SENDERS = 2  # потоков отправки
 
 # --- Симуляция ---
 MAX_TICKS = 150
@@ -39,7 +42,65 @@ IMPORTANCE_DECAY_FACTOR = 0.97
 EPISODE_GAP_TICKS = 3
 
 # --- ChromaDB ---
-CHROMA_DB_PATH = "data/chroma_db"
+CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH", "data/chroma_db")  # у каждого воркера (--workers) своя база, см. main.run_workers
+# Раскладка коллекций:
+#   per_user — 4 коллекции на пользователя (agent_memory__{uid} и т.д.)
+#   shared   — 4 общие коллекции, пользователь — поле user_id в метаданных
+CHROMA_LAYOUT = os.getenv("CHROMA_LAYOUT", "per_user")
+# Фоновая запись: изменения пишутся отдельным потоком, вне тика симуляции
+STORAGE_WRITER_ASYNC = os.getenv("STORAGE_WRITER_ASYNC", "1") == "1"
+STORAGE_WRITE_QUEUE_ROWS = int(os.getenv("STORAGE_WRITE_QUEUE_ROWS", "5000"))  # лимит очереди (записей)
+STORAGE_RETRY_MAX_DELAY = 30.0  # потолок паузы между повторами неудавшейся записи (сек)
+
+# --- API ---
+API_BLOCKING_WORKERS = int(os.getenv("API_BLOCKING_WORKERS", "16"))  # потоки для коротких блокирующих вызовов
+API_SESSION_WORKERS = int(os.getenv("API_SESSION_WORKERS", "64"))  # потоки для работы под lock'ом сессии (сообщения)
+JOB_TTL_SECONDS = float(os.getenv("JOB_TTL_SECONDS", "600"))  # сколько хранить завершённую задачу
+JOB_MAX_STORED = 10000
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))  # пинг в тихом стриме (SSE и WebSocket)
+WS_QUEUE_FRAMES = int(os.getenv("WS_QUEUE_FRAMES", "1000"))  # кадров в очереди медленного клиента
+USER_REPLY_SLO_SECONDS = float(os.getenv("USER_REPLY_SLO_SECONDS", "15"))  # цель: ответы агентов пользователю
+SLO_WINDOW = 1000  # последних замеров в окне
+# Допуск сообщений пользователя (admission.py)
+USER_MESSAGE_RATE = float(os.getenv("USER_MESSAGE_RATE", "0.5"))  # LLM-ответов агентов в секунду на пользователя
+USER_MESSAGE_BURST = float(os.getenv("USER_MESSAGE_BURST", "10"))  # запас токенов (ёмкость ведра)
+USER_MAX_PENDING_MESSAGES = int(os.getenv("USER_MAX_PENDING_MESSAGES", "3"))  # сообщений в работе на сессию
+LLM_SHED_QUEUE_SECONDS = float(os.getenv("LLM_SHED_QUEUE_SECONDS", "10"))  # ожидание LLM-слота, после которого — 503
+ADMISSION_RETRY_AFTER = 2  # Retry-After (сек), когда оценки точнее нет
+
+# --- Несколько воркеров (python main.py --api --workers N) ---
+# Роутер (router.py) держит список воркеров и направляет запросы пользователя его воркеру
+ROUTER_WORKERS = os.getenv("ML_WORKERS", "")  # через запятую: http://127.0.0.1:8084,...
+ROUTER_CONNECT_TIMEOUT = 10.0
+# Воркеры вне ring, чьи сессии роутер при старте переносит владельцам (--workers с меньшим N)
+ROUTER_DRAIN_WORKERS = os.getenv("ML_DRAIN_WORKERS", "")
+ROUTER_STARTUP_TIMEOUT = 120.0  # сколько роутер при старте ждёт воркеры перед раскладкой сессий
+# Общий секрет служебных эндпоинтов (internal_auth.py); --workers генерирует его сам, если не задан
+INTERNAL_API_TOKEN = os.getenv("ML_INTERNAL_TOKEN", "")
+
+# --- Гибернация сессий ---
+# Холодные сессии сохраняются снапшотом на диск и выгружаются из памяти
+HIBERNATION_DIR = os.getenv("HIBERNATION_DIR", "data/hibernated")
+SESSION_IDLE_TIMEOUT = float(os.getenv("SESSION_IDLE_TIMEOUT", "1800"))  # сек без запросов
+SESSION_MAX_RESIDENT = int(os.getenv("SESSION_MAX_RESIDENT", "100"))  # сессий в памяти
+SESSION_MEMORY_BUDGET_MB = float(os.getenv("SESSION_MEMORY_BUDGET_MB", "1024"))  # 0 — без лимита
+SESSION_MIN_IDLE = 30.0  # сессии с запросами за последние N сек не выгружаются
+HIBERNATION_CHECK_INTERVAL = 30.0
+SESSION_DRAIN_TIMEOUT = 120.0  # сколько перенос сессии ждёт уже принятые сообщения
+
+# --- Пул заранее собранных сессий ---
+# Сколько готовых миров держать на каждую пару (сценарий, расовый пресет)
+ORCHESTRATOR_POOL_DEPTH = int(os.getenv("ORCHESTRATOR_POOL_DEPTH", "2"))  # 0 — пул выключен
+# Пары, которые прогреваются при старте ("сценарий:пресет" через запятую);
+# остальные — после первого запроса
+ORCHESTRATOR_POOL_PREWARM = os.getenv("ORCHESTRATOR_POOL_PREWARM", "desert_island:humans")
+
+# --- Архив диалога ---
+# В памяти держится хвост истории, старые записи уходят в сегменты на диске
+CONVERSATION_DIR = "data/conversations"
+CONVERSATION_RESIDENT = int(os.getenv("CONVERSATION_RESIDENT", "500"))  # записей в памяти
+CONVERSATION_SPILL_CHUNK = 100  # выгрузка пачками; одна строка индекса на пачку
+CONVERSATION_SEGMENT_BYTES = 1024 * 1024  # размер сегмента, после которого начинается новый
 
 # --- Векторная память ---
 VECTOR_MEMORY_TOP_K = 3
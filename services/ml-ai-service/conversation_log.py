@@ -0,0 +1,252 @@
+"""
+Архив истории диалога: сегментированный append-only лог на диске.
+
+Оркестратор и агенты работают с хвостом диалога (последние 5–80 записей),
+а полная история нужна только для просмотра. ConversationLog — это list
+с резидентным хвостом: когда записей становится больше CONVERSATION_RESIDENT,
+старые пачками по CONVERSATION_SPILL_CHUNK уходят в файлы сегментов
+data/conversations/{user_id}/seg_000000.jsonl (одна JSON-строка на запись).
+
+На каждую пачку в разреженный индекс (index.tsv) пишется одна строка:
+первый тик, порядковый номер первой записи, сегмент и смещение. История
+по диапазону тиков читается так: бинарный поиск по индексу → mmap сегмента
+→ разбор строк с найденного смещения.
+
+Подписчики (subscribe) получают вызов после каждой новой записи — так
+SSE-стрим узнаёт о новых репликах без опроса.
+
+Записи не меняются после добавления, поэтому их JSON для API кэшируется
+по seq (encoded) и живёт, пока запись в хвосте.
+"""
+
+import bisect
+import json
+import mmap
+import shutil
+import threading
+import uuid
+from pathlib import Path
+from typing import Callable, Optional
+
+from config import (
+    CONVERSATION_DIR, CONVERSATION_RESIDENT, CONVERSATION_SPILL_CHUNK, CONVERSATION_SEGMENT_BYTES,
+)
+
+_INDEX_FILE = "index.tsv"
+
+
+def _tick(entry: dict) -> int:
+    return entry.get("tick", 0)
+
+
+class ConversationLog(list):
+    """
+    История диалога: резидентный хвост (сам list) + архив на диске.
+
+    Индексы и срезы list относятся только к хвосту; total — длина всей истории,
+    seq записи — её номер во всей истории (0 — самая первая).
+    """
+
+    def __init__(self, user_id: str = "", entries: Optional[list] = None, spilled: int = 0,
+                 directory: str = CONVERSATION_DIR, resident: int = CONVERSATION_RESIDENT,
+                 spill_chunk: int = CONVERSATION_SPILL_CHUNK,
+                 segment_bytes: int = CONVERSATION_SEGMENT_BYTES, epoch: Optional[str] = None):
+        super().__init__(entries or [])
+        self._root = Path(directory)
+        self.user_id = user_id
+        self.resident = resident
+        self.spill_chunk = spill_chunk
+        self.segment_bytes = segment_bytes
+        self.spilled = spilled  # записей в архиве
+        self._index: list[tuple[int, int, int, int]] = []  # (tick, seq, сегмент, смещение)
+        self._index_ticks: list[int] = []
+        self._index_seqs: list[int] = []
+        self._lock = threading.Lock()
+        self._listeners: list[Callable[[], None]] = []
+        self._encoded: dict[int, bytes] = {}  # seq → JSON записи для API
+        # Меняется с каждой новой историей (ETag, id событий стрима); снапшот её сохраняет
+        self.epoch = epoch or uuid.uuid4().hex[:12]
+        if spilled:
+            self._load_index()
+
+    # ─── Расположение ──────────────────────────────────────────
+
+    @property
+    def directory(self) -> Path:
+        # user_id провалидирован UserSession (буквы, цифры, '-', '_')
+        return self._root / (self.user_id or "_default")
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.directory / f"seg_{segment:06d}.jsonl"
+
+    def rebind(self, user_id: str):
+        """Перенести лог к другому пользователю (мир из пула ещё ничего не выгружал)."""
+        with self._lock:
+            old = self.directory
+            self.user_id = user_id
+            if self.spilled and old.exists():
+                self.directory.parent.mkdir(parents=True, exist_ok=True)
+                shutil.rmtree(self.directory, ignore_errors=True)
+                old.rename(self.directory)
+
+    @property
+    def total(self) -> int:
+        """Длина всей истории (архив + хвост)."""
+        return self.spilled + len(self)
+
+    # ─── Запись ────────────────────────────────────────────────
+
+    def append(self, entry: dict):
+        super().append(entry)
+        if len(self) >= self.resident + self.spill_chunk:
+            self._spill(self.spill_chunk)
+        for listener in list(self._listeners):
+            try:
+                listener()
+            except Exception:
+                pass  # подписчик не должен ломать тик
+
+    def subscribe(self, listener: Callable[[], None]):
+        """Вызывать listener() после каждой новой записи (из потока, который пишет)."""
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable[[], None]):
+        try:
+            self._listeners.remove(listener)
+        except ValueError:
+            pass
+
+    def _spill(self, count: int):
+        """Выгрузить count самых старых записей хвоста в архив."""
+        with self._lock:
+            chunk = self[:count]
+            if not chunk:
+                return
+            if not self.spilled:
+                # Первая выгрузка новой истории — архив прошлой сессии больше не нужен
+                shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory.mkdir(parents=True, exist_ok=True)
+            segment = self._index[-1][2] if self._index else 0
+            path = self._segment_path(segment)
+            if path.exists() and path.stat().st_size >= self.segment_bytes:
+                segment += 1
+                path = self._segment_path(segment)
+
+            payload = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in chunk).encode("utf-8")
+            with open(path, "ab") as f:
+                offset = f.tell()
+                f.write(payload)
+            row = (chunk[0].get("tick", 0), self.spilled, segment, offset)
+            with open(self.directory / _INDEX_FILE, "a", encoding="utf-8") as f:
+                f.write("\t".join(map(str, row)) + "\n")
+            self._add_index_row(row)
+
+            del self[:count]
+            for seq in range(self.spilled, self.spilled + len(chunk)):
+                self._encoded.pop(seq, None)
+            self.spilled += len(chunk)
+
+    def _add_index_row(self, row: tuple[int, int, int, int]):
+        self._index.append(row)
+        self._index_ticks.append(row[0])
+        self._index_seqs.append(row[1])
+
+    def _load_index(self):
+        path = self.directory / _INDEX_FILE
+        if not path.exists():
+            return
+        lines = path.read_text(encoding="utf-8").splitlines()
+        for line in lines:
+            parts = line.split("\t")
+            if len(parts) == 4:
+                row = tuple(int(p) for p in parts)
+                if row[1] < self.spilled:  # строки, записанные после снапшота, — не наши
+                    self._add_index_row(row)
+        if len(self._index) != len(lines):
+            path.write_text("".join("\t".join(map(str, r)) + "\n" for r in self._index), encoding="utf-8")
+
+    # ─── Чтение ────────────────────────────────────────────────
+
+    def _iter_archive(self, index: list, spilled: int, start: int):
+        """(seq, запись) архива, начиная с пачки start индекса."""
+        for i in range(start, len(index)):
+            _, seq, segment, offset = index[i]
+            end_seq = index[i + 1][1] if i + 1 < len(index) else spilled
+            path = self._segment_path(segment)
+            if not path.exists() or path.stat().st_size == 0:
+                continue
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                pos = offset
+                while seq < end_seq and pos < len(mm):
+                    nl = mm.find(b"\n", pos)
+                    if nl < 0:
+                        nl = len(mm)
+                    yield seq, json.loads(mm[pos:nl])
+                    seq += 1
+                    pos = nl + 1
+
+    def tail_after(self, tick: int, limit: int) -> list[tuple[int, dict]]:
+        """
+        Последние limit записей хвоста с тиком больше tick (tick < 0 — любые).
+        Тики в логе не убывают, поэтому граница ищется бинарным поиском.
+        """
+        with self._lock:
+            start = bisect.bisect_right(self, tick, key=_tick) if tick >= 0 else 0
+            start = max(start, len(self) - limit)
+            first = self.spilled + start
+            return [(first + i, e) for i, e in enumerate(self[start:])]
+
+    def encoded(self, seq: int, entry: dict, encode: Callable[[int, dict], bytes]) -> bytes:
+        """JSON записи для API: считается один раз, дальше берётся из кэша."""
+        data = self._encoded.get(seq)
+        if data is None:
+            data = encode(seq, entry)
+            if seq >= self.spilled:
+                self._encoded[seq] = data
+        return data
+
+    def since(self, seq: int, limit: int = 500) -> list[tuple[int, dict]]:
+        """Записи начиная с номера seq (для стрима). Обычно — срез хвоста, без диска."""
+        with self._lock:
+            spilled = self.spilled
+            if seq >= spilled:
+                start = seq - spilled
+                return [(spilled + start + i, e) for i, e in enumerate(self[start:start + limit])]
+        return self.read(0, -1, limit, start_seq=seq)[0]
+
+    def read(self, from_tick: int = 0, to_tick: int = -1, limit: int = 100,
+             start_seq: Optional[int] = None) -> tuple[list[tuple[int, dict]], Optional[int]]:
+        """
+        Страница истории: записи с from_tick <= tick <= to_tick (to_tick < 0 — без границы).
+
+        start_seq — продолжить с этой записи (курсор прошлой страницы).
+        Возвращает ([(seq, запись)], seq следующей страницы или None).
+        """
+        # Под локом — только согласованный снимок; сегменты дописываются, не меняются
+        with self._lock:
+            tail = list(self)
+            spilled = self.spilled
+            index = list(self._index)
+            if start_seq is not None:
+                start = max(0, bisect.bisect_right(self._index_seqs, start_seq) - 1)
+            else:
+                # Пачка, где может быть первая запись с тиком from_tick
+                start = max(0, bisect.bisect_left(self._index_ticks, from_tick) - 1)
+
+        archive = self._iter_archive(index, spilled, start) if start_seq is None or start_seq < spilled else iter(())
+        tail_items = ((spilled + i, e) for i, e in enumerate(tail))
+
+        page: list[tuple[int, dict]] = []
+        for source in (archive, tail_items):
+            for seq, entry in source:
+                if start_seq is not None and seq < start_seq:
+                    continue
+                tick = entry.get("tick", 0)
+                if tick < from_tick:
+                    continue
+                if 0 <= to_tick < tick:
+                    return page, None
+                if len(page) == limit:
+                    return page, seq
+                page.append((seq, entry))
+        return page, None
@@ -0,0 +1,297 @@
+"""
+Гибернация сессий: холодные сессии выгружаются из памяти на диск.
+
+Каждая сессия в SessionManager держит оркестратор, агентов, их память, индексы
+и поток фоновой симуляции. SessionHibernator по политике (простой, число сессий
+в памяти, бюджет памяти) сохраняет снапшот сессии в файл, останавливает её
+симуляцию и освобождает память. При следующем запросе к этому user_id сессия
+прозрачно поднимается из снапшота.
+
+Тот же снапшот переносит сессию между воркерами (export_snapshot /
+import_snapshot, см. router.py).
+"""
+
+import os
+import threading
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Callable, Optional
+
+from config import (
+    HIBERNATION_DIR, SESSION_IDLE_TIMEOUT, SESSION_MAX_RESIDENT,
+    SESSION_MEMORY_BUDGET_MB, SESSION_MIN_IDLE, HIBERNATION_CHECK_INTERVAL, SESSION_DRAIN_TIMEOUT,
+)
+from session import SessionManager, UserSession
+
+
+class SessionHibernator:
+    """
+    Выгрузка холодных сессий на диск и их подъём по требованию.
+
+    Политика (проверяется раз в HIBERNATION_CHECK_INTERVAL):
+    - простой дольше idle_timeout → сессия выгружается;
+    - в памяти больше max_resident сессий → выгружаются самые давние;
+    - суммарный размер сессий больше бюджета → выгружаются самые давние.
+    Сессии с запросами за последние min_idle секунд не трогаются никогда,
+    как и сессии с принятыми, но ещё не обработанными сообщениями (is_busy).
+
+    on_hibernate / on_wake — хуки API: остановить и запустить фоновую симуляцию.
+    session_lock — lock сессии из API: снапшот снимается и сессия отцепляется
+    под ним, поэтому сообщение, ждущее lock, не попадёт в выгружаемый мир.
+
+    Выгруженные user_id учитываются в памяти (каталог читается один раз, при
+    старте), поэтому hibernated_count() для /metrics не ходит на диск.
+    """
+
+    def __init__(self, sessions: SessionManager,
+                 on_hibernate: Optional[Callable[[str], None]] = None,
+                 on_wake: Optional[Callable[[str], None]] = None,
+                 session_lock: Optional[Callable[[str], threading.Lock]] = None,
+                 is_busy: Optional[Callable[[str], bool]] = None,
+                 directory: str = HIBERNATION_DIR,
+                 idle_timeout: float = SESSION_IDLE_TIMEOUT,
+                 max_resident: int = SESSION_MAX_RESIDENT,
+                 memory_budget_mb: float = SESSION_MEMORY_BUDGET_MB,
+                 min_idle: float = SESSION_MIN_IDLE):
+        self.sessions = sessions
+        self.on_hibernate = on_hibernate
+        self.on_wake = on_wake
+        self.session_lock = session_lock
+        self.is_busy = is_busy
+        self.directory = Path(directory)
+        self.idle_timeout = idle_timeout
+        self.max_resident = max_resident
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self.min_idle = min_idle
+        self._user_locks: dict[str, threading.RLock] = {}
+        self._guard = threading.Lock()
+        self._hibernated: Optional[set[str]] = None  # снапшоты в каталоге; None — ещё не прочитан
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def user_lock(self, user_id: str) -> threading.RLock:
+        """Lock переходов сессии: подъём, выгрузка, перенос (и сборка мира в API)."""
+        with self._guard:
+            return self._user_locks.setdefault(user_id, threading.RLock())
+
+    def _path(self, user_id: str) -> Path:
+        # user_id уже провалидирован UserSession (буквы, цифры, '-', '_')
+        return self.directory / f"{user_id}.bbsn"
+
+    def is_hibernated(self, user_id: str) -> bool:
+        return self._path(user_id).exists()
+
+    def _index(self) -> set[str]:
+        """Выгруженные user_id; при первом обращении — по содержимому каталога. Под _guard."""
+        if self._hibernated is None:
+            found = self.directory.glob("*.bbsn") if self.directory.exists() else ()
+            self._hibernated = {p.stem for p in found}
+        return self._hibernated
+
+    def _track(self, user_id: str, hibernated: bool):
+        """Учесть запись или удаление снапшота пользователя."""
+        with self._guard:
+            if hibernated:
+                self._index().add(user_id)
+            else:
+                self._index().discard(user_id)
+
+    def hibernated_count(self) -> int:
+        with self._guard:
+            return len(self._index())
+
+    def hibernated_ids(self) -> list[str]:
+        with self._guard:
+            return list(self._index())
+
+    # ─── Выгрузка ──────────────────────────────────────────────
+
+    def _busy(self, user_id: str) -> bool:
+        return self.is_busy is not None and self.is_busy(user_id)
+
+    def _drain(self, user_id: str, timeout: float = SESSION_DRAIN_TIMEOUT):
+        """Дождаться, пока принятые сообщения пользователя будут обработаны."""
+        deadline = time.monotonic() + timeout
+        while self._busy(user_id) and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def hibernate(self, user_id: str, force: bool = False) -> bool:
+        """Выгрузить сессию на диск. True, если сессия выгружена.
+
+        force — выгрузить, даже если во время записи снапшота пришёл запрос;
+        принятые сообщения при этом сначала дорабатываются (не дольше SESSION_DRAIN_TIMEOUT)."""
+        with self.user_lock(user_id):
+            session = self.sessions.get_session(user_id)
+            if session is None or session.orchestrator is None:
+                return False
+            if not force and self._busy(user_id):
+                return False
+            seen_access = session.last_access
+
+            if self.on_hibernate:
+                self.on_hibernate(user_id)
+            if force:
+                self._drain(user_id)
+
+            with self.session_lock(user_id) if self.session_lock else nullcontext():
+                orchestrator = session.orchestrator
+                try:
+                    orchestrator.save_all_memories()
+                    blob = orchestrator.snapshot()
+                    self.directory.mkdir(parents=True, exist_ok=True)
+                    path = self._path(user_id)
+                    tmp = path.with_suffix(".tmp")
+                    tmp.write_bytes(blob)
+                    os.replace(tmp, path)
+                    self._track(user_id, True)
+                except Exception as e:
+                    print(f"[Hibernation] Не удалось выгрузить {user_id[:8]}: {e}")
+                    if self.on_wake:
+                        self.on_wake(user_id)
+                    return False
+
+                # Пока писали снапшот, пришёл запрос — сессия снова горячая
+                if (session.last_access != seen_access or self._busy(user_id)) and not force:
+                    self._path(user_id).unlink(missing_ok=True)
+                    self._track(user_id, False)
+                    if self.on_wake:
+                        self.on_wake(user_id)
+                    return False
+
+                self.sessions.detach_session(user_id)
+                session.orchestrator = None
+            print(f"[Hibernation] Сессия {user_id[:8]} выгружена ({len(blob)} байт)")
+            return True
+
+    # ─── Подъём ────────────────────────────────────────────────
+
+    def wake(self, user_id: str) -> Optional[UserSession]:
+        """Поднять выгруженную сессию. None, если снапшота нет."""
+        from orchestrator import BigBrotherOrchestrator
+
+        with self.user_lock(user_id):
+            session = self.sessions.get_session(user_id)
+            if session is not None and session.orchestrator is not None:
+                return session  # уже подняли в соседнем запросе
+
+            path = self._path(user_id)
+            if not path.exists():
+                return None
+
+            restored = UserSession(user_id=user_id)
+            restored.orchestrator = BigBrotherOrchestrator.restore(
+                path.read_bytes(), user_id=user_id,
+                registry=restored.agent_registry, text_pool=restored.text_pool,
+            )
+            session = self.sessions.attach_session(restored)
+            if session.orchestrator is not restored.orchestrator:
+                # Пока поднимали, сессии уже собрали другой мир — снапшот не трогаем
+                print(f"[Hibernation] Сессия {user_id[:8]} уже с миром, снапшот оставлен")
+                return session
+            path.unlink(missing_ok=True)
+            self._track(user_id, False)
+
+            if self.on_wake:
+                self.on_wake(user_id)
+            print(f"[Hibernation] Сессия {user_id[:8]} поднята из снапшота")
+            return session
+
+    # ─── Перенос между воркерами ───────────────────────────────
+
+    def export_snapshot(self, user_id: str) -> Optional[bytes]:
+        """Снапшот сессии для переноса. Сессия выгружается, но файл остаётся, пока
+        новый воркер её не примет (discard_snapshot).
+
+        None — сессии нет ни в памяти, ни на диске; RuntimeError — сессию в памяти
+        выгрузить не удалось."""
+        with self.user_lock(user_id):
+            self.hibernate(user_id, force=True)
+            session = self.sessions.get_session(user_id)
+            if session is not None and session.orchestrator is not None:
+                raise RuntimeError(f"Сессию {user_id[:8]} не удалось выгрузить")
+            path = self._path(user_id)
+            if not path.exists():
+                return None
+            return path.read_bytes()
+
+    def discard_snapshot(self, user_id: str) -> bool:
+        """Удалить снапшот сессии, принятой другим воркером.
+        False — сессию с тех пор снова подняли здесь, снапшот не тронут."""
+        with self.user_lock(user_id):
+            session = self.sessions.get_session(user_id)
+            if session is not None and session.orchestrator is not None:
+                return False
+            self._path(user_id).unlink(missing_ok=True)
+            self._track(user_id, False)
+            return True
+
+    def import_snapshot(self, user_id: str, blob: bytes) -> UserSession:
+        """Принять сессию, снятую export_snapshot на другом процессе, и поднять её."""
+        with self.user_lock(user_id):
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self._path(user_id)
+            tmp = path.with_suffix(".tmp")
+            tmp.write_bytes(blob)
+            os.replace(tmp, path)
+            self._track(user_id, True)
+        return self.wake(user_id)
+
+    # ─── Политика ──────────────────────────────────────────────
+
+    def _footprint(self, session: UserSession) -> int:
+        try:
+            return session.orchestrator.memory_footprint()["total"]
+        except Exception:
+            return 0  # симуляция поменяла структуры во время обхода — учтём в следующий раз
+
+    def select_victims(self) -> list[str]:
+        """user_id сессий, которые по политике пора выгрузить (самые давние первыми)."""
+        now = time.monotonic()
+        resident = [s for s in self.sessions.resident_sessions() if s.orchestrator is not None]
+        cold = [s for s in resident if now - s.last_access >= self.min_idle]
+
+        victims = [s for s in cold if now - s.last_access >= self.idle_timeout]
+        rest = [s for s in cold if now - s.last_access < self.idle_timeout]
+
+        overflow = len(resident) - len(victims) - self.max_resident
+        if overflow > 0:
+            victims += rest[:overflow]
+            rest = rest[overflow:]
+
+        if self.memory_budget > 0 and rest:
+            sizes = {s.user_id: self._footprint(s) for s in resident if s not in victims}
+            total = sum(sizes.values())
+            for s in rest:
+                if total <= self.memory_budget:
+                    break
+                victims.append(s)
+                total -= sizes[s.user_id]
+
+        return [s.user_id for s in victims]
+
+    def sweep(self) -> list[str]:
+        """Один проход политики. Возвращает выгруженные user_id."""
+        return [uid for uid in self.select_victims() if self.hibernate(uid)]
+
+    def _loop(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"[Hibernation] Ошибка при проверке сессий: {e}")
+
+    def start(self, interval: float = HIBERNATION_CHECK_INTERVAL):
+        """Запустить фоновую проверку сессий."""
+        if self._thread and self._thread.is_alive():
+            return
+        self.hibernated_count()  # прочитать каталог сейчас, а не при первом опросе /metrics
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, args=(interval,),
+                                        daemon=True, name="hibernator")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=5.0)
@@ -0,0 +1,29 @@
+"""
+Доступ к служебным эндпоинтам (перенос сессий между воркерами, состав воркеров).
+
+Экспорт снапшота удаляет сессию с воркера, импорт поднимает присланный мир,
+а смена списка воркеров уводит на них все сессии, поэтому эти эндпоинты
+принимают только запросы с общим секретом в заголовке X-Internal-Token
+(ML_INTERNAL_TOKEN у роутера и воркеров). Без настроенного секрета
+служебные эндпоинты закрыты полностью.
+"""
+
+import hmac
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+from config import INTERNAL_API_TOKEN
+
+INTERNAL_TOKEN_HEADER = "X-Internal-Token"
+
+
+def internal_headers() -> dict:
+    """Заголовки для служебного запроса роутера к воркеру."""
+    return {INTERNAL_TOKEN_HEADER: INTERNAL_API_TOKEN}
+
+
+def require_internal_token(token: Optional[str] = Header(None, alias=INTERNAL_TOKEN_HEADER)):
+    """FastAPI-зависимость: 403, если секрет не настроен или не совпал."""
+    if not INTERNAL_API_TOKEN or token is None or not hmac.compare_digest(token, INTERNAL_API_TOKEN):
+        raise HTTPException(status_code=403, detail="Служебный эндпоинт")
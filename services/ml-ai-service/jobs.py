@@ -0,0 +1,135 @@
+"""
+Фоновые задачи: сообщения пользователя, принятые без ожидания ответа.
+
+POST /messages?async=true не держит HTTP-запрос, пока агенты отвечают
+(несколько LLM-запросов с ретраями): сообщение уходит в работу, клиент сразу
+получает 202 и job_id. Ответы приходят в стрим диалога, а статус задачи —
+с разбивкой по агентам — отдаёт GET /jobs/{job_id}.
+
+Задачи живут в памяти процесса; завершённые удаляются через JOB_TTL_SECONDS.
+"""
+
+import time
+import uuid
+import threading
+from typing import Optional
+from dataclasses import dataclass, field
+
+from config import JOB_TTL_SECONDS, JOB_MAX_STORED
+
+# Статусы задачи
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# Статусы ответа агента
+REPLY_PENDING = "pending"
+REPLY_GENERATED = "generated"
+REPLY_REJECTED = "rejected"
+
+
+@dataclass
+class MessageJob:
+    """Обработка одного сообщения пользователя."""
+    job_id: str
+    user_id: str
+    message: str
+    target: str  # "all" или имя агента
+    agents: dict[str, dict] = field(default_factory=dict)  # agent_id → {name, status, text}
+    status: str = JOB_QUEUED
+    responses: list[dict] = field(default_factory=list)
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def start(self):
+        with self._lock:
+            self.status = JOB_RUNNING
+
+    def set_reply(self, agent_id: str, text: Optional[str]):
+        """Ответ агента прошёл проверку (text) или отклонён (None). Зовётся из потоков генерации."""
+        with self._lock:
+            agent = self.agents.get(agent_id)
+            if agent is not None:
+                agent["status"] = REPLY_GENERATED if text else REPLY_REJECTED
+                agent["text"] = text
+
+    def finish(self, responses: list[dict]):
+        with self._lock:
+            self.responses = responses
+            for agent in self.agents.values():
+                if agent["status"] == REPLY_PENDING:
+                    agent["status"] = REPLY_REJECTED
+            self.status = JOB_DONE
+            self.finished_at = time.time()
+
+    def fail(self, error: str):
+        with self._lock:
+            self.error = error
+            self.status = JOB_FAILED
+            self.finished_at = time.time()
+
+    def as_dict(self) -> dict:
+        """Согласованный снимок для ответа API."""
+        with self._lock:
+            return {
+                "job_id": self.job_id,
+                "user_id": self.user_id,
+                "status": self.status,
+                "message": self.message,
+                "target": self.target,
+                "agents": [{"agent_id": aid, **a} for aid, a in self.agents.items()],
+                "responses": list(self.responses),
+                "error": self.error,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class JobStore:
+    """Задачи по job_id. Потокобезопасный; чужие задачи пользователю не видны."""
+
+    def __init__(self, ttl: float = JOB_TTL_SECONDS, max_jobs: int = JOB_MAX_STORED):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self._jobs: dict[str, MessageJob] = {}
+        self._lock = threading.Lock()
+
+    def create(self, user_id: str, message: str, target: str,
+               agents: list[tuple[str, str]]) -> MessageJob:
+        """Новая задача; agents — [(agent_id, имя)] адресатов сообщения."""
+        job = MessageJob(
+            job_id=uuid.uuid4().hex, user_id=user_id, message=message, target=target,
+            agents={aid: {"name": name, "status": REPLY_PENDING, "text": None} for aid, name in agents},
+        )
+        with self._lock:
+            self._prune()
+            self._jobs[job.job_id] = job
+        return job
+
+    def get(self, job_id: str, user_id: str) -> Optional[MessageJob]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.user_id != user_id:
+            return None
+        return job
+
+    def _prune(self):
+        now = time.time()
+        expired = [jid for jid, j in self._jobs.items()
+                   if j.finished_at is not None and now - j.finished_at > self.ttl]
+        for jid in expired:
+            del self._jobs[jid]
+        # Переполнение — выбрасываем самые старые завершённые
+        overflow = len(self._jobs) - self.max_jobs + 1
+        if overflow > 0:
+            finished = sorted((j for j in self._jobs.values() if j.finished_at is not None),
+                              key=lambda j: j.finished_at)
+            for j in finished[:overflow]:
+                del self._jobs[j.job_id]
+
+
+# Глобальный экземпляр
+job_store = JobStore()
@@ -1,15 +1,29 @@
 """
 LLM-клиент: подключение к OpenAI-совместимому API (LM Studio) с retry.
+
+llm_chat — ответ целиком; llm_chat_stream — тот же запрос со stream=True,
+каждый фрагмент текста отдаётся в on_token по мере генерации.
+
+Одновременно к LLM идёт не больше LLM_MAX_CONCURRENCY запросов на процесс
+(все сессии и потоки вместе); паузы между ретраями слот не занимают.
+Запросы внутри user_priority() получают свободный слот раньше фоновых.
+Фоновые запросы внутри preemptible(should_yield) бросают ретраи и обрывают
+стрим, как только should_yield() вернёт True (ждёт сообщение пользователя).
 """
 
+import threading
 import time
-from typing import Optional
+from contextlib import contextmanager
+from typing import Callable, Optional
 
 import httpx
 from openai import OpenAI, APITimeoutError, APIConnectionError, APIStatusError
 from colorama import Fore, Style
 
-from config import LLM_BASE_URL, LLM_API_KEY, LLM_MODEL, LLM_TIMEOUT, LLM_MAX_RETRIES, LLM_RETRY_DELAY
+from slo import LatencyTracker
+from config import (
+    LLM_BASE_URL, LLM_API_KEY, LLM_MODEL, LLM_TIMEOUT, LLM_MAX_RETRIES, LLM_RETRY_DELAY, LLM_MAX_CONCURRENCY,
+)
 
 http_client = httpx.Client(
     timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0),
@@ -25,33 +39,201 @@ client = OpenAI(
 )
 
 
-def llm_chat(messages: list[dict], temperature: float = 0.8) -> Optional[str]:
-    """Отправить запрос к LLM с retry и таймаутом. Возвращает None при неудаче."""
+
+class _LLMSlots:
+    """Семафор с приоритетом: пока слот ждёт запрос пользователя, фоновые не входят."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._free = size
+        self._user_waiting = 0
+        self.waiting = 0  # потоков ждут слот (для /metrics)
+        self._user_since: list[float] = []  # с какого момента ждут запросы пользователя
+        self._cond = threading.Condition()
+        self.wait_latency = LatencyTracker()  # ожидание слота (для /metrics)
+
+    @property
+    def in_flight(self) -> int:
+        return self.size - self._free
+
+    def user_queue_age(self) -> float:
+        """Сколько секунд ждёт слот самый давний запрос пользователя (0 — никто не ждёт)."""
+        with self._cond:
+            oldest = min(self._user_since, default=None)
+        return time.monotonic() - oldest if oldest is not None else 0.0
+
+    def __enter__(self):
+        user = getattr(_priority, "user", False)
+        started = time.monotonic()
+        with self._cond:
+            self.waiting += 1
+            if user:
+                self._user_since.append(started)
+            try:
+                self._acquire(user)
+            finally:
+                self.waiting -= 1
+                if user:
+                    self._user_since.remove(started)
+            self._free -= 1
+        self.wait_latency.record(time.monotonic() - started)
+
+    def _acquire(self, user: bool):
+        # Под self._cond: дождаться, когда слот можно занять
+        if user:
+            self._user_waiting += 1
+            try:
+                while self._free <= 0:
+                    self._cond.wait()
+            finally:
+                self._user_waiting -= 1
+        else:
+            while self._free <= 0 or self._user_waiting:
+                self._cond.wait()
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self._free += 1
+            self._cond.notify_all()
+
+
+_priority = threading.local()
+_llm_slots = _LLMSlots(max(1, LLM_MAX_CONCURRENCY))
+
+
+@contextmanager
+def user_priority():
+    """LLM-запросы этого потока внутри блока — ответ пользователю (приоритетные)."""
+    previous = getattr(_priority, "user", False)
+    _priority.user = True
+    try:
+        yield
+    finally:
+        _priority.user = previous
+
+
+@contextmanager
+def preemptible(should_yield: Callable[[], bool]):
+    """Фоновые LLM-запросы этого потока внутри блока уступают, как только should_yield() — True."""
+    previous = getattr(_priority, "preempt", None)
+    _priority.preempt = should_yield
+    try:
+        yield
+    finally:
+        _priority.preempt = previous
+
+
+class _Preempted(Exception):
+    """Фоновый запрос прерван: ждёт сообщение пользователя."""
+
+
+def _preempted() -> bool:
+    if getattr(_priority, "user", False):
+        return False
+    should_yield = getattr(_priority, "preempt", None)
+    return should_yield is not None and should_yield()
+
+
+def _backoff(wait: float):
+    """Пауза перед ретраем; фоновый запрос прерывает её, если ждёт пользователь."""
+    deadline = time.monotonic() + wait
+    while not _preempted():
+        left = deadline - time.monotonic()
+        if left <= 0:
+            return
+        time.sleep(min(left, 0.1))
+
+
+def _no_think(messages: list[dict]) -> list[dict]:
     if messages and messages[0]["role"] == "system":
         if "/no_think" not in messages[0]["content"]:
             messages = messages.copy()
             messages[0] = messages[0].copy()
             messages[0]["content"] = "/no_think\n" + messages[0]["content"]
+    return messages
+
+
+def llm_chat(messages: list[dict], temperature: float = 0.8) -> Optional[str]:
+    """Отправить запрос к LLM с retry и таймаутом. Возвращает None при неудаче."""
+    messages = _no_think(messages)
+
+    def request() -> str:
+        resp = client.chat.completions.create(
+            model=LLM_MODEL,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=150,
+        )
+        return resp.choices[0].message.content.strip()
+
+    return _with_retries(request, messages)
 
+
+def llm_chat_stream(messages: list[dict], on_token: Callable[[str], None], temperature: float = 0.8,
+                    on_restart: Optional[Callable[[], None]] = None) -> Optional[str]:
+    """
+    Как llm_chat, но фрагменты ответа отдаются в on_token по мере генерации.
+
+    Если попытка оборвалась после первых токенов и запрос повторяется,
+    перед повтором вызывается on_restart — уже отданный текст недействителен.
+    Возвращает весь ответ (как llm_chat) или None.
+    """
+    messages = _no_think(messages)
+    emitted = False
+
+    def request() -> str:
+        nonlocal emitted
+        if emitted and on_restart:
+            on_restart()
+        emitted = False
+        parts = []
+        stream = client.chat.completions.create(
+            model=LLM_MODEL,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=150,
+            stream=True,
+        )
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if _preempted():
+                    raise _Preempted()
+                if delta:
+                    parts.append(delta)
+                    emitted = True
+                    on_token(delta)
+        finally:
+            stream.close()
+        return "".join(parts).strip()
+
+    return _with_retries(request, messages)
+
+
+def _with_retries(request: Callable[[], str], messages: list[dict]) -> Optional[str]:
     for attempt in range(1, LLM_MAX_RETRIES + 1):
+        if _preempted():
+            print(f"{Fore.WHITE}  LLM-запрос уступил сообщению пользователя{Style.RESET_ALL}")
+            return None
         try:
-            resp = client.chat.completions.create(
-                model=LLM_MODEL,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=150,
-            )
-            return resp.choices[0].message.content.strip()
+            with _llm_slots:
+                return request()
+
+        except _Preempted:
+            print(f"{Fore.WHITE}  LLM-стрим прерван: ждёт сообщение пользователя{Style.RESET_ALL}")
+            return None
 
         except APITimeoutError:
             wait = LLM_RETRY_DELAY * attempt
             print(f"{Fore.RED}  LLM таймаут (попытка {attempt}/{LLM_MAX_RETRIES}), жду {wait:.0f}с...{Style.RESET_ALL}")
-            time.sleep(wait)
+            _backoff(wait)
 
         except APIConnectionError as e:
             wait = LLM_RETRY_DELAY * attempt
             print(f"{Fore.RED}  LLM недоступен (попытка {attempt}/{LLM_MAX_RETRIES}): {e}{Style.RESET_ALL}")
-            time.sleep(wait)
+            _backoff(wait)
 
         except APIStatusError as e:
             if e.status_code == 400:
@@ -66,11 +248,11 @@ def llm_chat(messages: list[dict], temperature: float = 0.8) -> Optional[str]:
             elif e.status_code == 429:
                 wait = LLM_RETRY_DELAY * attempt * 2
                 print(f"{Fore.RED}  LLM перегружен (429), жду {wait:.0f}с...{Style.RESET_ALL}")
-                time.sleep(wait)
+                _backoff(wait)
             elif e.status_code >= 500:
                 wait = LLM_RETRY_DELAY * attempt
                 print(f"{Fore.RED}  LLM ошибка сервера ({e.status_code}), жду {wait:.0f}с...{Style.RESET_ALL}")
-                time.sleep(wait)
+                _backoff(wait)
             else:
                 print(f"{Fore.RED}  LLM ошибка {e.status_code}: {e.message}{Style.RESET_ALL}")
                 return None
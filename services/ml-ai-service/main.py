@@ -42,6 +42,7 @@ from agent_registry import agent_registry
 from scenarios import ScenarioManager, UserEventInput
 from orchestrator import RACE_PRESETS, create_agents, BigBrotherOrchestrator
 from session import session_manager
+import chroma_storage
 
 
 def main():
@@ -114,11 +115,12 @@ def main():
                 print(f"   Удален {file}")
     print(f"{Fore.GREEN}Данные очищены. Новая сессия!{Style.RESET_ALL}\n")
 
-    agents = create_agents(selected_race_preset, user_id=user_id, registry=registry)
+    agents = create_agents(selected_race_preset, user_id=user_id, registry=registry,
+                           text_pool=session.text_pool)
     user_input = UserEventInput(agent_names=registry.get_all_names())
     orchestrator = BigBrotherOrchestrator(
         agents, selected_scenario, user_event_input=user_input,
-        user_id=user_id, registry=registry,
+        user_id=user_id, registry=registry, text_pool=session.text_pool,
     )
     session.orchestrator = orchestrator
 
@@ -250,6 +252,7 @@ def main():
         user_input.stop()
         print(f"\n{Fore.CYAN}Сохраняю память агентов...{Style.RESET_ALL}")
         orchestrator.save_all_memories()
+        chroma_storage.flush_writes()
         print(f"{Fore.GREEN}Память сохранена в ChromaDB ({CHROMA_DB_PATH}){Style.RESET_ALL}")
         # Закрываем сессию пользователя
         session_manager.close_session(user_id)
@@ -260,21 +263,77 @@ def main():
     orchestrator.print_stats()
 
     counts = {}
-    for e in orchestrator.conversation:
+    conversation = orchestrator.conversation
+    for _, e in conversation.read(0, -1, conversation.total)[0]:
         counts[e["name"]] = counts.get(e["name"], 0) + 1
     print(f"{Fore.WHITE}Количество сообщений:")
     for name, cnt in sorted(counts.items()):
         print(f"  {name}: {cnt}")
 
 
+def run_workers(host: str, port: int, workers: int):
+    """
+    Несколько процессов: N воркеров api.py на портах port+1..port+N (только localhost)
+    и роутер (router.py) на port, который направляет пользователя его воркеру.
+    У каждого воркера своя база ChromaDB и каталог гибернации; воркер 0 работает
+    на прежних путях, поэтому данные запуска без --workers остаются на месте.
+    Если остались данные воркеров прошлого запуска с бо́льшим N, такие воркеры
+    тоже поднимаются, но в ring не входят: роутер при старте переносит их сессии
+    к владельцам (ML_DRAIN_WORKERS).
+    """
+    import secrets
+    import signal
+    import subprocess
+    import uvicorn
+    import config
+    from config import HIBERNATION_DIR
+
+    # Секрет служебных эндпоинтов — общий для роутера и воркеров.
+    # config уже импортирован, поэтому роутеру значения выставляются и в нём
+    config.INTERNAL_API_TOKEN = os.environ.setdefault("ML_INTERNAL_TOKEN", secrets.token_hex(32))
+
+    def data_paths(i: int) -> tuple[str, str]:
+        if i == 0:
+            return CHROMA_DB_PATH, HIBERNATION_DIR
+        return f"{CHROMA_DB_PATH}_w{i}", f"{HIBERNATION_DIR}/w{i}"
+
+    total = workers
+    while any(os.path.exists(p) for p in data_paths(total)):
+        total += 1
+
+    urls, procs = [], []
+    for i in range(total):
+        worker_port = port + 1 + i
+        chroma_path, hibernation_dir = data_paths(i)
+        env = dict(os.environ, CHROMA_DB_PATH=chroma_path, HIBERNATION_DIR=hibernation_dir)
+        procs.append(subprocess.Popen(
+            [sys.executable, __file__, "--api", "--host", "127.0.0.1", "--port", str(worker_port)], env=env,
+        ))
+        urls.append(f"http://127.0.0.1:{worker_port}")
+
+    config.ROUTER_WORKERS = os.environ["ML_WORKERS"] = ",".join(urls[:workers])
+    config.ROUTER_DRAIN_WORKERS = os.environ["ML_DRAIN_WORKERS"] = ",".join(urls[workers:])
+    from router import app as router_app
+    # uvicorn после остановки заново посылает себе пойманный сигнал; со стандартным
+    # обработчиком SIGTERM процесс умер бы, не остановив воркеры (finally ниже)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        uvicorn.run(router_app, host=host, port=port)
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait(timeout=30)
+
+
 if __name__ == "__main__":
-    # Режим API-сервера: python main.py --api [--port PORT] [--host HOST]
+    # Режим API-сервера: python main.py --api [--port PORT] [--host HOST] [--workers N]
     if "--api" in sys.argv:
         import uvicorn
-        from api import app
 
         host = "0.0.0.0"
         port = 8083
+        workers = 1
 
         if "--port" in sys.argv:
             idx = sys.argv.index("--port")
@@ -286,14 +345,25 @@ if __name__ == "__main__":
             if idx + 1 < len(sys.argv):
                 host = sys.argv[idx + 1]
 
+        if "--workers" in sys.argv:
+            idx = sys.argv.index("--workers")
+            if idx + 1 < len(sys.argv):
+                workers = int(sys.argv[idx + 1])
+
         print(f"\n{'=' * 60}")
         print(f"  КИБЕР РЫВОК — ML AI Service (API режим)")
         print(f"  Сервер: http://{host}:{port}")
         print(f"  Docs:   http://{host}:{port}/docs")
         print(f"  Модель: {LLM_MODEL}")
+        if workers > 1:
+            print(f"  Воркеры: {workers} (порты {port + 1}-{port + workers})")
         print(f"{'=' * 60}\n")
 
-        uvicorn.run(app, host=host, port=port)
+        if workers > 1:
+            run_workers(host, port, workers)
+        else:
+            from api import app
+            uvicorn.run(app, host=host, port=port)
     else:
         # Терминальный режим (оригинальный)
         main()
@@ -2,8 +2,14 @@
 Система памяти: MemoryItem, AgentMemorySystem.
 """
 
+import bisect
+import heapq
+import math
 import re
-from dataclasses import dataclass, asdict
+import sys
+import time
+import uuid
+from dataclasses import dataclass, asdict, field
 from datetime import datetime
 from typing import Optional
 
@@ -16,31 +22,144 @@ from config import (
 from agent_registry import agent_registry
 from llm_client import llm_chat
 from vector_memory import VectorMemoryLayer
+from text_pool import TextPool, text_pool as global_text_pool
 import chroma_storage
 
 
-@dataclass
+@dataclass(slots=True)
 class MemoryItem:
     tick: int
     speaker: str
     text: str
-    timestamp: str
+    timestamp: int  # unix-время в секундах
     importance: float = 0.5
     speaker_id: str = ""
     addressed_to: str = ""
     addressed_to_id: str = ""
     is_event: bool = False
     is_action_result: bool = False
+    memory_id: str = ""  # стабильный ID записи в ChromaDB
+    dirty: bool = field(default=True, compare=False, repr=False)  # нужно пересохранить
+
+    def __post_init__(self):
+        if not self.memory_id:
+            self.memory_id = uuid.uuid4().hex[:16]
+        # Имена и ID повторяются в тысячах записей — храним одну копию
+        self.speaker = sys.intern(self.speaker)
+        self.speaker_id = sys.intern(self.speaker_id)
+        self.addressed_to = sys.intern(self.addressed_to)
+        self.addressed_to_id = sys.intern(self.addressed_to_id)
 
     def to_dict(self):
-        return asdict(self)
+        data = asdict(self)
+        data.pop("dirty", None)
+        return data
+
+
+def _parse_timestamp(value) -> int:
+    """Timestamp из БД: int или ISO-строка старого формата → unix-время."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    if isinstance(value, str) and value:
+        try:
+            return int(datetime.fromisoformat(value).timestamp())
+        except ValueError:
+            pass
+    return 0
+
+
+def _decay_factor(memory: MemoryItem) -> float:
+    """Коэффициент затухания за тик: события забываются медленнее."""
+    return IMPORTANCE_DECAY_FACTOR if not memory.is_event else (IMPORTANCE_DECAY_FACTOR ** 0.5)
+
+
+class _LongTermIndex:
+    """
+    Упорядоченные индексы long-term памяти для выборки top-k и вытеснения.
+
+    Затухание экспоненциальное: importance * f^(T - tick). В лог-пространстве это
+    log(importance) - tick*log(f) + T*log(f), и слагаемое T*log(f) одинаково для
+    всех записей с тем же f. Поэтому порядок по ключу log(importance) - tick*log(f)
+    не меняется с ростом текущего тика T — записи вставляются один раз (bisect),
+    а выборка top-k берёт начало списка без пересортировки.
+
+    Записи с разным f (события и обычные) лежат в разных группах. Окончательный
+    порядок кандидатов считается точной формулой _decayed_importance с исходным
+    порядком в long_term как tie-break — результат совпадает с полной сортировкой.
+    """
+
+    _EPS = 1e-9  # запас на погрешность float при отборе кандидатов
+
+    def __init__(self, items: list[MemoryItem]):
+        self.source = items  # список, по которому построен индекс
+        self._entries: dict[int, tuple] = {}  # id(mem) → (group, sort_key)
+        self._groups: dict[str, list] = {"event": [], "action": [], "regular": []}
+        self._evictable: list = []  # обычные записи по (importance, seq)
+        self._next_seq = 0
+        for m in items:
+            self.add(m)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _group(memory: MemoryItem) -> str:
+        if memory.is_event:
+            return "event"
+        if memory.is_action_result:
+            return "action"
+        return "regular"
+
+    @staticmethod
+    def _log_key(memory: MemoryItem) -> float:
+        if memory.importance <= 0:
+            return -math.inf
+        return math.log(memory.importance) - memory.tick * math.log(_decay_factor(memory))
+
+    def seq(self, memory: MemoryItem) -> int:
+        """Позиция записи в порядке добавления (= порядок в long_term)."""
+        return self._entries[id(memory)][1][1]
+
+    def add(self, memory: MemoryItem):
+        group = self._group(memory)
+        key = (-self._log_key(memory), self._next_seq)
+        self._next_seq += 1
+        self._entries[id(memory)] = (group, key)
+        bisect.insort(self._groups[group], key + (memory,))
+        if group == "regular":
+            bisect.insort(self._evictable, (memory.importance, key[1], memory))
+
+    def remove(self, memory: MemoryItem):
+        group, key = self._entries.pop(id(memory))
+        entries = self._groups[group]
+        del entries[bisect.bisect_left(entries, key)]
+        if group == "regular":
+            del self._evictable[bisect.bisect_left(self._evictable, (memory.importance, key[1]))]
+
+    def least_important_evictable(self) -> Optional[MemoryItem]:
+        """Обычная запись с минимальной importance (при равенстве — самая ранняя)."""
+        return self._evictable[0][2] if self._evictable else None
+
+    def candidates(self, group: str, n: int) -> list[MemoryItem]:
+        """Первые n записей группы по лог-ключу + всё, что в пределах погрешности от n-й."""
+        entries = self._groups[group]
+        if len(entries) <= n:
+            return [e[2] for e in entries]
+        if n <= 0:
+            return []
+        threshold = entries[n - 1][0]
+        threshold += self._EPS * max(1.0, abs(threshold))
+        end = bisect.bisect_right(entries, (threshold, math.inf))
+        return [e[2] for e in entries[:end]]
 
 
 class AgentMemorySystem:
-    def __init__(self, agent_id: str, user_id: str = "", registry: 'AgentRegistry' = None):
+    def __init__(self, agent_id: str, user_id: str = "", registry: 'AgentRegistry' = None,
+                 text_pool: Optional[TextPool] = None, load: bool = True):
         self.agent_id = agent_id
         self.user_id = user_id
         self._registry = registry  # Изолированный реестр сессии (если None — глобальный)
+        self._text_pool = text_pool if text_pool is not None else global_text_pool
         self.short_term: list[MemoryItem] = []
         self.long_term: list[MemoryItem] = []
         self.completed_actions: list[str] = []
@@ -48,8 +167,22 @@ class AgentMemorySystem:
         self.group_decisions: list[dict] = []  # решения группы и собственные предложения
         self._memories_since_save = 0
         self._autosave_interval = 1
-        self.vector_layer = VectorMemoryLayer(agent_id, user_id=user_id)
-        self.load_from_db()
+        # Что уже записано в ChromaDB — для diff-сохранения
+        self._persisted_layers: dict[str, str] = {}  # memory_id → layer
+        self._persisted_actions = 0
+        self._persisted_decisions = 0
+        self._actions_dirty = False
+        self._decisions_dirty = False
+        self._legacy_ids: list[str] = []
+        self._lt_index: Optional[_LongTermIndex] = None
+        # Версия содержимого памяти — ключ кэша format_for_prompt
+        self._version = 0
+        self._prompt_cache_key: Optional[tuple] = None
+        self._prompt_cache = ""
+        self.vector_layer = VectorMemoryLayer(agent_id, user_id=user_id, text_pool=self._text_pool,
+                                              load=load)
+        if load:
+            self.load_from_db()
 
     def _get_registry(self):
         """Get agent registry (session-scoped or global fallback)."""
@@ -57,16 +190,21 @@ class AgentMemorySystem:
             return self._registry
         return agent_registry
 
+    def _touch(self):
+        """Отметить изменение памяти — сбрасывает кэш format_for_prompt."""
+        self._version += 1
+
     def add_memory(self, tick: int, speaker: str, text: str, importance: float = 0.5,
                    addressed_to: str = "", addressed_to_id: str = "",
                    speaker_id: str = "",
                    is_event: bool = False, is_action_result: bool = False):
         if not speaker_id and speaker:
             speaker_id = self._get_registry().get_id(speaker) or ""
+        text = self._text_pool.share(text)
 
         memory = MemoryItem(
             tick=tick, speaker=speaker, text=text,
-            timestamp=datetime.now().isoformat(),
+            timestamp=int(time.time()),
             importance=importance,
             speaker_id=speaker_id,
             addressed_to=addressed_to,
@@ -77,6 +215,7 @@ class AgentMemorySystem:
 
         self.short_term.append(memory)
         self._memories_since_save += 1
+        self._touch()
 
         # Параллельно сохраняем в векторную БД
         self.vector_layer.add_document(
@@ -99,11 +238,13 @@ class AgentMemorySystem:
     def add_group_decision(self, tick: int, proposer: str, decision: str, proposer_id: str = ""):
         """Записать решение группы или предложение агента."""
         self.group_decisions.append({
-            "tick": tick, "proposer": proposer, "proposer_id": proposer_id,
-            "decision": decision[:200],
+            "tick": tick, "proposer": sys.intern(proposer), "proposer_id": sys.intern(proposer_id),
+            "decision": self._text_pool.share(decision[:200]),
         })
         if len(self.group_decisions) > 15:
             self.group_decisions = self.group_decisions[-15:]
+        self._decisions_dirty = True
+        self._touch()
 
     def get_group_decisions_text(self) -> str:
         """Форматировать решения группы для промпта."""
@@ -122,6 +263,8 @@ class AgentMemorySystem:
         self.completed_actions.append(action_text.lower().strip()[:100])
         if len(self.completed_actions) > 20:
             self.completed_actions = self.completed_actions[-20:]
+        self._actions_dirty = True
+        self._touch()
 
     def has_done_similar(self, action_text: str) -> bool:
         """Проверить, делал ли агент уже подобное."""
@@ -155,15 +298,27 @@ class AgentMemorySystem:
     def clear_pending_questions(self):
         self.pending_questions = []
 
+    def _long_term_index(self) -> _LongTermIndex:
+        """Индекс long-term; перестраивается, если список заменили целиком."""
+        index = self._lt_index
+        if index is None or index.source is not self.long_term or len(index) != len(self.long_term):
+            index = self._lt_index = _LongTermIndex(self.long_term)
+        return index
+
     def _consolidate_to_long_term(self, memory: MemoryItem):
+        index = self._long_term_index()
         self.long_term.append(memory)
+        index.add(memory)
         if len(self.long_term) > LONG_TERM_MEMORY:
-            removable = [m for m in self.long_term if not m.is_event and not m.is_action_result]
-            if removable:
-                removable.sort(key=lambda m: m.importance)
-                to_remove = removable[0]
-                self.long_term.remove(to_remove)
+            to_remove = index.least_important_evictable()
+            if to_remove is not None:
+                index.remove(to_remove)
+                for i, m in enumerate(self.long_term):
+                    if m is to_remove:
+                        del self.long_term[i]
+                        break
             else:
+                # Все записи — события/результаты (редкий случай): прежняя логика
                 self.long_term.sort(key=lambda m: m.importance, reverse=True)
                 self.long_term = self.long_term[:LONG_TERM_MEMORY]
 
@@ -188,19 +343,21 @@ class AgentMemorySystem:
         regular_memories = [m for m in older_memories if id(m) not in critical_set]
 
         current_tick = max((m.tick for m in all_memories), default=0)
-        regular_memories.sort(
-            key=lambda m: self._decayed_importance(m, current_tick),
-            reverse=True
-        )
+
+        def decayed(m: MemoryItem) -> float:
+            return self._decayed_importance(m, current_tick)
 
         slots_for_regular = max(target_size - len(fresh_memories) - len(critical_memories), 5)
-        top_important = regular_memories[:slots_for_regular]
+        # nlargest эквивалентен sorted(..., reverse=True)[:n], но без полной сортировки
+        top_important = heapq.nlargest(slots_for_regular, regular_memories, key=decayed)
+        top_set = set(id(m) for m in top_important)
 
-        remaining = regular_memories[slots_for_regular:]
+        remaining = [m for m in regular_memories if id(m) not in top_set]
         summary_memories = []
 
         if len(remaining) > 5:
-            remaining_sorted = sorted(remaining, key=lambda m: m.tick)
+            # Порядок внутри тика — как при сортировке по убыванию важности
+            remaining_sorted = sorted(remaining, key=lambda m: (m.tick, -decayed(m)))
             episodes: list[list[MemoryItem]] = []
             current_episode: list[MemoryItem] = [remaining_sorted[0]]
 
@@ -237,7 +394,7 @@ class AgentMemorySystem:
                     summary_memories.append(MemoryItem(
                         tick=episode[-1].tick,
                         speaker="[СВОДКА]", text=f"[тики {tick_range}] {summary[:250]}",
-                        timestamp=datetime.now().isoformat(), importance=0.65,
+                        timestamp=int(time.time()), importance=0.65,
                         is_event=False, is_action_result=False,
                     ))
 
@@ -248,6 +405,7 @@ class AgentMemorySystem:
         old_size = len(all_memories)
         self.short_term = fresh_memories
         self.long_term = new_long_term
+        self._touch()
         new_size = len(self.short_term) + len(self.long_term)
 
         print(f"{Fore.GREEN}Память сжата: {old_size} -> {new_size} элементов{Style.RESET_ALL}")
@@ -304,7 +462,7 @@ class AgentMemorySystem:
                     tick=episode[-1].tick,
                     speaker="[СВОДКА]",
                     text=f"[{old_name}→{new_name}] {summary[:250]}",
-                    timestamp=datetime.now().isoformat(), importance=0.7,
+                    timestamp=int(time.time()), importance=0.7,
                     is_event=False, is_action_result=False,
                 ))
 
@@ -316,6 +474,8 @@ class AgentMemorySystem:
         for mem in self.short_term + self.long_term:
             if mem.speaker == old_name:
                 mem.speaker = new_name
+                mem.dirty = True
+        self._touch()
 
         self.save_to_db()
         print(f"{Fore.GREEN}Консолидация завершена: {len(affected)} записей -> "
@@ -332,8 +492,7 @@ class AgentMemorySystem:
                 default=0
             )
         age = max(current_tick - memory.tick, 0)
-        factor = IMPORTANCE_DECAY_FACTOR if not memory.is_event else (IMPORTANCE_DECAY_FACTOR ** 0.5)
-        return memory.importance * (factor ** age)
+        return memory.importance * (_decay_factor(memory) ** age)
 
     def get_relevant_long_term(self, n: int = 5) -> list[MemoryItem]:
         """Приоритет — события и результаты действий, с temporal decay."""
@@ -341,13 +500,42 @@ class AgentMemorySystem:
             (m.tick for m in self.short_term + self.long_term),
             default=0
         )
-        sorted_memories = sorted(self.long_term, key=lambda m: (
-            m.is_event or m.is_action_result,
-            self._decayed_importance(m, current_tick)
-        ), reverse=True)
-        return sorted_memories[:n]
+        index = self._long_term_index()
+
+        def decayed(m: MemoryItem) -> float:
+            return self._decayed_importance(m, current_tick)
+
+        def ranked(candidates: list[MemoryItem]) -> list[MemoryItem]:
+            candidates.sort(key=index.seq)
+            candidates.sort(key=decayed, reverse=True)
+            return candidates
+
+        result = ranked(index.candidates("event", n) + index.candidates("action", n))[:n]
+        if len(result) < n:
+            result += ranked(index.candidates("regular", n - len(result)))[:n - len(result)]
+        if result and decayed(result[-1]) <= 0:
+            # Затухание ушло в ноль (очень старые записи) — лог-ключи больше не
+            # отражают порядок равных нулей, считаем полной сортировкой
+            return sorted(self.long_term, key=lambda m: (
+                m.is_event or m.is_action_result, decayed(m)
+            ), reverse=True)[:n]
+        return result
 
     def format_for_prompt(self) -> str:
+        """Контекст памяти для system prompt.
+
+        Кэшируется до изменения памяти или реестра имён: повторные вызовы в том же
+        тике (ретраи, рассылка сообщения пользователя) не пересчитывают контекст.
+        """
+        registry = self._get_registry()
+        cache_key = (self._version, id(registry), registry.version)
+        if cache_key == self._prompt_cache_key:
+            return self._prompt_cache
+        self._prompt_cache = self._build_prompt_context()
+        self._prompt_cache_key = cache_key
+        return self._prompt_cache
+
+    def _build_prompt_context(self) -> str:
         context_parts = []
 
         # Решения группы — критически важно для консистентности
@@ -400,29 +588,112 @@ class AgentMemorySystem:
         return "\n".join(context_parts) if context_parts else ""
 
     def save_to_db(self):
-        chroma_storage.save_agent_memories(
-            agent_id=self.agent_id,
-            short_term=[m.to_dict() for m in self.short_term],
-            long_term=[m.to_dict() for m in self.long_term],
-            completed_actions=self.completed_actions,
-            group_decisions=self.group_decisions,
-            user_id=self.user_id,
-        )
+        """Diff-сохранение: пишем только новые/изменённые записи и удаляем вытесненные."""
+        changed = []
+        current_layers: dict[str, str] = {}
+        for layer, items in (("short_term", self.short_term), ("long_term", self.long_term)):
+            for m in items:
+                current_layers[m.memory_id] = layer
+                if m.dirty or self._persisted_layers.get(m.memory_id) != layer:
+                    row = m.to_dict()
+                    row["layer"] = layer
+                    changed.append(row)
+
+        deleted = [chroma_storage.memory_doc_id(self.agent_id, mid)
+                   for mid in self._persisted_layers if mid not in current_layers]
+        deleted.extend(self._legacy_ids)
+
+        actions = None
+        if self._actions_dirty:
+            actions = self.completed_actions
+            deleted.extend(chroma_storage.action_doc_id(self.agent_id, i)
+                           for i in range(len(actions), self._persisted_actions))
+        decisions = None
+        if self._decisions_dirty:
+            decisions = self.group_decisions
+            deleted.extend(chroma_storage.decision_doc_id(self.agent_id, i)
+                           for i in range(len(decisions), self._persisted_decisions))
+
+        if changed or deleted or actions is not None or decisions is not None:
+            chroma_storage.save_agent_memories(
+                agent_id=self.agent_id,
+                memories=changed,
+                deleted_ids=deleted,
+                completed_actions=actions,
+                group_decisions=decisions,
+                user_id=self.user_id,
+            )
+
+        for items in (self.short_term, self.long_term):
+            for m in items:
+                m.dirty = False
+        self._persisted_layers = current_layers
+        self._legacy_ids = []
+        if actions is not None:
+            self._persisted_actions = len(actions)
+            self._actions_dirty = False
+        if decisions is not None:
+            self._persisted_decisions = len(decisions)
+            self._decisions_dirty = False
+
         try:
             self.vector_layer.save()
         except Exception:
             pass
 
-    def load_from_db(self):
+    def hydrate(self, state: dict):
+        """Заполнить память из chroma_storage.agent_state() без отдельных запросов."""
+        self.load_from_db(state["memory"])
+        self.vector_layer._load(state["vector"])
+
+    def mark_unsaved(self):
+        """Считать всю память несохранённой: следующий save_to_db запишет её целиком.
+
+        Нужно, когда память переезжает к другому user_id (пул заранее собранных сессий).
+        """
+        for items in (self.short_term, self.long_term):
+            for m in items:
+                m.dirty = True
+        self._persisted_layers = {}
+        self._legacy_ids = []
+        self._persisted_actions = 0
+        self._persisted_decisions = 0
+        self._actions_dirty = True
+        self._decisions_dirty = True
+        self.vector_layer.mark_unsaved()
+
+    def load_from_db(self, data: Optional[dict] = None):
+        """Загрузить память из ChromaDB (или из уже полученного dict load_agent_memories)."""
         try:
-            data = chroma_storage.load_agent_memories(self.agent_id, user_id=self.user_id)
+            if data is None:
+                data = chroma_storage.load_agent_memories(self.agent_id, user_id=self.user_id)
             _removed_fields = {'openness', 'conscientiousness', 'extraversion',
                                'agreeableness', 'neuroticism', 'talkativeness'}
             def _clean(item: dict) -> dict:
-                return {k: v for k, v in item.items() if k not in _removed_fields}
-            self.short_term = [MemoryItem(**_clean(item)) for item in data.get("short_term", [])]
-            self.long_term = [MemoryItem(**_clean(item)) for item in data.get("long_term", [])]
+                item = {k: v for k, v in item.items() if k not in _removed_fields}
+                item["timestamp"] = _parse_timestamp(item.get("timestamp"))
+                item["text"] = self._text_pool.share(item.get("text", ""))
+                return item
+            self._persisted_layers = {}
+            loaded = {}
+            for layer in ("short_term", "long_term"):
+                items = []
+                for item in data.get(layer, []):
+                    mem = MemoryItem(**_clean(item))
+                    # Записи старого формата (без memory_id) получили новый ID
+                    # и остаются dirty — пересохранятся при первом save
+                    if item.get("memory_id"):
+                        mem.dirty = False
+                        self._persisted_layers[mem.memory_id] = layer
+                    items.append(mem)
+                loaded[layer] = items
+            self.short_term = loaded["short_term"]
+            self.long_term = loaded["long_term"]
             self.completed_actions = data.get("completed_actions", [])
             self.group_decisions = data.get("group_decisions", [])
+            self._legacy_ids = list(data.get("legacy_ids", []))
+            self._persisted_actions = len(self.completed_actions)
+            self._persisted_decisions = len(self.group_decisions)
+            self._touch()
         except Exception as e:
             print(f"{Fore.YELLOW}Не удалось загрузить память для {self.agent_id}: {e}{Style.RESET_ALL}")
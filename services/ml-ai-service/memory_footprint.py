@@ -0,0 +1,85 @@
+"""
+Отчёт о памяти сессии: сколько байт занимает каждый агент и каждый слой.
+
+Размер считается обходом объектов (sys.getsizeof + содержимое). Общие объекты
+(строки из TextPool, интернированные имена) учитываются один раз — за тем
+слоем, где встретились первыми, поэтому сумма по слоям = реальный объём сессии.
+"""
+
+import sys
+from dataclasses import fields, is_dataclass
+
+
+class _Sizer:
+    """Глубокий подсчёт размера с учётом уже посчитанных объектов."""
+
+    def __init__(self):
+        self._seen: set[int] = set()
+
+    def size(self, obj) -> int:
+        if id(obj) in self._seen:
+            return 0
+        self._seen.add(id(obj))
+        total = sys.getsizeof(obj)
+
+        if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+            return total
+        if isinstance(obj, dict):
+            for k, v in obj.items():
+                total += self.size(k) + self.size(v)
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            for item in obj:
+                total += self.size(item)
+        elif is_dataclass(obj):
+            for f in fields(obj):
+                total += self.size(getattr(obj, f.name))
+        return total
+
+    def size_all(self, items) -> int:
+        return sum(self.size(item) for item in items)
+
+
+def agent_footprint(agent, sizer: _Sizer = None) -> dict:
+    """Байты по слоям памяти одного агента."""
+    sizer = sizer or _Sizer()
+    mem = agent.memory_system
+    vector = mem.vector_layer
+    layers = {
+        "short_term": sizer.size(mem.short_term),
+        "long_term": sizer.size(mem.long_term),
+        "vector_documents": sizer.size(vector.documents),
+        "vector_index": sizer.size(vector._tfidf_cache) + sizer.size(vector._idf_cache),
+        "completed_actions": sizer.size(mem.completed_actions),
+        "group_decisions": sizer.size(mem.group_decisions),
+        "pending_questions": sizer.size(mem.pending_questions),
+        "prompt_cache": sizer.size(mem._prompt_cache) + sizer.size(agent._persona_cache),
+    }
+    layers["total"] = sum(layers.values())
+    layers["records"] = len(mem.short_term) + len(mem.long_term) + len(vector.documents)
+    return layers
+
+
+def session_footprint(orchestrator) -> dict:
+    """
+    Отчёт по сессии: агенты (по слоям), история диалога, пул текстов.
+
+    Агенты считаются первыми: текст, общий для истории и памяти, засчитывается агенту.
+    """
+    sizer = _Sizer()
+    agents = {}
+    for agent in orchestrator.agents:
+        agents[agent.agent_id] = agent_footprint(agent, sizer)
+
+    conversation_bytes = sizer.size(orchestrator.conversation)
+    pool = orchestrator._text_pool
+    pool_texts = pool.texts()
+    pool_bytes = sizer.size(pool_texts)  # только строки, не попавшие ни в один слой
+
+    agents_total = sum(a["total"] for a in agents.values())
+    return {
+        "agents": agents,
+        "agents_total": agents_total,
+        "conversation": {"entries": len(orchestrator.conversation), "bytes": conversation_bytes},
+        "text_pool": {"entries": len(pool_texts), "unreferenced_bytes": pool_bytes},
+        "total": agents_total + conversation_bytes + pool_bytes,
+    }
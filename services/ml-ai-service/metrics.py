@@ -0,0 +1,146 @@
+"""
+Метрики сервиса в текстовом формате Prometheus (GET /metrics).
+
+Отдельно метрики почти не копятся: при каждом опросе значения читаются из
+объектов, которые и так ведут учёт, — session_manager, слоты LLM, фоновый
+писатель ChromaDB, очередь аудита, окна задержек (slo.LatencyTracker).
+Опрос не берёт lock'и сессий и не ходит в ChromaDB: только len() и счётчики,
+поэтому его можно делать раз в несколько секунд и под полной нагрузкой.
+
+Скорость тиков — счётчик ml_session_ticks_total, в Prometheus это
+rate(ml_session_ticks_total[1m]) по user_id.
+"""
+
+from typing import Optional
+
+import chroma_storage
+from admission import admission
+from audit_client import audit_queue
+from llm_client import _llm_slots
+from session import session_manager
+from slo import LatencyTracker, slo_tracker
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_QUANTILES = (0.5, 0.9, 0.99)
+
+# Длительность тика фоновой симуляции (по всем сессиям процесса)
+tick_latency = LatencyTracker()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels: Optional[dict]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+class MetricsText:
+    """Тело ответа /metrics: семейства (HELP, TYPE) и их значения."""
+
+    def __init__(self):
+        self._lines: list[str] = []
+
+    def family(self, name: str, kind: str, help_text: str):
+        self._lines.append(f"# HELP {name} {help_text}")
+        self._lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name: str, value: float, labels: Optional[dict] = None):
+        self._lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    def gauge(self, name: str, help_text: str, value: float):
+        self.family(name, "gauge", help_text)
+        self.sample(name, value)
+
+    def counter(self, name: str, help_text: str, value: float):
+        self.family(name, "counter", help_text)
+        self.sample(name, value)
+
+    def summary(self, name: str, tracker: LatencyTracker, labels: Optional[dict] = None):
+        """Квантили по окну трекера, _sum и _count — за всё время."""
+        count, total, samples = tracker.snapshot()
+        labels = labels or {}
+        for q in _QUANTILES:
+            value = samples[min(len(samples) - 1, int(len(samples) * q))] if samples else float("nan")
+            self.sample(name, round(value, 6), {**labels, "quantile": q})
+        self.sample(f"{name}_sum", round(total, 6), labels or None)
+        self.sample(f"{name}_count", count, labels or None)
+
+    def render(self) -> str:
+        return "\n".join(self._lines) + "\n"
+
+
+def render_metrics(simulation_threads: int, hibernated_sessions: int) -> str:
+    """Снять метрики процесса. Аргументы — состояние api.py, которое живёт только там."""
+    out = MetricsText()
+    sessions = session_manager.resident_sessions()
+
+    # ─── Сессии и очереди ──────────────────────────────────────
+    out.gauge("ml_sessions_resident", "Сессии в памяти процесса.", len(sessions))
+    out.gauge("ml_sessions_active", "Активные сессии в памяти.", sum(1 for s in sessions if s.is_active))
+    out.gauge("ml_sessions_hibernated", "Сессии, выгруженные на диск.", hibernated_sessions)
+    out.gauge("ml_simulation_threads", "Живые потоки фоновой симуляции.", simulation_threads)
+    out.gauge("ml_user_messages_waiting", "Принятые сообщения пользователей, ждущие или держащие lock сессии.",
+              admission.total_pending)
+    out.family("ml_admission_rejected_total", "counter", "Отказы в приёме сообщений (429/503) по причинам.")
+    for reason, count in admission.rejected.items():
+        out.sample("ml_admission_rejected_total", count, {"reason": reason})
+
+    # ─── Тики ──────────────────────────────────────────────────
+    out.family("ml_session_ticks_total", "counter", "Тики симуляции сессии (rate — тиков в секунду).")
+    for session in sessions:
+        if session.orchestrator is not None:
+            out.sample("ml_session_ticks_total", session.orchestrator.tick, {"user_id": session.user_id})
+    out.family("ml_tick_duration_seconds", "summary", "Длительность тика фоновой симуляции.")
+    out.summary("ml_tick_duration_seconds", tick_latency)
+
+    # ─── LLM ───────────────────────────────────────────────────
+    out.gauge("ml_llm_slots", "Одновременных запросов к LLM на процесс (LLM_MAX_CONCURRENCY).", _llm_slots.size)
+    out.gauge("ml_llm_in_flight", "Запросы к LLM в работе.", _llm_slots.in_flight)
+    out.gauge("ml_llm_waiting", "Потоки, ждущие свободный слот LLM.", _llm_slots.waiting)
+    out.gauge("ml_llm_user_queue_age_seconds", "Сколько ждёт слот самый давний запрос пользователя.",
+              round(_llm_slots.user_queue_age(), 6))
+    out.family("ml_llm_wait_seconds", "summary", "Ожидание свободного слота LLM.")
+    out.summary("ml_llm_wait_seconds", _llm_slots.wait_latency)
+
+    # ─── Задержки ответа пользователю ──────────────────────────
+    out.family("ml_user_latency_seconds", "summary", "Задержки ответа пользователю (см. /api/v1/ml/slo).")
+    for kind, tracker in slo_tracker.trackers().items():
+        out.summary("ml_user_latency_seconds", tracker, {"kind": kind})
+
+    # ─── ChromaDB ──────────────────────────────────────────────
+    writer = chroma_storage.storage_writer
+    out.gauge("ml_chroma_queue_rows", "Записи в очереди фонового писателя ChromaDB.", writer.pending_rows)
+    out.family("ml_chroma_flush_seconds", "summary", "Запись одного батча в ChromaDB.")
+    out.summary("ml_chroma_flush_seconds", writer.flush_latency)
+    out.counter("ml_chroma_written_rows_total", "Записи, отправленные в ChromaDB.", writer.written_rows)
+    out.counter("ml_chroma_coalesced_rows_total", "Записи, заменённые более поздними до отправки.",
+                writer.coalesced_rows)
+    out.counter("ml_chroma_failed_batches_total", "Батчи, которые не удалось записать.", writer.failed_batches)
+
+    # ─── Память агентов ────────────────────────────────────────
+    out.family("ml_agent_memories", "gauge", "Воспоминания агента по слоям.")
+    vector_rows = []
+    for session in sessions:
+        orchestrator = session.orchestrator
+        if orchestrator is None:
+            continue
+        for agent in list(orchestrator.agents):
+            memory = agent.memory_system
+            labels = {"user_id": session.user_id, "agent_id": agent.agent_id}
+            out.sample("ml_agent_memories", len(memory.short_term), {**labels, "layer": "short_term"})
+            out.sample("ml_agent_memories", len(memory.long_term), {**labels, "layer": "long_term"})
+            vector_rows.append((labels, len(memory.vector_layer.documents)))
+    out.family("ml_agent_vector_documents", "gauge", "Документы векторной памяти агента.")
+    for labels, count in vector_rows:
+        out.sample("ml_agent_vector_documents", count, labels)
+
+    # ─── Аудит ─────────────────────────────────────────────────
+    out.gauge("ml_audit_queue_depth", "События в очереди отправки в Audit Service.", audit_queue.depth)
+    out.counter("ml_audit_sent_total", "События, переданные в Audit Service.", audit_queue.sent)
+    out.counter("ml_audit_dropped_total", "События, отброшенные из-за переполнения очереди.", audit_queue.dropped)
+
+    return out.render()
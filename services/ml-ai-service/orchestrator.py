@@ -6,7 +6,10 @@
 import re
 import time
 import random
-from typing import Optional
+import itertools
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
 
 from colorama import Fore, Style
 
@@ -16,7 +19,7 @@ from config import (
     SCENARIO_EVENT_INTERVAL, CREATIVITY_BOOST,
     RELATIONSHIP_CHANGE_RATE, REPETITION_SIMILARITY_THRESHOLD,
     REPETITION_CONSECUTIVE_LIMIT, PHASE_TICKS,
-    GOBLIN_DISTRUST, TICK_DELAY,
+    GOBLIN_DISTRUST, TICK_DELAY, LLM_MAX_CONCURRENCY,
 )
 from models import (
     PersonalityType, BigFiveTraits, RaceType,
@@ -24,25 +27,40 @@ from models import (
 )
 from memory import AgentMemorySystem
 from agent_registry import agent_registry
+from text_pool import text_pool as global_text_pool
+from memory_footprint import session_footprint
+from snapshot import snapshot_orchestrator, restore_orchestrator
+from conversation_log import ConversationLog
 from agent import Agent
 from topics import TopicManager, DialoguePhaseManager
 from scenarios import ScenarioManager, UserEventInput
-from llm_client import llm_chat
+from llm_client import llm_chat, llm_chat_stream, user_priority, preemptible
 from utils import text_similarity, extract_phrases, has_banned_pattern, has_repetitive_pattern
 from audit_client import send_audit_event
+import chroma_storage
 from data_presets.race_presets import RACE_PRESETS, AGENT_COLORS
 
+# Параллельная генерация ответов на сообщение «всем» (общий на все сессии)
+_reply_executor = ThreadPoolExecutor(max_workers=max(1, LLM_MAX_CONCURRENCY), thread_name_prefix="agent-reply")
+
 
 def create_agents(race_preset: str = "humans", user_id: str = "",
-                  registry: 'AgentRegistry' = None) -> list['Agent']:
+                  registry: 'AgentRegistry' = None,
+                  text_pool: 'TextPool' = None,
+                  session_state: Optional[dict] = None) -> list['Agent']:
     """Создать агентов по выбранному расовому пресету.
     
     Args:
         race_preset: Ключ пресета расового состава.
         user_id: ID пользователя для изоляции данных.
         registry: Изолированный реестр агентов сессии (если None — глобальный).
+        text_pool: Пул текстов сессии (если None — глобальный).
+        session_state: Результат chroma_storage.load_session_state(). Если None —
+            загружается здесь (по одному запросу на коллекцию, не на агента).
     """
     _reg = registry if registry is not None else agent_registry
+    if session_state is None:
+        session_state = chroma_storage.load_session_state(user_id)
     preset = RACE_PRESETS.get(race_preset, RACE_PRESETS["humans"])
     agents_data = preset["agents"]
 
@@ -71,7 +89,10 @@ def create_agents(race_preset: str = "humans", user_id: str = "",
             color=color,
             user_id=user_id,
             _registry=registry,
+            _text_pool=text_pool,
+            _load_memory=False,
         )
+        agent.memory_system.hydrate(chroma_storage.agent_state(session_state, agent.agent_id))
         agents.append(agent)
 
     for a in agents:
@@ -101,14 +122,22 @@ def create_agents(race_preset: str = "humans", user_id: str = "",
 class BigBrotherOrchestrator:
     def __init__(self, agents: list[Agent], scenario_name: str = "desert_island",
                  user_event_input: Optional[UserEventInput] = None,
-                 user_id: str = "", registry: 'AgentRegistry' = None):
+                 user_id: str = "", registry: 'AgentRegistry' = None,
+                 text_pool: 'TextPool' = None, load_state: bool = True,
+                 session_state: Optional[dict] = None):
         self.agents = agents
         self.user_id = user_id
         self._registry = registry if registry is not None else agent_registry
-        self.conversation: list[dict] = []
+        self._text_pool = text_pool if text_pool is not None else global_text_pool
+        self.conversation: ConversationLog = ConversationLog(user_id)  # хвост в памяти, остальное на диске
         self.tick = 0
-        self.topic_manager = TopicManager(user_id=user_id)
-        self.scenario_manager = ScenarioManager(scenario_name, user_id=user_id)
+        # session_state — уже загруженное состояние (chroma_storage.load_session_state)
+        self.topic_manager = TopicManager(user_id=user_id, load=load_state and session_state is None)
+        self.scenario_manager = ScenarioManager(scenario_name, user_id=user_id,
+                                                load=load_state and session_state is None)
+        if load_state and session_state is not None:
+            self.topic_manager.load_from_db(session_state["topic"])
+            self.scenario_manager.load_from_db(session_state["scenario"])
         self.active_event: Optional[str] = None
         self.event_started_tick: int = 0
         self.quality_warnings: int = 0
@@ -121,6 +150,12 @@ class BigBrotherOrchestrator:
         self._quit_requested = False
         self.tick_delay = TICK_DELAY
         self._next_agent_index = len(agents)  # Счётчик для уникальных agent_id
+        # Потоковая выдача реплик (WebSocket): кадры start/token/commit/retract
+        self._stream_sinks: list[Callable[[dict], None]] = []
+        self._open_replies: dict[str, dict] = {}  # agent_id → реплика, которая сейчас генерируется
+        self._reply_ids = itertools.count(1)
+        # preempt() → True, если ждёт сообщение пользователя: фоновый тик уступает
+        self.preempt: Optional[Callable[[], bool]] = None
 
     # ─── Динамическое управление агентами ─────────────────────
 
@@ -159,6 +194,7 @@ class BigBrotherOrchestrator:
             color=color,
             user_id=self.user_id,
             _registry=self._registry,
+            _text_pool=self._text_pool,
         )
 
         self._registry.register(agent_id, name)
@@ -656,6 +692,10 @@ class BigBrotherOrchestrator:
         self.remove_agent(raw_command)
 
     def inject_user_event(self, event_text: str):
+        with chroma_storage.write_batch():
+            self._inject_user_event_core(event_text)
+
+    def _inject_user_event_core(self, event_text: str):
         event_text = event_text.strip()
         if not event_text:
             return
@@ -722,12 +762,23 @@ class BigBrotherOrchestrator:
                 print(f"{tick_str} {name_str} {arrow}: {text_str}")
         print()
 
-    def inject_user_message_api(self, message_text: str, target_agents: list[Agent]) -> list[dict]:
-        """Инжектить сообщение пользователя (API режим, возвращает ответы)."""
-        return self._inject_user_message_core(message_text, target_agents)
+    def inject_user_message_api(self, message_text: str, target_agents: list[Agent],
+                                on_reply: Optional[Callable[[str, Optional[str]], None]] = None) -> list[dict]:
+        """Инжектить сообщение пользователя (API режим, возвращает ответы).
 
-    def _inject_user_message_core(self, message_text: str, target_agents: list[Agent]) -> list[dict]:
+        on_reply(agent_id, text) — вызывается, как только ответ агента готов
+        (text=None — агент не ответил или ответ отклонён)."""
+        return self._inject_user_message_core(message_text, target_agents, on_reply)
+
+    def _inject_user_message_core(self, message_text: str, target_agents: list[Agent],
+                                  on_reply: Optional[Callable[[str, Optional[str]], None]] = None) -> list[dict]:
         """Ядро обработки сообщения пользователя. Возвращает список ответов агентов."""
+        # Записи всех агентов в ChromaDB уходят одним набором запросов в конце
+        with chroma_storage.write_batch():
+            return self._process_user_message(message_text, target_agents, on_reply)
+
+    def _process_user_message(self, message_text: str, target_agents: list[Agent],
+                              on_reply: Optional[Callable[[str, Optional[str]], None]] = None) -> list[dict]:
         message_text = message_text.strip()
         if not message_text or not target_agents:
             return []
@@ -761,7 +812,61 @@ class BigBrotherOrchestrator:
             if is_target:
                 agent.memory_system.add_pending_question(self.tick, "Игрок", message_text, from_id="user")
 
-        for agent in target_agents:
+        # Черновики ответов генерируются параллельно (до LLM_MAX_CONCURRENCY) из одного
+        # снимка диалога; в диалог и память попадают по очереди, в порядке target_agents
+        def draft(agent: Agent) -> Optional[str]:
+            with user_priority():
+                text = self._draft_user_reply(agent, message_text, is_personal)
+            if on_reply:
+                on_reply(agent.agent_id, text)
+            return text
+
+        if len(target_agents) > 1:
+            drafts = list(_reply_executor.map(draft, target_agents))
+        else:
+            drafts = [draft(target_agents[0])]
+
+        for agent, text in zip(target_agents, drafts):
+            if not text:
+                continue
+            agent_display = self._registry.get_name(agent.agent_id)
+            reply_entry = {
+                "tick": self.tick, "agent_id": agent.agent_id,
+                "name": agent_display, "text": text,
+            }
+            self.conversation.append(reply_entry)
+            self.topic_manager.record_message(agent_display)
+
+            # Собираем ответ для возврата через API
+            responses.append({
+                "agent_id": agent.agent_id,
+                "name": agent_display,
+                "text": text,
+                "tick": self.tick,
+                "race": agent.race.race_type.value,
+                "race_emoji": agent.race.emoji,
+                "mood": agent.mood.get_dominant_emotion(),
+            })
+
+            for a in self.agents:
+                is_own = (a.agent_id == agent.agent_id)
+                a.process_message(self.tick, agent_display, text, is_own, speaker_id=agent.agent_id)
+
+            if agent.memory_system.pending_questions:
+                agent.memory_system.clear_pending_questions()
+
+            agent.update_talkativeness_spoke()
+            agent.memory_system.record_action(text)
+
+        return responses
+
+    def _draft_user_reply(self, agent: Agent, message_text: str, is_personal: bool) -> Optional[str]:
+        """
+        Ответ агента Игроку, прошедший очистку и проверку качества, или None.
+        Состояние не меняет (кроме счётчика предупреждений) — безопасно вызывать
+        для нескольких агентов параллельно, пока диалог не меняется.
+        """
+        try:
             scenario_context = self.scenario_manager.get_scenario_context()
             phase_instruction = self.phase_manager.get_phase_instruction()
 
@@ -771,8 +876,8 @@ class BigBrotherOrchestrator:
                 phase_instruction=phase_instruction,
                 force_event_reaction=False,
             )
+            agent_display = self._registry.get_name(agent.agent_id)
             if messages and messages[-1]["role"] == "user":
-                agent_display = self._registry.get_name(agent.agent_id)
                 messages[-1] = {"role": "user", "content": (
                     f"Игрок обращается {'лично к тебе' if is_personal else 'ко всем'}: "
                     f"'{message_text}'. "
@@ -781,25 +886,24 @@ class BigBrotherOrchestrator:
                     f"1-3 предложения. Не пиши за других."
                 )}
 
-            raw_response = llm_chat(messages)
+            raw_response = self._reply_llm(agent, messages)
             text = None
             if raw_response:
-                text = self._clean_response(raw_response, self._registry.get_name(agent.agent_id))
+                text = self._clean_response(raw_response, agent_display)
 
             if not text:
-                agent_display = self._registry.get_name(agent.agent_id)
                 retry_messages = messages.copy()
                 retry_messages.append({"role": "user", "content":
                     f"Ты — {agent_display}. Ответь Игроку на: '{message_text[:80]}'. "
                     f"КОРОТКО, 1-2 предложения. РУССКИЙ. НЕ пиши за других."
                 })
-                raw_retry = llm_chat(retry_messages, temperature=1.0)
+                raw_retry = self._reply_llm(agent, retry_messages, temperature=1.0)
                 if raw_retry:
-                    text = self._clean_response(raw_retry, self._registry.get_name(agent.agent_id))
+                    text = self._clean_response(raw_retry, agent_display)
 
             if not text:
-                print(f"{Fore.WHITE}  {self._registry.get_name(agent.agent_id)} не смог ответить на сообщение.{Style.RESET_ALL}")
-                continue
+                print(f"{Fore.WHITE}  {agent_display} не смог ответить на сообщение.{Style.RESET_ALL}")
+                return None
 
             for a in self.agents:
                 a_display = self._registry.get_name(a.agent_id)
@@ -807,46 +911,92 @@ class BigBrotherOrchestrator:
                 if text.startswith(prefix):
                     text = text[len(prefix):].strip()
                     break
-            text = self._strip_other_agents_speech(text, self._registry.get_name(agent.agent_id))
+            text = self._strip_other_agents_speech(text, agent_display)
 
             if not text or len(text) < 3:
-                continue
+                return None
 
             quality_ok, quality_reason = self._check_quality(text, agent)
             if not quality_ok:
-                print(f"{Fore.RED}  BigBrother отклонил ответ {self._registry.get_name(agent.agent_id)}: {quality_reason}{Style.RESET_ALL}")
-                continue
-
-            agent_display = self._registry.get_name(agent.agent_id)
-            reply_entry = {
-                "tick": self.tick, "agent_id": agent.agent_id,
-                "name": agent_display, "text": text,
-            }
-            self.conversation.append(reply_entry)
-            self.topic_manager.record_message(agent_display)
-
-            # Собираем ответ для возврата через API
-            responses.append({
-                "agent_id": agent.agent_id,
-                "name": agent_display,
-                "text": text,
-                "tick": self.tick,
-                "race": agent.race.race_type.value,
-                "race_emoji": agent.race.emoji,
-                "mood": agent.mood.get_dominant_emotion(),
-            })
-
-            for a in self.agents:
-                is_own = (a.agent_id == agent.agent_id)
-                a.process_message(self.tick, agent_display, text, is_own, speaker_id=agent.agent_id)
-
-            if agent.memory_system.pending_questions:
-                agent.memory_system.clear_pending_questions()
+                print(f"{Fore.RED}  BigBrother отклонил ответ {agent_display}: {quality_reason}{Style.RESET_ALL}")
+                return None
 
-            agent.update_talkativeness_spoke()
-            agent.memory_system.record_action(text)
+            self._close_reply(agent.agent_id, text)  # в стрим — сразу, не дожидаясь остальных
+            return text
+        finally:
+            self._close_reply(agent.agent_id, None, "rejected")
+
+    def _yield_to_user(self) -> bool:
+        """Проверка перед LLM-запросами фонового тика: ждёт пользователь — тик прерывается."""
+        if self.preempt is not None and self.preempt():
+            print(f"{Fore.WHITE}  [tick {self.tick:>3}] тик уступил сообщению пользователя{Style.RESET_ALL}")
+            return True
+        return False
 
-        return responses
+    # ─── Потоковая выдача реплик ──────────────────────────────
+
+    def add_stream_sink(self, sink: Callable[[dict], None]):
+        """Подписать sink(frame) на кадры генерации реплик (вызывается из потока тика)."""
+        self._stream_sinks.append(sink)
+
+    def remove_stream_sink(self, sink: Callable[[dict], None]):
+        try:
+            self._stream_sinks.remove(sink)
+        except ValueError:
+            pass
+
+    def _emit(self, frame: dict):
+        for sink in list(self._stream_sinks):
+            try:
+                sink(frame)
+            except Exception:
+                pass  # подписчик не должен ломать тик
+
+    def _reply_llm(self, agent: Agent, messages: list[dict], temperature: float = 0.8) -> Optional[str]:
+        """
+        LLM-запрос за репликой агента. Есть подписчики — ответ идёт по токенам:
+        start, затем token с сырыми фрагментами. Итог решают _close_reply:
+        commit с очищенным текстом или retract, если реплику отвергли.
+        """
+        if not self._stream_sinks:
+            return llm_chat(messages, temperature=temperature)
+        agent_id = agent.agent_id
+        self._close_reply(agent_id, None, "retry")  # прошлая попытка этого хода не принята
+
+        def start():
+            reply = {
+                "reply_id": next(self._reply_ids), "agent_id": agent_id,
+                "name": self._registry.get_name(agent_id), "tick": self.tick,
+            }
+            self._open_replies[agent_id] = reply
+            self._emit({"type": "start", **reply})
+
+        def on_token(token: str):
+            reply = self._open_replies.get(agent_id)
+            if reply is not None:
+                self._emit({"type": "token", "reply_id": reply["reply_id"], "text": token})
+
+        def on_restart():
+            self._close_reply(agent_id, None, "retry")
+            start()
+
+        start()
+        return llm_chat_stream(messages, on_token, temperature=temperature, on_restart=on_restart)
+
+    def _close_reply(self, agent_id: Optional[str], text: Optional[str], reason: str = ""):
+        """Закрыть реплику агента в стриме: commit с итоговым текстом или retract.
+        agent_id=None — отозвать все открытые."""
+        if agent_id is None:
+            for open_id in list(self._open_replies):
+                self._close_reply(open_id, None, reason)
+            return
+        reply = self._open_replies.pop(agent_id, None)
+        if reply is None:
+            return
+        if text:
+            self._emit({"type": "commit", **reply, "text": text})
+        else:
+            self._emit({"type": "retract", "reply_id": reply["reply_id"], "reason": reason})
 
     def _parse_user_input(self, raw_input: str) -> tuple[str, Optional[list[Agent]]]:
         raw_input = raw_input.strip()
@@ -1377,6 +1527,16 @@ class BigBrotherOrchestrator:
         speaker.last_response_phrases = new_phrases
 
     def run_tick(self) -> Optional[dict]:
+        """Один тик симуляции. Все записи агентов в ChromaDB за тик сбрасываются
+        одним батчем: по одному delete и upsert на коллекцию."""
+        with chroma_storage.write_batch(), \
+                (preemptible(self.preempt) if self.preempt is not None else nullcontext()):
+            try:
+                return self._run_tick()
+            finally:
+                self._close_reply(None, None, "rejected")  # реплика не дошла до диалога
+
+    def _run_tick(self) -> Optional[dict]:
         self.tick += 1
 
         self._process_user_events()
@@ -1396,6 +1556,8 @@ class BigBrotherOrchestrator:
             print(f"{Fore.CYAN}  {phase_label}{Style.RESET_ALL}")
 
         if self.phase_manager.is_topic_complete() and not self.active_event:
+            if self._yield_to_user():
+                return None  # тема сменится на следующем тике
             scenario_context = self.scenario_manager.get_scenario_context()
             new_topic = self.topic_manager.get_new_topic(scenario_context)
             self.phase_manager.start_new_topic(self.tick)
@@ -1441,6 +1603,8 @@ class BigBrotherOrchestrator:
                     print(f"{Fore.YELLOW}  {agent_display}: {dominant} "
                           f"(Счаст:{agent.mood.happiness:+.2f} Злость:{agent.mood.anger:.2f} Страх:{agent.mood.fear:.2f}){Style.RESET_ALL}")
 
+                if self._yield_to_user():
+                    return None  # событие уже в диалоге, последствие пропускаем
                 scenario_ctx = self.scenario_manager.get_scenario_context()
                 consequence = self._generate_event_consequence(event, scenario_ctx)
                 if consequence:
@@ -1501,23 +1665,22 @@ class BigBrotherOrchestrator:
             phase_instruction=phase_instruction,
             force_event_reaction=force_event_reaction,
         )
-        raw_response = llm_chat(messages)
+        if self._yield_to_user():
+            return None
+        raw_response = self._reply_llm(speaker, messages)
         text = None
 
         if raw_response is not None:
             text = self._clean_response(raw_response, self._registry.get_name(speaker.agent_id))
 
-        if not text:
-            retry_messages = speaker.build_messages(
-                self.conversation, mode, scenario_context,
-                active_event=self.active_event, all_agents=self.agents,
-                phase_instruction=phase_instruction,
-                force_event_reaction=force_event_reaction,
-            )
+        # Ретраи переиспользуют уже собранные messages и добавляют короткий суффикс:
+        # состояние между попытками не меняется, а общий префикс остаётся в KV-кэше бэкенда
+        if not text and not self._yield_to_user():
+            retry_messages = messages.copy()
             retry_messages.append({"role": "user", "content":
                 f"Ты — {self._registry.get_name(speaker.agent_id)}. Ответь КОРОТКО, 1-2 предложения. БЕЗ тегов. Русский текст. НЕ пиши за других."
             })
-            raw_retry = llm_chat(retry_messages, temperature=1.0)
+            raw_retry = self._reply_llm(speaker, retry_messages, temperature=1.0)
             if raw_retry:
                 text = self._clean_response(raw_retry, self._registry.get_name(speaker.agent_id))
 
@@ -1545,17 +1708,14 @@ class BigBrotherOrchestrator:
         quality_ok, quality_reason = self._check_quality(text, speaker)
         if not quality_ok:
             print(f"{Fore.RED}  BigBrother отклонил: {quality_reason}{Style.RESET_ALL}")
-            retry_msgs = speaker.build_messages(
-                self.conversation, mode, scenario_context,
-                active_event=self.active_event, all_agents=self.agents,
-                phase_instruction=phase_instruction,
-                force_event_reaction=force_event_reaction,
-            )
+            if self._yield_to_user():
+                return None
+            retry_msgs = messages.copy()
             retry_msgs.append({"role": "user", "content":
                 f"СТОП! Ответ отклонён: {quality_reason}. "
                 "Скажи что-то БЕЗОПАСНОЕ и РАЗУМНОЕ. 1-2 предложения."
             })
-            raw_retry = llm_chat(retry_msgs, temperature=0.7)
+            raw_retry = self._reply_llm(speaker, retry_msgs, temperature=0.7)
             if raw_retry:
                 text = self._clean_response(raw_retry, speaker_display)
                 for a in self.agents:
@@ -1619,12 +1779,9 @@ class BigBrotherOrchestrator:
             is_repetitive = True
 
         if is_repetitive:
-            retry_msgs = speaker.build_messages(
-                self.conversation, mode, scenario_context,
-                active_event=self.active_event, all_agents=self.agents,
-                phase_instruction=phase_instruction,
-                force_event_reaction=force_event_reaction,
-            )
+            if self._yield_to_user():
+                return None
+            retry_msgs = messages.copy()
             banned = '; '.join([t[:50] for t in own_recent[-3:]]) if own_recent else ''
             if speaker.consecutive_similar_count >= REPETITION_CONSECUTIVE_LIMIT:
                 style_change = random.choice([
@@ -1646,7 +1803,7 @@ class BigBrotherOrchestrator:
                     f"СТОП! Повтор: '{text[:50]}...' уже было. Запрещено: {banned}. "
                     "Скажи СОВЕРШЕННО ДРУГОЕ."
                 )})
-            raw_retry = llm_chat(retry_msgs, temperature=1.3)
+            raw_retry = self._reply_llm(speaker, retry_msgs, temperature=1.3)
             if raw_retry:
                 text_retry = self._clean_response(raw_retry, speaker_display)
                 for a in self.agents:
@@ -1667,6 +1824,7 @@ class BigBrotherOrchestrator:
                 return None
 
         self._check_consecutive_similarity(speaker, text)
+        self._close_reply(speaker.agent_id, text)
 
         if self.active_event and speaker.agent_id not in self.event_reacted_agents:
             self.event_reacted_agents.add(speaker.agent_id)
@@ -1828,8 +1986,66 @@ class BigBrotherOrchestrator:
         return entry
 
     def save_all_memories(self):
+        with chroma_storage.write_batch():
+            for agent in self.agents:
+                agent.save_memory()
+
+    def start_discussion(self) -> dict:
+        """Стартовая тема от ведущего: первая запись диалога, её слышат все агенты."""
+        scenario_context = self.scenario_manager.get_scenario_context()
+        start_topic = self.topic_manager.get_new_topic(scenario_context)
+        self.phase_manager.start_new_topic(0)
+
+        starter = {
+            "tick": 0, "agent_id": "system",
+            "name": "Ведущий",
+            "text": f"Привет всем! Давайте обсудим: {start_topic}",
+            "is_new_topic": True,
+        }
+        self.conversation.append(starter)
+        with chroma_storage.write_batch():
+            for agent in self.agents:
+                agent.process_message(0, "Ведущий", starter["text"], is_own=False)
+        return starter
+
+    def bind_user(self, user_id: str):
+        """
+        Привязать заранее собранный мир (см. orchestrator_pool.py) к пользователю.
+
+        Реестр и пул текстов остаются теми, с которыми мир собран, — сессия
+        забирает их себе. Вся память помечается несохранённой и при следующем
+        сохранении уходит в коллекции user_id.
+        """
+        self.user_id = user_id
+        self.topic_manager.user_id = user_id
+        self.scenario_manager.user_id = user_id
+        self.conversation.rebind(user_id)
         for agent in self.agents:
-            agent.save_memory()
+            agent.user_id = user_id
+            agent.memory_system.user_id = user_id
+            agent.memory_system.vector_layer.user_id = user_id
+            agent.memory_system.mark_unsaved()
+
+    def save_world(self):
+        """Сохранить память агентов, темы и сценарий одним батчем."""
+        with chroma_storage.write_batch():
+            self.save_all_memories()
+            self.topic_manager.save_to_db()
+            self.scenario_manager.save_to_db()
+
+    def memory_footprint(self) -> dict:
+        """Отчёт о потреблении памяти сессией (байты по агентам и слоям)."""
+        return session_footprint(self)
+
+    def snapshot(self) -> bytes:
+        """Полный снапшот мира сессии (компактный бинарный блоб, см. snapshot.py)."""
+        return snapshot_orchestrator(self)
+
+    @classmethod
+    def restore(cls, blob: bytes, user_id: Optional[str] = None, registry=None,
+                text_pool=None) -> "BigBrotherOrchestrator":
+        """Поднять сессию из снапшота без обращений к ChromaDB и LLM."""
+        return restore_orchestrator(blob, user_id=user_id, registry=registry, text_pool=text_pool)
 
     def print_entry(self, entry: dict):
         if entry.get("is_event", False):
@@ -1919,10 +2135,12 @@ class BigBrotherOrchestrator:
                 print(f"  {a.color}{a_race.emoji}{a_display}{Style.RESET_ALL} → {other_emoji}{other_display}: [{bar}] {val:+.2f} {emoji}")
 
         print(f"\n{Fore.WHITE}Активность (реплики / инициатив / реакции):")
+        # self.conversation — только хвост; считаем по всей истории, включая архив
+        history, _ = self.conversation.read(0, -1, self.conversation.total)
         for a in self.agents:
             a_display = self._registry.get_name(a.agent_id)
-            total_msgs = sum(1 for e in self.conversation if e.get('agent_id') == a.agent_id and not e.get('is_event'))
-            initiatives = sum(1 for e in self.conversation if e.get('agent_id') == a.agent_id and e.get('is_initiative'))
+            total_msgs = sum(1 for _, e in history if e.get('agent_id') == a.agent_id and not e.get('is_event'))
+            initiatives = sum(1 for _, e in history if e.get('agent_id') == a.agent_id and e.get('is_initiative'))
             reactions = total_msgs - initiatives
             print(f"  {a.color}{a_display}:{Style.RESET_ALL} {total_msgs} реплик, {initiatives} инициатив, {reactions} реакций")
 
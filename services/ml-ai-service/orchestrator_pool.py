@@ -0,0 +1,118 @@
+"""
+Пул заранее собранных миров для мгновенного создания сессий.
+
+Создание сессии — это агенты, оркестратор и LLM-запрос за стартовой темой.
+OrchestratorPool делает всё это в фоне заранее, для каждой пары
+(сценарий, расовый пресет), и держит готовые оркестраторы. Сессия забирает
+готовый мир, привязывает его к своему user_id (bind_user) и отвечает сразу.
+Пул доливается фоновым потоком до заданной глубины.
+"""
+
+import threading
+from collections import deque
+from typing import Optional
+
+from config import ORCHESTRATOR_POOL_DEPTH, ORCHESTRATOR_POOL_PREWARM
+from agent_registry import AgentRegistry
+from text_pool import TextPool
+import chroma_storage
+
+# user_id, под которым собираются миры пула; его записи в ChromaDB не попадают
+POOL_USER_ID = "__pool__"
+
+
+def _parse_prewarm(spec: str) -> list[tuple[str, str]]:
+    keys = []
+    for item in spec.split(","):
+        scenario, _, race_preset = item.strip().partition(":")
+        if scenario and race_preset:
+            keys.append((scenario, race_preset))
+    return keys
+
+
+class OrchestratorPool:
+    """Готовые оркестраторы по ключу (scenario, race_preset). Потокобезопасный."""
+
+    def __init__(self, depth: int = ORCHESTRATOR_POOL_DEPTH,
+                 prewarm: Optional[list[tuple[str, str]]] = None):
+        self.depth = depth
+        self._ready: dict[tuple[str, str], deque] = {}
+        self._wanted: set[tuple[str, str]] = set(
+            prewarm if prewarm is not None else _parse_prewarm(ORCHESTRATOR_POOL_PREWARM)
+        )
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def claim(self, scenario: str, race_preset: str):
+        """Забрать готовый оркестратор или None. Ключ ставится на (до)заполнение."""
+        if self.depth <= 0:
+            return None
+        key = (scenario, race_preset)
+        with self._lock:
+            self._wanted.add(key)
+            ready = self._ready.get(key)
+            orchestrator = ready.popleft() if ready else None
+        self._wake.set()
+        return orchestrator
+
+    def ready_count(self, scenario: str, race_preset: str) -> int:
+        with self._lock:
+            return len(self._ready.get((scenario, race_preset), ()))
+
+    def build(self, scenario: str, race_preset: str):
+        """Собрать непривязанный мир: агенты, оркестратор, стартовая тема."""
+        from orchestrator import create_agents, BigBrotherOrchestrator
+
+        registry = AgentRegistry()
+        text_pool = TextPool()
+        state = chroma_storage.empty_session_state()
+        with chroma_storage.write_batch() as batch:
+            agents = create_agents(race_preset, user_id=POOL_USER_ID, registry=registry,
+                                   text_pool=text_pool, session_state=state)
+            orchestrator = BigBrotherOrchestrator(
+                agents, scenario, user_id=POOL_USER_ID, registry=registry,
+                text_pool=text_pool, session_state=state,
+            )
+            orchestrator.start_discussion()
+            # Мир ещё ничей: сохранится при bind_user под настоящим user_id
+            batch.discard_user(POOL_USER_ID)
+        return orchestrator
+
+    def fill(self):
+        """Долить все нужные ключи до глубины пула."""
+        with self._lock:
+            keys = list(self._wanted)
+        for key in keys:
+            while not self._stop.is_set():
+                with self._lock:
+                    if len(self._ready.get(key, ())) >= self.depth:
+                        break
+                try:
+                    orchestrator = self.build(*key)
+                except Exception as e:
+                    print(f"[Pool] Не удалось собрать мир {key}: {e}")
+                    break
+                with self._lock:
+                    self._ready.setdefault(key, deque()).append(orchestrator)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.fill()
+            self._wake.wait()
+            self._wake.clear()
+
+    def start(self):
+        """Запустить фоновое заполнение пула."""
+        if self.depth <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="orchestrator-pool")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=5.0)
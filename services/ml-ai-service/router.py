@@ -0,0 +1,438 @@
+"""
+Роутер для запуска в несколько процессов (python main.py --api --workers N).
+
+Сессии живут в памяти процесса (session_manager, потоки симуляции, lock'и),
+поэтому все запросы одного пользователя должны попадать в один воркер.
+Роутер — тонкий прокси: по user_id из пути /api/v1/ml/users/{user_id}/...
+выбирает воркер rendezvous-хешированием и пересылает запрос как есть
+(включая SSE-стрим и WebSocket).
+
+Список воркеров меняется через PUT /router/workers. Сессии, у которых после
+этого сменился владелец, переносятся: export со старого воркера → import на
+новый → release на старом (копия там удаляется только после того, как новый
+воркер её принял). Живой или выгруженный мир едет снапшотом (см.
+hibernation.py), память пользователя без мира (только в ChromaDB воркера) —
+записями хранилища. Если перенос не удался или список сессий воркера получить
+не удалось, пользователь остаётся у прежнего воркера (см. _route), а не
+получает пустой мир у нового владельца.
+У каждого воркера своя ChromaDB: PersistentClient не рассчитан на запись из
+нескольких процессов. На время переноса запросы этого пользователя получают
+503 с Retry-After.
+
+Перенос и смена состава — служебные операции: PUT /router/workers и вызовы
+export/import у воркеров требуют общий секрет (X-Internal-Token, см.
+internal_auth.py). Служебные пути воркеров (/api/v1/ml/internal/...) наружу
+не пробрасываются, а заголовок с секретом из клиентских запросов вырезается.
+
+При старте роутер дожидается воркеров и делает ту же раскладку: сессии могли
+остаться у воркеров, которые ими больше не владеют (другое N в --workers,
+данные запуска без роутера), а воркеры из ML_DRAIN_WORKERS отдают все свои.
+
+Воркеры слушают только localhost, поэтому /metrics и /api/v1/ml/slo роутер
+собирает сам: опрашивает все воркеры и отдаёт их ответы вместе, с меткой
+worker у каждой метрики.
+
+Архив истории диалога (CONVERSATION_DIR) не входит в снапшот — воркеры
+должны видеть общий каталог data/conversations (один хост или общий том).
+"""
+
+import asyncio
+import hashlib
+import re
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+from fastapi import FastAPI, HTTPException, Request, WebSocket, Depends
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel
+from starlette.background import BackgroundTask
+
+from config import ROUTER_WORKERS, ROUTER_CONNECT_TIMEOUT, ROUTER_DRAIN_WORKERS, ROUTER_STARTUP_TIMEOUT
+from internal_auth import INTERNAL_TOKEN_HEADER, internal_headers, require_internal_token
+
+# Заголовки одного соединения — не пересылаются
+_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "host",
+    INTERNAL_TOKEN_HEADER.lower(),  # секрет не должен приходить от клиента
+}
+
+
+def _parse_workers(spec: str) -> list[str]:
+    return [w.strip().rstrip("/") for w in spec.split(",") if w.strip()]
+
+
+class WorkerRing:
+    """Владелец user_id — воркер с наибольшим хешем (worker, user_id).
+
+    При добавлении или удалении воркера переезжают только сессии,
+    у которых сменился победитель, — примерно 1/N от всех."""
+
+    def __init__(self, workers: list[str]):
+        self.workers = list(dict.fromkeys(workers))
+
+    @staticmethod
+    def _score(worker: str, user_id: str) -> int:
+        digest = hashlib.blake2b(f"{worker}|{user_id}".encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    def owner(self, user_id: str) -> Optional[str]:
+        if not self.workers:
+            return None
+        return max(self.workers, key=lambda w: self._score(w, user_id))
+
+
+class WorkersRequest(BaseModel):
+    workers: list[str]
+
+
+ring = WorkerRing(_parse_workers(ROUTER_WORKERS))
+_migrating: set[str] = set()
+# Пользователи, которых не удалось перенести: остаются у прежнего воркера
+_overrides: dict[str, str] = {}
+# Воркеры, чей список сессий при смене состава получить не удалось, и раскладка,
+# по которой у них лежат сессии: их пользователи остаются у них
+_unlisted: dict[str, WorkerRing] = {}
+# Перенесённые пользователи, чью копию на прежнем воркере удалить не удалось
+_unreleased: dict[str, str] = {}
+# Воркеры вне ring, которые при старте отдают сессии владельцам (см. _reconcile)
+_drain = _parse_workers(ROUTER_DRAIN_WORKERS)
+_rebalance_lock = asyncio.Lock()
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _http() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        # read=None: SSE-стрим и long-poll держат ответ открытым
+        _client = httpx.AsyncClient(timeout=httpx.Timeout(ROUTER_CONNECT_TIMEOUT, read=None))
+    return _client
+
+
+def _forward_headers(headers) -> dict:
+    return {k: v for k, v in headers.items() if k.lower() not in _HOP_HEADERS}
+
+
+def _route(user_id: str) -> Optional[str]:
+    """Воркер пользователя: несостоявшийся перенос, затем воркер без списка сессий, затем ring."""
+    worker = _overrides.get(user_id)
+    if worker is not None:
+        return worker
+    for worker, placed in _unlisted.items():
+        if placed.owner(user_id) == worker:
+            return worker
+    return ring.owner(user_id)
+
+
+def _owner_or_503(user_id: str) -> str:
+    if user_id in _migrating:
+        raise HTTPException(status_code=503, detail="Сессия переносится на другой воркер",
+                            headers={"Retry-After": "1"})
+    worker = _route(user_id)
+    if worker is None:
+        raise HTTPException(status_code=503, detail="Нет доступных воркеров")
+    return worker
+
+
+async def _wait_ready(worker: str, deadline: float) -> bool:
+    loop = asyncio.get_running_loop()
+    while loop.time() < deadline:
+        try:
+            if (await _http().get(f"{worker}/health")).status_code == 200:
+                return True
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.5)
+    print(f"[Router] Воркер {worker} не поднялся за {ROUTER_STARTUP_TIMEOUT:.0f} с")
+    return False
+
+
+async def _reconcile():
+    """Разложить по ring сессии, которые лежат не у своих воркеров (см. модуль)."""
+    deadline = asyncio.get_running_loop().time() + ROUTER_STARTUP_TIMEOUT
+    await asyncio.gather(*(_wait_ready(w, deadline) for w in ring.workers + _drain))
+    result = await rebalance(ring, drain=_drain)
+    if result["moved"] or result["failed"] or result["unlisted"]:
+        print(f"[Router] Раскладка при старте: перенесено {len(result['moved'])}, "
+              f"не удалось {len(result['failed'])}, без списка: {', '.join(result['unlisted']) or 'нет'}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    print(f"[Router] Воркеры: {', '.join(ring.workers) or 'нет'}")
+    if ring.workers:
+        # До приёма запросов: иначе пользователь получил бы пустой мир у нового владельца
+        await _reconcile()
+    yield
+    if _client is not None:
+        await _client.aclose()
+
+
+app = FastAPI(title="ML AI Service Router", lifespan=lifespan)
+
+
+@app.get("/health")
+async def health():
+    """Состояние роутера и каждого воркера."""
+    async def probe(worker: str) -> dict:
+        try:
+            resp = await _http().get(f"{worker}/health", timeout=ROUTER_CONNECT_TIMEOUT)
+            return {"url": worker, "status": "ok" if resp.status_code == 200 else f"http {resp.status_code}"}
+        except httpx.HTTPError as e:
+            return {"url": worker, "status": f"unreachable: {type(e).__name__}"}
+
+    workers = await asyncio.gather(*(probe(w) for w in ring.workers))
+    ok = bool(workers) and all(w["status"] == "ok" for w in workers)
+    return {"status": "ok" if ok else "degraded", "workers": workers}
+
+
+# ─── Метрики воркеров ──────────────────────────────────────
+
+_METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+_SAMPLE_RE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)$")
+
+
+def _serving_workers() -> list[str]:
+    """Все воркеры, у которых могут быть сессии: ring, drain и оставшиеся после переносов."""
+    return list(dict.fromkeys(ring.workers + _drain + list(_unlisted) + list(_overrides.values())))
+
+
+async def _gather_workers(path: str) -> dict[str, Optional[httpx.Response]]:
+    """GET path у каждого воркера параллельно; None — воркер не ответил."""
+    async def fetch(worker: str) -> Optional[httpx.Response]:
+        try:
+            resp = await _http().get(f"{worker}{path}", timeout=ROUTER_CONNECT_TIMEOUT)
+            resp.raise_for_status()
+            return resp
+        except httpx.HTTPError:
+            return None
+
+    workers = _serving_workers()
+    return dict(zip(workers, await asyncio.gather(*(fetch(w) for w in workers))))
+
+
+def _merge_metrics(bodies: dict[str, Optional[str]]) -> str:
+    """Метрики воркеров одним телом: у каждой записи метка worker,
+    HELP и TYPE — по одному разу на семейство."""
+    headers: dict[str, list[str]] = {}
+    samples: dict[str, list[str]] = {}
+    up = []
+    for worker, body in bodies.items():
+        up.append(f'ml_worker_up{{worker="{worker}"}} {0 if body is None else 1}')
+        family = None
+        for line in (body or "").splitlines():
+            if line.startswith("# "):
+                parts = line.split(" ", 3)
+                if len(parts) >= 3 and parts[1] in ("HELP", "TYPE"):
+                    family = parts[2]
+                    header = headers.setdefault(family, [])
+                    if not any(h.startswith(f"# {parts[1]} ") for h in header):
+                        header.append(line)
+                continue
+            match = _SAMPLE_RE.match(line)
+            if match is None or family is None:
+                continue
+            name, labels, value = match.groups()
+            labels = f'worker="{worker}"' + (f",{labels}" if labels else "")
+            samples.setdefault(family, []).append(f"{name}{{{labels}}} {value}")
+
+    lines = ["# HELP ml_worker_up Ответил ли воркер на опрос метрик.", "# TYPE ml_worker_up gauge", *up]
+    for family, header in headers.items():
+        lines += header + samples.get(family, [])
+    return "\n".join(lines) + "\n"
+
+
+@app.get("/metrics")
+async def metrics():
+    """Метрики всех воркеров в формате Prometheus (метка worker)."""
+    responses = await _gather_workers("/metrics")
+    body = _merge_metrics({w: r.text if r is not None else None for w, r in responses.items()})
+    return Response(content=body, media_type=_METRICS_CONTENT_TYPE)
+
+
+@app.get("/api/v1/ml/slo")
+async def slo_report():
+    """Отчёты SLO воркеров. Перцентили разных воркеров не складываются — отдаются рядом."""
+    responses = await _gather_workers("/api/v1/ml/slo")
+    return {"workers": {w: r.json() if r is not None else {"error": "unreachable"}
+                        for w, r in responses.items()}}
+
+
+@app.get("/router/workers", dependencies=[Depends(require_internal_token)])
+async def get_workers():
+    return {"workers": ring.workers, "migrating": sorted(_migrating),
+            "overrides": _overrides, "unlisted": sorted(_unlisted)}
+
+
+@app.put("/router/workers", dependencies=[Depends(require_internal_token)])
+async def set_workers(request: WorkersRequest):
+    """Сменить состав воркеров и перенести сессии, у которых сменился владелец."""
+    new = WorkerRing([w.rstrip("/") for w in request.workers])
+    if not new.workers:
+        raise HTTPException(status_code=400, detail="Нужен хотя бы один воркер")
+    return await rebalance(new)
+
+
+async def _list_sessions(worker: str) -> Optional[list[str]]:
+    """user_id сессий воркера; None — воркер не ответил."""
+    try:
+        resp = await _http().get(f"{worker}/api/v1/ml/internal/sessions", headers=internal_headers())
+        resp.raise_for_status()
+    except httpx.HTTPError as e:
+        print(f"[Router] Воркер {worker} недоступен, его сессии не переносятся: {e}")
+        return None
+    return resp.json()["user_ids"]
+
+
+async def rebalance(new: WorkerRing, drain: list[str] = ()) -> dict:
+    """Перейти на состав new: опросить воркеры, где могут лежать сессии
+    (и воркеры drain вне ring), и перенести каждую к её владельцу в new."""
+    global ring
+    async with _rebalance_lock:
+        for user_id, source in list(_unreleased.items()):
+            await _release(user_id, source)
+
+        # Где лежит каждый пользователь. Копий может быть несколько (перенос
+        # прервался) — тогда верна та, куда он сейчас направляется
+        sources = dict.fromkeys(ring.workers + new.workers + list(drain) + list(_unlisted)
+                                + list(_overrides.values()))
+        found: dict[str, list[str]] = {}
+        unlisted = {}
+        for worker in sources:
+            user_ids = await _list_sessions(worker)
+            if user_ids is None:
+                unlisted[worker] = _unlisted.get(worker, ring)
+                continue
+            for user_id in user_ids:
+                found.setdefault(user_id, []).append(worker)
+
+        for user_id, worker in list(_overrides.items()):
+            if worker not in unlisted and user_id not in found:
+                del _overrides[user_id]  # сессии больше нет — пользователь снова по ring
+
+        moves = []
+        for user_id, workers in found.items():
+            current = _route(user_id)
+            source = workers[0] if len(workers) == 1 else current if current in workers else None
+            if source is None:
+                print(f"[Router] {user_id[:8]} есть на {', '.join(workers)} — не ясно, какая копия верна")
+                continue
+            target = new.owner(user_id)
+            if target == source:
+                _overrides.pop(user_id, None)
+            else:
+                moves.append((user_id, source, target))
+
+        _unlisted.clear()
+        _unlisted.update(unlisted)
+        _migrating.update(user_id for user_id, _, _ in moves)
+        ring = new
+        moved, failed = [], []
+        for user_id, source, target in moves:
+            try:
+                await _migrate(user_id, source, target)
+                _overrides.pop(user_id, None)
+                moved.append(user_id)
+            except Exception as e:
+                print(f"[Router] Не удалось перенести {user_id[:8]} {source} → {target}: {e}")
+                _overrides[user_id] = source  # копия у прежнего воркера цела — он и обслуживает
+                failed.append(user_id)
+            finally:
+                _migrating.discard(user_id)
+
+    return {"workers": ring.workers, "moved": moved, "failed": failed, "unlisted": sorted(unlisted)}
+
+
+async def _migrate(user_id: str, source: str, target: str):
+    """Скопировать сессию на target; копию на source удалить, только когда target её принял."""
+    base = f"/api/v1/ml/internal/sessions/{user_id}"
+    resp = await _http().post(f"{source}{base}/export", headers=internal_headers())
+    if resp.status_code == 404:
+        return  # сессию успели удалить
+    resp.raise_for_status()
+    # Формат (снапшот или записи хранилища) выбирает источник — import разбирает по нему
+    headers = {**internal_headers(),
+               "Content-Type": resp.headers.get("content-type", "application/octet-stream")}
+    imported = await _http().post(f"{target}{base}/import", content=resp.content, headers=headers)
+    imported.raise_for_status()
+    await _release(user_id, source)
+
+
+async def _release(user_id: str, source: str):
+    """Удалить копию перенесённой сессии на прежнем воркере; не вышло — повторить при следующей смене состава."""
+    try:
+        resp = await _http().post(f"{source}/api/v1/ml/internal/sessions/{user_id}/release",
+                                  headers=internal_headers())
+        if resp.status_code == 409:
+            print(f"[Router] {user_id[:8]} снова активен на {source}, копия там оставлена")
+        else:
+            resp.raise_for_status()
+        _unreleased.pop(user_id, None)
+    except httpx.HTTPError as e:
+        print(f"[Router] Копия {user_id[:8]} на {source} не удалена: {e}")
+        _unreleased[user_id] = source
+
+
+@app.api_route("/api/v1/ml/internal/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+async def refuse_internal(path: str):
+    """Служебные эндпоинты воркеров через роутер недоступны."""
+    raise HTTPException(status_code=404, detail="Not Found")
+
+
+@app.api_route("/api/v1/ml/users/{user_id}/{path:path}",
+               methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+async def forward(user_id: str, path: str, request: Request):
+    """Переслать запрос пользователя его воркеру; ответ отдаётся потоком."""
+    worker = _owner_or_503(user_id)
+    upstream = _http().build_request(
+        request.method, f"{worker}{request.url.path}",
+        params=request.query_params, headers=_forward_headers(request.headers),
+        content=await request.body(),
+    )
+    try:
+        resp = await _http().send(upstream, stream=True)
+    except httpx.HTTPError as e:
+        return JSONResponse(status_code=502, content={"detail": f"Воркер {worker} недоступен: {e}"})
+    return StreamingResponse(
+        resp.aiter_raw(), status_code=resp.status_code,
+        headers=_forward_headers(resp.headers), background=BackgroundTask(resp.aclose),
+    )
+
+
+@app.websocket("/api/v1/ml/users/{user_id}/ws")
+async def forward_socket(websocket: WebSocket, user_id: str):
+    """WebSocket до воркера: кадры пересылаются в обе стороны."""
+    from websockets.asyncio.client import connect
+
+    worker = _route(user_id)
+    if worker is None or user_id in _migrating:
+        await websocket.close(code=1013)  # попробовать позже
+        return
+    url = "ws" + worker[len("http"):] + websocket.url.path
+    try:
+        upstream = await connect(url)
+    except Exception:
+        await websocket.close(code=1011)
+        return
+    await websocket.accept()
+
+    async def to_client():
+        async for message in upstream:
+            await websocket.send_text(message)
+
+    async def to_worker():
+        while True:
+            await upstream.send(await websocket.receive_text())
+
+    tasks = [asyncio.create_task(to_client()), asyncio.create_task(to_worker())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await upstream.close()
+        try:
+            await websocket.close()
+        except Exception:
+            pass  # клиент уже закрыл соединение
@@ -38,11 +38,12 @@ class ScenarioManager:
         for key, data in SCENARIOS_DATA.items()
     }
 
-    def __init__(self, scenario_name: str = "desert_island", user_id: str = ""):
+    def __init__(self, scenario_name: str = "desert_island", user_id: str = "", load: bool = True):
         self.current_scenario = self.SCENARIOS.get(scenario_name, self.SCENARIOS["desert_island"])
         self.events_triggered: list[str] = []
         self.user_id = user_id
-        self.load_from_db()
+        if load:
+            self.load_from_db()
 
     def get_scenario_context(self) -> str:
         context = f"\nСЦЕНАРИЙ: {self.current_scenario.name}\n"
@@ -69,9 +70,10 @@ class ScenarioManager:
             user_id=self.user_id,
         )
 
-    def load_from_db(self):
+    def load_from_db(self, data: Optional[dict] = None):
         try:
-            data = chroma_storage.load_scenario_state(user_id=self.user_id)
+            if data is None:
+                data = chroma_storage.load_scenario_state(user_id=self.user_id)
             self.events_triggered = data.get("events_triggered", [])
         except Exception as e:
             print(f"{Fore.YELLOW}Не удалось загрузить сценарий: {e}{Style.RESET_ALL}")
@@ -6,6 +6,7 @@
 Пользователь НЕ может взаимодействовать с агентами чужой сессии.
 """
 
+import time
 import uuid
 import threading
 from typing import Optional
@@ -13,6 +14,7 @@ from dataclasses import dataclass, field
 from datetime import datetime
 
 from agent_registry import AgentRegistry
+from text_pool import TextPool
 
 
 @dataclass
@@ -21,8 +23,10 @@ class UserSession:
     user_id: str
     created_at: str = field(default_factory=lambda: datetime.now().isoformat())
     agent_registry: AgentRegistry = field(default_factory=AgentRegistry)
+    text_pool: TextPool = field(default_factory=TextPool)  # общие тексты агентов сессии
     orchestrator: Optional[object] = None  # BigBrotherOrchestrator (ленивая инициализация)
     is_active: bool = True
+    last_access: float = field(default_factory=time.monotonic)  # для выгрузки холодных сессий
 
     def __post_init__(self):
         # Валидация user_id — только буквы, цифры, дефисы, подчёркивания
@@ -104,6 +108,34 @@ class SessionManager:
                     pass
             return True
 
+    def touch(self, user_id: str):
+        """Отметить обращение к сессии (сбрасывает таймер простоя)."""
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is not None:
+                session.last_access = time.monotonic()
+
+    def detach_session(self, user_id: str) -> Optional[UserSession]:
+        """Убрать сессию из памяти без сохранения (для гибернации)."""
+        with self._lock:
+            return self._sessions.pop(user_id, None)
+
+    def attach_session(self, session: UserSession) -> UserSession:
+        """Вернуть сессию в память. Если за это время создали новую — остаётся она;
+        если у новой ещё нет мира, ей достаётся мир возвращаемой."""
+        with self._lock:
+            current = self._sessions.setdefault(session.user_id, session)
+            if current is not session and current.orchestrator is None:
+                current.agent_registry = session.agent_registry
+                current.text_pool = session.text_pool
+                current.orchestrator = session.orchestrator
+            return current
+
+    def resident_sessions(self) -> list[UserSession]:
+        """Сессии в памяти, от самой давней по обращению к самой свежей."""
+        with self._lock:
+            return sorted(self._sessions.values(), key=lambda s: s.last_access)
+
     def validate_access(self, user_id: str, target_agent_id: str) -> bool:
         """
         Проверить, имеет ли пользователь доступ к агенту.
@@ -131,6 +163,7 @@ class SessionManager:
                 result.append({
                     "user_id": uid,
                     "created_at": session.created_at,
+                    "idle_seconds": round(time.monotonic() - session.last_access, 1),
                     "is_active": session.is_active,
                     "agents_count": len(session.agent_registry.get_all_ids()),
                     "agent_names": session.agent_registry.get_all_names(),
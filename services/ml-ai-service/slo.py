@@ -0,0 +1,86 @@
+"""
+Учёт задержек ответа пользователю (SLO).
+
+LatencyTracker хранит последние N замеров и считает перцентили и долю
+запросов, уложившихся в цель. Замеры API:
+  user_reply  — от приёма сообщения до готовности всех ответов агентов;
+  first_reply — от приёма сообщения до первого принятого ответа;
+  lock_wait   — сколько сообщение ждало, пока фоновый тик отпустит сессию.
+Отчёт — GET /api/v1/ml/slo.
+"""
+
+import threading
+from collections import deque
+
+from config import USER_REPLY_SLO_SECONDS, SLO_WINDOW
+
+
+class LatencyTracker:
+    """Скользящее окно замеров (секунды). Потокобезопасный."""
+
+    def __init__(self, window: int = SLO_WINDOW):
+        self._samples: deque = deque(maxlen=window)
+        self._count = 0
+        self._total = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+            self._count += 1
+            self._total += seconds
+
+    def snapshot(self) -> tuple[int, float, list[float]]:
+        """(всего замеров, их сумма, отсортированное окно) — для /metrics."""
+        with self._lock:
+            samples = list(self._samples)
+            count, total = self._count, self._total
+        samples.sort()
+        return count, total, samples
+
+    def summary(self, target: float) -> dict:
+        count, _, samples = self.snapshot()
+        if not samples:
+            return {"count": count, "window": 0}
+
+        def pct(q: float) -> float:
+            return round(samples[min(len(samples) - 1, int(len(samples) * q))], 3)
+
+        within = sum(1 for s in samples if s <= target)
+        return {
+            "count": count,
+            "window": len(samples),
+            "p50": pct(0.50),
+            "p95": pct(0.95),
+            "p99": pct(0.99),
+            "max": round(samples[-1], 3),
+            "within_target": round(within / len(samples), 4),
+        }
+
+
+class SloTracker:
+    """Именованные окна задержек и цель SLO для ответов пользователю."""
+
+    def __init__(self, target: float = USER_REPLY_SLO_SECONDS):
+        self.target = target
+        self._trackers: dict[str, LatencyTracker] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            tracker = self._trackers.setdefault(name, LatencyTracker())
+        tracker.record(seconds)
+
+    def trackers(self) -> dict[str, LatencyTracker]:
+        with self._lock:
+            return dict(sorted(self._trackers.items()))
+
+    def report(self) -> dict:
+        return {
+            "target_seconds": self.target,
+            "latencies": {name: t.summary(self.target) for name, t in self.trackers().items()},
+        }
+
+
+# Глобальный экземпляр
+slo_tracker = SloTracker()
@@ -0,0 +1,361 @@
+"""
+Снапшот сессии: весь мир оркестратора в одном компактном бинарном блобе.
+
+В ChromaDB сохраняются только память агентов и состояние тем/сценария.
+Диалог, настроения, отношения, планы, болтливость и тик живут только в памяти.
+Снапшот сохраняет всё это, а restore поднимает сессию за миллисекунды, без
+запросов к ChromaDB и без повторного прогона LLM. Используется для гибернации
+сессий, переноса между воркерами и переживания рестартов.
+
+Формат:
+  MAGIC (4 байта) | версия (uint16) | флаги (uint16) | zlib(JSON)
+JSON компактный, повторяющиеся строки (тексты реплик в памяти каждого агента,
+имена) вынесены в таблицу строк и записаны индексами.
+"""
+
+import json
+import struct
+import zlib
+from dataclasses import asdict
+from typing import Optional
+
+from models import PersonalityType, BigFiveTraits, RaceType, AgentMood
+from memory import MemoryItem
+from vector_memory import VectorDocument
+from topics import Goal, ActionPlan
+from scenarios import ScenarioManager
+from conversation_log import ConversationLog
+
+
+MAGIC = b"BBSN"
+SNAPSHOT_VERSION = 1
+_HEADER = struct.Struct(">4sHH")
+_FLAG_ZLIB = 0x1
+
+
+class SnapshotError(ValueError):
+    """Блоб не является снапшотом или его версия не поддерживается."""
+
+
+class _StringTable:
+    """Таблица строк: одинаковые строки сериализуются один раз."""
+
+    def __init__(self, strings: Optional[list[str]] = None):
+        self.strings: list[str] = strings if strings is not None else []
+        self._index: dict[str, int] = {}
+
+    def ref(self, s: str) -> int:
+        idx = self._index.get(s)
+        if idx is None:
+            idx = self._index[s] = len(self.strings)
+            self.strings.append(s)
+        return idx
+
+    def get(self, idx: int) -> str:
+        return self.strings[idx]
+
+
+# ─── Записи памяти (позиционные массивы) ──────────────────────
+
+def _pack_memory(m: MemoryItem, st: _StringTable) -> list:
+    return [
+        m.tick, st.ref(m.speaker), st.ref(m.text), m.timestamp, m.importance,
+        st.ref(m.speaker_id), st.ref(m.addressed_to), st.ref(m.addressed_to_id),
+        int(m.is_event) | (int(m.is_action_result) << 1) | (int(m.dirty) << 2),
+        m.memory_id,
+    ]
+
+
+def _unpack_memory(row: list, st: _StringTable) -> MemoryItem:
+    tick, speaker, text, timestamp, importance, speaker_id, addressed_to, addressed_to_id, flags, memory_id = row
+    return MemoryItem(
+        tick=tick, speaker=st.get(speaker), text=st.get(text), timestamp=timestamp,
+        importance=importance, speaker_id=st.get(speaker_id),
+        addressed_to=st.get(addressed_to), addressed_to_id=st.get(addressed_to_id),
+        is_event=bool(flags & 1), is_action_result=bool(flags & 2),
+        memory_id=memory_id, dirty=bool(flags & 4),
+    )
+
+
+def _pack_vector(d: VectorDocument, st: _StringTable) -> list:
+    return [
+        st.ref(d.text), d.tick, d.importance, int(d.is_event) | (int(d.dirty) << 2),
+        st.ref(d.speaker), st.ref(d.speaker_id), d.doc_id,
+    ]
+
+
+def _unpack_vector(row: list, st: _StringTable) -> VectorDocument:
+    text, tick, importance, flags, speaker, speaker_id, doc_id = row
+    return VectorDocument(
+        text=st.get(text), tick=tick, importance=importance, is_event=bool(flags & 1),
+        speaker=st.get(speaker), speaker_id=st.get(speaker_id),
+        doc_id=doc_id, dirty=bool(flags & 4),
+    )
+
+
+# ─── Агенты ──────────────────────────────────────────────────
+
+def _pack_memory_system(mem, st: _StringTable) -> dict:
+    vector = mem.vector_layer
+    return {
+        "short_term": [_pack_memory(m, st) for m in mem.short_term],
+        "long_term": [_pack_memory(m, st) for m in mem.long_term],
+        "completed_actions": mem.completed_actions,
+        "pending_questions": mem.pending_questions,
+        "group_decisions": mem.group_decisions,
+        "persisted_layers": mem._persisted_layers,
+        "persisted_actions": mem._persisted_actions,
+        "persisted_decisions": mem._persisted_decisions,
+        "actions_dirty": mem._actions_dirty,
+        "decisions_dirty": mem._decisions_dirty,
+        "legacy_ids": mem._legacy_ids,
+        "vector": [_pack_vector(d, st) for d in vector.documents],
+        "vector_persisted": sorted(vector._persisted_ids),
+        "vector_legacy_ids": vector._legacy_ids,
+    }
+
+
+def _restore_memory_system(mem, data: dict, st: _StringTable):
+    mem.short_term = [_unpack_memory(r, st) for r in data["short_term"]]
+    mem.long_term = [_unpack_memory(r, st) for r in data["long_term"]]
+    mem.completed_actions = list(data["completed_actions"])
+    mem.pending_questions = list(data["pending_questions"])
+    mem.group_decisions = list(data["group_decisions"])
+    mem._persisted_layers = dict(data["persisted_layers"])
+    mem._persisted_actions = data["persisted_actions"]
+    mem._persisted_decisions = data["persisted_decisions"]
+    mem._actions_dirty = data["actions_dirty"]
+    mem._decisions_dirty = data["decisions_dirty"]
+    mem._legacy_ids = list(data["legacy_ids"])
+    mem._touch()
+
+    vector = mem.vector_layer
+    vector.documents = [_unpack_vector(r, st) for r in data["vector"]]
+    vector._persisted_ids = set(data["vector_persisted"])
+    vector._legacy_ids = list(data["vector_legacy_ids"])
+    vector._dirty = bool(vector.documents)  # индекс пересчитается при первом поиске
+
+
+def _pack_agent(agent, st: _StringTable) -> dict:
+    return {
+        "agent_id": agent.agent_id,
+        "name": agent.name,
+        "personality_type": agent.personality_type.value,
+        "big_five": asdict(agent.big_five),
+        "race_type": agent.race_type.value,
+        "is_male": agent.is_male,
+        "age": agent.age,
+        "interests": agent.interests,
+        "additional_info": agent.additional_info,
+        "color": agent.color,
+        "talkativeness": agent.talkativeness,
+        "base_talkativeness": agent.base_talkativeness,
+        "recovery_rate": agent.recovery_rate,
+        "depletion_rate": agent.depletion_rate,
+        "ticks_silent": agent.ticks_silent,
+        "messages_spoken": agent.messages_spoken,
+        "relationships": agent.relationships,
+        "relationship_log": agent.relationship_log,
+        "goals": [asdict(g) if isinstance(g, Goal) else g for g in agent.goals],
+        "current_plan": asdict(agent.current_plan) if agent.current_plan else None,
+        "observations": agent.observations,
+        "last_event": agent.last_event,
+        "event_focus_tick": agent.event_focus_tick,
+        "active_event": agent.active_event,
+        "consecutive_similar_count": agent.consecutive_similar_count,
+        "last_response_phrases": sorted(agent.last_response_phrases),
+        "reacted_to_event": agent.reacted_to_event,
+        "mood": asdict(agent.mood),
+        "memory": _pack_memory_system(agent.memory_system, st),
+    }
+
+
+def _restore_agent(data: dict, st: _StringTable, user_id: str, registry, text_pool):
+    from agent import Agent
+
+    agent = Agent(
+        agent_id=data["agent_id"],
+        name=data["name"],
+        personality_type=PersonalityType(data["personality_type"]),
+        big_five=BigFiveTraits(**data["big_five"]),
+        race_type=RaceType(data["race_type"]),
+        is_male=data["is_male"],
+        age=data["age"],
+        interests=data["interests"],
+        additional_info=data["additional_info"],
+        color=data["color"],
+        user_id=user_id,
+        _registry=registry,
+        _text_pool=text_pool,
+        _load_memory=False,
+    )
+    # __post_init__ применил расовые модификаторы и случайную болтливость —
+    # перезаписываем всё сохранённым состоянием
+    agent.big_five = BigFiveTraits(**data["big_five"])
+    for key in ("talkativeness", "base_talkativeness", "recovery_rate", "depletion_rate",
+                "ticks_silent", "messages_spoken", "last_event", "event_focus_tick",
+                "active_event", "consecutive_similar_count", "reacted_to_event"):
+        setattr(agent, key, data[key])
+    agent.relationships = dict(data["relationships"])
+    agent.relationship_log = list(data["relationship_log"])
+    agent.goals = [Goal(**g) if isinstance(g, dict) else g for g in data["goals"]]
+    agent.current_plan = ActionPlan(**data["current_plan"]) if data["current_plan"] else None
+    agent.observations = list(data["observations"])
+    agent.last_response_phrases = set(data["last_response_phrases"])
+    agent.mood = AgentMood(**data["mood"])
+    _restore_memory_system(agent.memory_system, data["memory"], st)
+    return agent
+
+
+# ─── Оркестратор ─────────────────────────────────────────────
+
+def _scenario_key(scenario_manager) -> str:
+    for key, scenario in ScenarioManager.SCENARIOS.items():
+        if scenario is scenario_manager.current_scenario:
+            return key
+    return "desert_island"
+
+
+def _pack_conversation(conversation: list[dict], st: _StringTable) -> list:
+    packed = []
+    for entry in conversation:
+        row = dict(entry)
+        if isinstance(row.get("text"), str):
+            row["text"] = st.ref(row["text"])
+        packed.append(row)
+    return packed
+
+
+def _unpack_conversation(rows: list, st: _StringTable) -> list[dict]:
+    conversation = []
+    for row in rows:
+        entry = dict(row)
+        if isinstance(entry.get("text"), int):
+            entry["text"] = st.get(entry["text"])
+        conversation.append(entry)
+    return conversation
+
+
+def capture_state(orchestrator) -> dict:
+    """Состояние мира оркестратора в виде JSON-совместимого dict."""
+    st = _StringTable()
+    topic = orchestrator.topic_manager
+    phase = orchestrator.phase_manager
+    state = {
+        "user_id": orchestrator.user_id,
+        "tick": orchestrator.tick,
+        "tick_delay": orchestrator.tick_delay,
+        "active_event": orchestrator.active_event,
+        "event_started_tick": orchestrator.event_started_tick,
+        "quality_warnings": orchestrator.quality_warnings,
+        "last_warning_reason": orchestrator.last_warning_reason,
+        "last_speaker_id": orchestrator.last_speaker_id,
+        "event_reacted_agents": sorted(orchestrator.event_reacted_agents),
+        "last_visible_tick": orchestrator.last_visible_tick,
+        "next_agent_index": orchestrator._next_agent_index,
+        "registry": orchestrator._registry.export_state(),
+        "agents": [_pack_agent(a, st) for a in orchestrator.agents],
+        # Только резидентный хвост; архив остаётся в сегментах на диске
+        "conversation": _pack_conversation(orchestrator.conversation, st),
+        "conversation_spilled": getattr(orchestrator.conversation, "spilled", 0),
+        "conversation_epoch": getattr(orchestrator.conversation, "epoch", None),
+        "topic": {
+            "current_topic": topic.current_topic,
+            "messages_on_topic": topic.messages_on_topic,
+            "discussed_topics": topic.discussed_topics,
+            "topic_has_responses": topic.topic_has_responses,
+            "topic_respondents": sorted(topic.topic_respondents),
+        },
+        "scenario": {
+            "key": _scenario_key(orchestrator.scenario_manager),
+            "events_triggered": orchestrator.scenario_manager.events_triggered,
+        },
+        "phase": {
+            "current_phase_index": phase.current_phase_index,
+            "ticks_in_phase": phase.ticks_in_phase,
+            "topic_started_tick": phase.topic_started_tick,
+            "topic_decisions": phase.topic_decisions,
+            "topic_actions": phase.topic_actions,
+        },
+    }
+    state["strings"] = st.strings
+    return state
+
+
+def rebuild_from_state(state: dict, user_id: Optional[str] = None, registry=None, text_pool=None):
+    """Собрать оркестратор из dict состояния без обращений к ChromaDB."""
+    from orchestrator import BigBrotherOrchestrator
+    from agent_registry import AgentRegistry
+
+    user_id = state["user_id"] if user_id is None else user_id
+    registry = registry if registry is not None else AgentRegistry()
+    registry.load_state(state["registry"])
+    st = _StringTable(list(state["strings"]))
+    if text_pool is not None:
+        st.strings = [text_pool.share(s) for s in st.strings]
+
+    agents = [_restore_agent(a, st, user_id, registry, text_pool) for a in state["agents"]]
+    orch = BigBrotherOrchestrator(
+        agents, state["scenario"]["key"], user_id=user_id, registry=registry,
+        text_pool=text_pool, load_state=False,
+    )
+    orch.tick = state["tick"]
+    orch.tick_delay = state["tick_delay"]
+    orch.active_event = state["active_event"]
+    orch.event_started_tick = state["event_started_tick"]
+    orch.quality_warnings = state["quality_warnings"]
+    orch.last_warning_reason = state["last_warning_reason"]
+    orch.last_speaker_id = state["last_speaker_id"]
+    orch.event_reacted_agents = set(state["event_reacted_agents"])
+    orch.last_visible_tick = state["last_visible_tick"]
+    orch._next_agent_index = state["next_agent_index"]
+    orch.conversation = ConversationLog(
+        user_id, _unpack_conversation(state["conversation"], st),
+        spilled=state.get("conversation_spilled", 0),
+        epoch=state.get("conversation_epoch"),
+    )
+
+    topic = orch.topic_manager
+    topic.current_topic = state["topic"]["current_topic"]
+    topic.messages_on_topic = state["topic"]["messages_on_topic"]
+    topic.discussed_topics = list(state["topic"]["discussed_topics"])
+    topic.topic_has_responses = state["topic"]["topic_has_responses"]
+    topic.topic_respondents = set(state["topic"]["topic_respondents"])
+
+    orch.scenario_manager.events_triggered = list(state["scenario"]["events_triggered"])
+
+    phase = orch.phase_manager
+    for key, value in state["phase"].items():
+        setattr(phase, key, list(value) if isinstance(value, list) else value)
+    return orch
+
+
+# ─── Бинарная обёртка ────────────────────────────────────────
+
+def encode(state: dict, level: int = 6) -> bytes:
+    """dict состояния → бинарный блоб (заголовок + zlib(JSON))."""
+    payload = json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return _HEADER.pack(MAGIC, SNAPSHOT_VERSION, _FLAG_ZLIB) + zlib.compress(payload, level)
+
+
+def decode(blob: bytes) -> dict:
+    """Бинарный блоб → dict состояния. SnapshotError, если формат не тот."""
+    if len(blob) < _HEADER.size:
+        raise SnapshotError("Снапшот слишком короткий")
+    magic, version, flags = _HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise SnapshotError("Неизвестный формат снапшота")
+    if version != SNAPSHOT_VERSION:
+        raise SnapshotError(f"Неподдерживаемая версия снапшота: {version}")
+    payload = blob[_HEADER.size:]
+    if flags & _FLAG_ZLIB:
+        payload = zlib.decompress(payload)
+    return json.loads(payload)
+
+
+def snapshot_orchestrator(orchestrator) -> bytes:
+    return encode(capture_state(orchestrator))
+
+
+def restore_orchestrator(blob: bytes, user_id: Optional[str] = None, registry=None, text_pool=None):
+    return rebuild_from_state(decode(blob), user_id=user_id, registry=registry, text_pool=text_pool)
@@ -0,0 +1,47 @@
+"""
+Общее хранилище текстов сессии.
+
+Одна и та же реплика попадает в память каждого агента, в его векторный слой
+и в историю диалога. После загрузки из ChromaDB это отдельные копии строки.
+TextPool возвращает каноническую строку, и одинаковые тексты хранятся один раз.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class TextPool:
+    """Дедупликация строк в пределах сессии. Потокобезопасный, ограниченный по размеру."""
+
+    def __init__(self, max_entries: int = 4096):
+        self._texts: OrderedDict[str, str] = OrderedDict()
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def share(self, text: str) -> str:
+        """Вернуть каноническую копию строки (ту же, что уже лежит в пуле)."""
+        if not text:
+            return text
+        with self._lock:
+            canonical = self._texts.get(text)
+            if canonical is not None:
+                self._texts.move_to_end(text)
+                return canonical
+            self._texts[text] = text
+            # Вытесненные строки остаются живы у владельцев — просто больше не дедуплицируются
+            if len(self._texts) > self._max_entries:
+                self._texts.popitem(last=False)
+            return text
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._texts)
+
+    def texts(self) -> list[str]:
+        """Снимок строк пула (для отчёта о памяти)."""
+        with self._lock:
+            return list(self._texts.values())
+
+
+# Глобальный пул — fallback, если сессия не передала свой
+text_pool = TextPool()
@@ -18,14 +18,15 @@ import chroma_storage
 
 
 class TopicManager:
-    def __init__(self, user_id: str = ""):
+    def __init__(self, user_id: str = "", load: bool = True):
         self.current_topic: Optional[str] = None
         self.messages_on_topic: int = 0
         self.discussed_topics: list[str] = []
         self.topic_has_responses: int = 0
         self.topic_respondents: set = set()
         self.user_id = user_id
-        self.load_from_db()
+        if load:
+            self.load_from_db()
 
     def generate_new_topic_llm(self, scenario_context: str = "") -> str:
         discussed_context = ""
@@ -139,9 +140,10 @@ class TopicManager:
             user_id=self.user_id,
         )
 
-    def load_from_db(self):
+    def load_from_db(self, data: Optional[dict] = None):
         try:
-            data = chroma_storage.load_topic_state(user_id=self.user_id)
+            if data is None:
+                data = chroma_storage.load_topic_state(user_id=self.user_id)
             self.current_topic = data.get("current_topic")
             self.messages_on_topic = data.get("messages_on_topic", 0)
             self.discussed_topics = data.get("discussed_topics", [])
@@ -7,11 +7,14 @@
 
 import math
 import re
+import sys
+import uuid
 from collections import Counter
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, field
 from typing import Optional
 
 from config import VECTOR_MEMORY_TOP_K
+from text_pool import TextPool, text_pool as global_text_pool
 import chroma_storage
 
 
@@ -50,7 +53,7 @@ def _cosine_similarity(vec_a: dict[str, float], vec_b: dict[str, float]) -> floa
     return dot / (norm_a * norm_b)
 
 
-@dataclass
+@dataclass(slots=True)
 class VectorDocument:
     """Один документ в векторной БД."""
     text: str
@@ -59,6 +62,14 @@ class VectorDocument:
     is_event: bool
     speaker: str
     speaker_id: str
+    doc_id: str = ""  # стабильный ID записи в ChromaDB
+    dirty: bool = field(default=True, compare=False, repr=False)  # нужно пересохранить
+
+    def __post_init__(self):
+        if not self.doc_id:
+            self.doc_id = uuid.uuid4().hex[:16]
+        self.speaker = sys.intern(self.speaker)
+        self.speaker_id = sys.intern(self.speaker_id)
 
 
 class VectorMemoryLayer:
@@ -76,14 +87,19 @@ class VectorMemoryLayer:
 
     MAX_DOCUMENTS = 200
 
-    def __init__(self, agent_id: str, user_id: str = ""):
+    def __init__(self, agent_id: str, user_id: str = "", text_pool: Optional[TextPool] = None,
+                 load: bool = True):
         self.agent_id = agent_id
         self.user_id = user_id
+        self._text_pool = text_pool if text_pool is not None else global_text_pool
         self.documents: list[VectorDocument] = []
         self._idf_cache: dict[str, float] = {}
         self._tfidf_cache: list[dict[str, float]] = []
         self._dirty = False  # нужен ли пересчёт IDF
-        self._load()
+        self._persisted_ids: set[str] = set()  # doc_id, уже записанные в ChromaDB
+        self._legacy_ids: list[str] = []  # ID старого формата — удалить при save
+        if load:
+            self._load()
 
     def add_document(self, text: str, tick: int, importance: float = 0.5,
                      is_event: bool = False, speaker: str = "",
@@ -94,7 +110,7 @@ class VectorMemoryLayer:
             return
 
         doc = VectorDocument(
-            text=text.strip()[:300],  # лимит длины документа
+            text=self._text_pool.share(text.strip()[:300]),  # лимит длины документа
             tick=tick,
             importance=importance,
             is_event=is_event,
@@ -236,26 +252,60 @@ class VectorMemoryLayer:
         self._dirty = True
 
     def save(self):
-        """Сохранить документы в ChromaDB."""
-        chroma_storage.save_vector_documents(
-            agent_id=self.agent_id,
-            documents=[asdict(d) for d in self.documents],
-            user_id=self.user_id,
-        )
-
-    def _load(self):
-        """Загрузить документы из ChromaDB."""
+        """Сохранить в ChromaDB только новые документы и удалить вытесненные _prune()."""
+        current_ids = {d.doc_id for d in self.documents}
+        changed = []
+        for d in self.documents:
+            if d.dirty or d.doc_id not in self._persisted_ids:
+                row = asdict(d)
+                row.pop("dirty", None)
+                changed.append(row)
+        deleted = [chroma_storage.vector_doc_id(self.agent_id, did)
+                   for did in self._persisted_ids if did not in current_ids]
+        deleted.extend(self._legacy_ids)
+
+        if changed or deleted:
+            chroma_storage.save_vector_documents(
+                agent_id=self.agent_id,
+                documents=changed,
+                deleted_ids=deleted,
+                user_id=self.user_id,
+            )
+
+        for d in self.documents:
+            d.dirty = False
+        self._persisted_ids = current_ids
+        self._legacy_ids = []
+
+    def mark_unsaved(self):
+        """Считать все документы несохранёнными (см. AgentMemorySystem.mark_unsaved)."""
+        for d in self.documents:
+            d.dirty = True
+        self._persisted_ids = set()
+        self._legacy_ids = []
+
+    def _load(self, docs_data: Optional[list[dict]] = None):
+        """Загрузить документы из ChromaDB (или из уже полученного списка)."""
         try:
-            docs_data = chroma_storage.load_vector_documents(self.agent_id, user_id=self.user_id)
+            if docs_data is None:
+                docs_data = chroma_storage.load_vector_documents(self.agent_id, user_id=self.user_id)
             for doc_dict in docs_data:
-                self.documents.append(VectorDocument(
-                    text=doc_dict["text"],
+                doc = VectorDocument(
+                    text=self._text_pool.share(doc_dict["text"]),
                     tick=doc_dict["tick"],
                     importance=doc_dict.get("importance", 0.5),
                     is_event=doc_dict.get("is_event", False),
                     speaker=doc_dict.get("speaker", ""),
                     speaker_id=doc_dict.get("speaker_id", ""),
-                ))
+                    doc_id=doc_dict.get("doc_id", ""),
+                )
+                if doc_dict.get("legacy_id"):
+                    # Старый формат — получил новый doc_id, пересохраним
+                    self._legacy_ids.append(doc_dict["legacy_id"])
+                else:
+                    doc.dirty = False
+                    self._persisted_ids.add(doc.doc_id)
+                self.documents.append(doc)
             if self.documents:
                 self._dirty = True  # нужен пересчёт индекса
         except Exception: